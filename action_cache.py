@@ -0,0 +1,122 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from ui_tree import screen_signature
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_INTENT = ""
+
+
+def cache_signature(ui_xml, activity=""):
+    # Text is part of the key: two dialogs with the same layout can ask very different questions.
+    # So is the checked state, or a cached tap on a switch could undo what it was meant to do
+    screen = screen_signature(ui_xml, include_text=True, include_state=True)
+    return hashlib.sha1(f"{activity}|{screen}".encode('utf-8')).hexdigest()
+
+
+class ActionCache:
+    """Persistent, size-bounded map from screen signature (and optional task intent) to the actions that worked.
+
+    Entries are stored per intent. When the same screen is resolved with the same actions under
+    ``promote_after`` different intents, the entry is promoted to a global one that matches any task.
+    The least recently used entries are evicted beyond ``max_entries``. The agent only stores the actions of
+    tasks that completed.
+    """
+
+    def __init__(self, path, max_entries=2000, promote_after=2):
+        self.path = path
+        self.max_entries = max_entries
+        self.promote_after = promote_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                signature TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                actions TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (signature, intent)
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL);
+        """)
+        self._db.commit()
+
+    def lookup(self, signature, intent=GLOBAL_INTENT):
+        """Return the cached actions for the screen, preferring an entry for this intent over a global one."""
+        now = time.time()
+        with self._lock:
+            self._bump("lookups", 1)
+            row = None
+            for key in dict.fromkeys((intent, GLOBAL_INTENT)):
+                row = self._db.execute("SELECT actions FROM entries WHERE signature = ? AND intent = ?",
+                                       (signature, key)).fetchone()
+                if row:
+                    self._db.execute("UPDATE entries SET hits = hits + 1, last_used = ? WHERE signature = ? AND intent = ?",
+                                     (now, signature, key))
+                    self._bump("hits", 1)
+                    break
+            self._db.commit()
+        return json.loads(row[0]) if row else None
+
+    def store(self, signature, actions, intent=GLOBAL_INTENT):
+        now = time.time()
+        actions_json = json.dumps(actions, sort_keys=True)
+        with self._lock:
+            self._upsert(signature, intent, actions_json, now)
+            if intent != GLOBAL_INTENT:
+                agreeing = self._db.execute(
+                    "SELECT COUNT(DISTINCT intent) FROM entries WHERE signature = ? AND intent != ? AND actions = ?",
+                    (signature, GLOBAL_INTENT, actions_json)).fetchone()[0]
+                if agreeing >= self.promote_after:
+                    self._upsert(signature, GLOBAL_INTENT, actions_json, now)
+            self._evict()
+            self._db.commit()
+
+    def _upsert(self, signature, intent, actions_json, now):
+        self._db.execute("""
+            INSERT INTO entries (signature, intent, actions, created, last_used) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (signature, intent) DO UPDATE SET actions = excluded.actions, last_used = excluded.last_used
+        """, (signature, intent, actions_json, now, now))
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute("""
+                DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY last_used LIMIT ?)
+            """, (count - self.max_entries,))
+
+    def record_saved_latency(self, seconds):
+        with self._lock:
+            self._bump("latency_saved_seconds", seconds)
+            self._db.commit()
+
+    def _bump(self, name, amount):
+        self._db.execute("""
+            INSERT INTO stats (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+        """, (name, amount))
+
+    def stats(self):
+        with self._lock:
+            values = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = int(values.get("lookups", 0))
+        hits = int(values.get("hits", 0))
+        return {
+            "entries": entries,
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(values.get("latency_saved_seconds", 0.0), 2)
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
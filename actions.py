@@ -0,0 +1,171 @@
+import shlex
+import subprocess
+import time
+import logging
+from text_entry import TextEntry, is_broadcast_output
+
+logger = logging.getLogger(__name__)
+
+KEY_MAPPING = {
+    "home": "KEYCODE_HOME",
+    "back": "KEYCODE_BACK",
+    "menu": "KEYCODE_MENU",
+    "power": "KEYCODE_POWER",
+    "volume_up": "KEYCODE_VOLUME_UP",
+    "volume_down": "KEYCODE_VOLUME_DOWN",
+    "enter": "KEYCODE_ENTER",
+    "delete": "KEYCODE_DEL"
+}
+
+# Tools that only inject input events and don't need an observation in between,
+# so consecutive calls can be compiled into a single on-device shell script.
+BATCHABLE_TOOLS = {"tap", "swipe", "input_text", "press_key", "long_press"}
+
+DEFAULT_ACTION_DELAY_MS = 500
+
+_ACTION_MARKER = "__PHONE_AGENT_ACTION__"
+
+# Shared so the active input method is only looked up once per TTL
+TEXT_ENTRY = TextEntry()
+
+
+class ToolExecutionError(Exception):
+    def __init__(self, tool_names, detail):
+        super().__init__(f"Error executing {tool_names}: {detail}")
+        self.tool_names = tool_names
+
+
+class RejectedAction(str):
+    """Result of an action that could not be turned into a device command and was never sent.
+
+    Still a result string, so batches carry on; the agent reports it to the model as an error.
+    """
+
+
+def _reject(name, error):
+    logger.warning(f"Rejected {name}: {str(error)}")
+    return RejectedAction(f"{name} was not executed: {str(error)}")
+
+
+def build_action_command(name, params):
+    if name == "tap":
+        return ['input', 'tap', str(params["x"]), str(params["y"])]
+    elif name == "swipe":
+        return ['input', 'swipe',
+                str(params["start_x"]), str(params["start_y"]),
+                str(params["end_x"]), str(params["end_y"]),
+                str(params.get("duration", 300))]
+    elif name == "press_key":
+        return ['input', 'keyevent', KEY_MAPPING[params["key"]]]
+    elif name == "long_press":
+        return ['input', 'swipe',
+                str(params["x"]), str(params["y"]),
+                str(params["x"]), str(params["y"]),
+                str(params.get("duration", 1000))]
+    raise ValueError(f"Unknown tool: {name}")
+
+
+def build_action_script(name, params, text_entry=None):
+    """The action as one line for the device shell; text entry may expand to several chained commands."""
+    if name == "input_text":
+        return (text_entry or TEXT_ENTRY).script(params["text"])
+    return ' '.join(shlex.quote(arg) for arg in build_action_command(name, params))
+
+
+def describe_action(name, params):
+    if name == "tap":
+        return f"Successfully tapped at coordinates ({params['x']}, {params['y']})"
+    elif name == "swipe":
+        return f"Swiped from ({params['start_x']}, {params['start_y']}) to ({params['end_x']}, {params['end_y']})"
+    elif name == "input_text":
+        return f"Input text: {params['text']}"
+    elif name == "press_key":
+        return f"Pressed key: {params['key']}"
+    elif name == "long_press":
+        return f"Long pressed at ({params['x']}, {params['y']}) for {params.get('duration', 1000)}ms"
+    raise ValueError(f"Unknown tool: {name}")
+
+
+def execute_action(name, params):
+    # Passed as a single quoted script so the device shell never re-splits text or sees its metacharacters
+    try:
+        script = build_action_script(name, params)
+    except ValueError as e:
+        return _reject(name, e)
+    try:
+        process = subprocess.run(['adb', 'shell', script], capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Failed to execute {name} command: {str(e)}")
+    if process.stderr:
+        raise Exception(f"ADB error: {process.stderr}")
+    if name == "tap":
+        # Add small delay to ensure tap is registered
+        time.sleep(DEFAULT_ACTION_DELAY_MS / 1000)
+    return describe_action(name, params)
+
+
+def build_batch_script(commands):
+    """One device script for (command, delay_ms) pairs, as built by ``build_action_script``."""
+    lines = []
+    for index, (command, delay_ms) in enumerate(commands):
+        # Stop at the first failing action so later input isn't sent to an unexpected screen
+        lines.append(f'{{ {command}; }} 2>&1; rc=$?; echo "{_ACTION_MARKER} {index} $rc"; [ $rc -eq 0 ] || exit $rc')
+        if delay_ms and index < len(commands) - 1:
+            lines.append(f'sleep {delay_ms / 1000:g}')
+    return '\n'.join(lines)
+
+
+def parse_batch_output(output, count):
+    statuses = [None] * count
+    errors = [''] * count
+    buffer = []
+    for line in output.splitlines():
+        if line.startswith(_ACTION_MARKER):
+            _, index, rc = line.split()
+            index = int(index)
+            statuses[index] = int(rc)
+            errors[index] = '\n'.join(buffer).strip()
+            buffer = []
+        elif line.strip() and not is_broadcast_output(line):
+            # `input` can print an error and still exit 0, so other output fails the action
+            buffer.append(line)
+    return statuses, errors
+
+
+def execute_batch(actions):
+    """Run (name, params, delay_ms) actions in one adb round trip and return a result per action.
+
+    Actions that can't be built, like non-ASCII text without the ADB Keyboard IME, are left out of the
+    script and get a RejectedAction result; the others still run.
+    """
+    if not actions:
+        return []
+    rejected = {}
+    runnable = []
+    commands = []
+    for index, (name, params, delay_ms) in enumerate(actions):
+        try:
+            commands.append((build_action_script(name, params), delay_ms))
+        except ValueError as e:
+            rejected[index] = _reject(name, e)
+            continue
+        runnable.append((name, params))
+    statuses, errors = [], []
+    if commands:
+        logger.debug(f"Executing batch of {len(commands)} actions")
+        process = subprocess.run(['adb', 'shell', build_batch_script(commands)], capture_output=True, text=True)
+        statuses, errors = parse_batch_output(process.stdout, len(commands))
+
+    results = []
+    completed = iter(zip(runnable, statuses, errors))
+    for index in range(len(actions)):
+        if index in rejected:
+            results.append(rejected[index])
+            continue
+        (name, params), status, error = next(completed)
+        if status is None:
+            raise Exception(f"Batch aborted before {name} ran. Completed: {results}. ADB output: {process.stderr.strip()}")
+        if status != 0 or error:
+            raise Exception(f"Error during {name} operation: {error or f'exit code {status}'}. Completed: {results}")
+        results.append(describe_action(name, params))
+    return results
@@ -1,131 +1,198 @@
-import anthropic
 import time
 import logging
-import subprocess
-import base64
 from constants import SYSTEM_PROMPT, TOOLS
-from screen import capture_screenshot, move_cursor, click_cursor, get_screen_dimensions
+from screen import move_cursor, click_cursor, png_size
+from device import AdbDevice
+from pipeline import StepScheduler, StageTimings
+from conversation_store import ConversationStore
+from journal import StepJournal, JournalReader, load_checkpoint
+from actions import BATCHABLE_TOOLS, DEFAULT_ACTION_DELAY_MS, ToolExecutionError, RejectedAction
+from macros import MacroLibrary, MacroPlayer, MacroRecorder, task_key
+from action_cache import cache_signature
+from ui_tree import screen_signature
+from model_client import RoutedClient, client_from_environment
+from zoom import OVERVIEW_LONG_SIDE, overview, crop_region, describe_crop
+from frame_diff import FULL_FRAME_EVERY, FrameDiff
 from anthropic.types import (
+    Message,
     MessageParam,
     TextBlockParam,
-    ImageBlockParam,
     ToolResultBlockParam,
     ToolUseBlock
 )
 
+
+def resume_signature(ui_xml):
+    # Exact text, digits included: a checkpointed response is only replayed on the very screen it was chosen for
+    return screen_signature(ui_xml, include_text=True, mask_digits=False, include_state=True) if ui_xml else None
+
+
 class PhoneMirroringAgent:
-    def __init__(self, api_key, model, max_tokens, temperature, max_messages, device_type="android"):
+    def __init__(self, api_key, model, max_tokens, temperature, max_messages, device_type="android",
+                 frame_grabber=None, max_history_images=None, journal_dir=None, macro_dir=None,
+                 replay_macros=False, action_cache=None, client=None, device=None, grounder=None,
+                 overview_long_side=OVERVIEW_LONG_SIDE, full_frame_every=FULL_FRAME_EVERY, metrics=None):
         self.logger = logging.getLogger(__name__)
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # Any ModelClient works here: cassette replay and scripted clients run without network access.
+        # By default Bedrock and Vertex AI are added as failover providers when they are configured.
+        self.client = client or client_from_environment(api_key)
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.max_messages = max_messages
-        self.conversation: list[MessageParam] = []
+        self.conversation = ConversationStore()
+        # Only the most recent screenshots are sent to the API; None keeps them all
+        self.max_history_images = max_history_images
+        # Screenshots go out scaled down to this long side (None sends them as captured); the model
+        # asks for detail with the zoom tool, which crops last_frame
+        self.overview_long_side = overview_long_side
+        self.last_frame = None
+        # When only part of the screen changed, just that part is sent; a full frame goes out at least every
+        # full_frame_every screenshots (None sends every screenshot in full)
+        self.frame_diff = FrameDiff(full_frame_every, max_history_images) if full_frame_every else None
         self.task_description = ""
+        self.journal_dir = journal_dir
+        self.journal = None
+        self.step = 0
+        self.usage = {"input_tokens": 0, "output_tokens": 0}
+        # State of the last step, re-written with the final status when the task ends
+        self._checkpoint = None
+        self._resume_from = None
+        self.macro_library = MacroLibrary(macro_dir) if macro_dir else None
+        self.replay_macros = replay_macros
+        self.macro_recorder = None
+        self.action_cache = action_cache
+        self.cache_signature = None
+        self._pending_cache_entry = None
+        # (signature, actions) that moved this task past a screen; stored only if the task succeeds
+        self._cache_entries = []
+        self._model_latency = None
+        # Optional VisionGrounder: detects elements in the screenshot when the UI dump is sparse
+        self.grounder = grounder
+        # Called with (name, params) for every input action sent to the device, e.g. by the GUI preview
+        self.action_listeners = []
         self.cursor_position = (0, 0)
         self._is_paused = False
         self._is_cancelled = False
         self.update_status = None
         self.device_type = device_type
-        
-        # 默认分辨率
-        width = 1080
-        height = 1920
-        
-        # 获取初始截图以确定屏幕分辨率
-        screenshot_data, cursor_position, ui_xml = capture_screenshot(device_type)
-        if screenshot_data:
-            width, height = get_screen_dimensions(device_type)
-        
-        # 设置系统提示
-        self.system_prompt = SYSTEM_PROMPT.format(
-            device_type=device_type.capitalize(),
+        self.device = device or AdbDevice(device_type)
+        self.frame_grabber = frame_grabber
+        self.scheduler = StepScheduler(device_type, frame_grabber=frame_grabber, device=self.device)
+        # Built from the first captured frame; constructing the agent never touches the device
+        self.system_prompt = None
+        # Optional metrics.AgentMetrics for the fleet's /metrics endpoint
+        self.metrics = metrics
+
+        self.logger.info(f"PhoneMirroringAgent initialized for {device_type} device")
+
+    @classmethod
+    def from_checkpoint(cls, run_dir, api_key, **kwargs):
+        """An agent that continues the task checkpointed in ``run_dir`` when run, instead of starting over."""
+        checkpoint = load_checkpoint(run_dir)
+        if checkpoint is None:
+            raise Exception(f"No checkpoint found in {run_dir}")
+        agent = cls(api_key, checkpoint["model"], checkpoint["max_tokens"], checkpoint["temperature"],
+                    checkpoint["max_messages"], journal_dir=run_dir, **kwargs)
+        agent.task_description = checkpoint["task"]
+        agent._resume_from = checkpoint
+        return agent
+
+    def build_system_prompt(self):
+        try:
+            width, height = self.scheduler.screen_size or self.device.screen_dimensions()
+        except Exception as e:
+            self.logger.error(f"Error getting screen dimensions: {str(e)}")
+            width, height = 1080, 1920
+        self.logger.info(f"Screen resolution {width}x{height}")
+        return SYSTEM_PROMPT.format(
+            device_type=self.device_type.capitalize(),
             width=width,
             height=height
         )
-        
-        self.logger.info(f"PhoneMirroringAgent initialized for {device_type} device with resolution {width}x{height}")
 
-    def capture_screenshot(self):
+    def capture_screenshot(self, timings=None):
         try:
-            screenshot_data, cursor_position, ui_xml = capture_screenshot(self.device_type)
-            self.cursor_position = cursor_position
-            self.logger.debug(f"Screenshot captured. Cursor position: {cursor_position}")
-            return screenshot_data, cursor_position, ui_xml
+            observation = self.scheduler.observe(timings)
+            self.cursor_position = observation.cursor_position
+            self.logger.debug(f"Screenshot captured. Cursor position: {observation.cursor_position}")
+            return observation.png, observation.cursor_position, observation.ui_xml
         except Exception as e:
             self.logger.error(f"Error capturing screenshot: {str(e)}")
+            if self.metrics is not None:
+                self.metrics.adb_error("capture")
             return None, None, None
 
-    def send_to_claude(self, screenshot_data, cursor_position, ui_xml=None, tool_results=None):
+    def send_to_claude(self, screenshot_png, cursor_position, ui_xml=None, tool_results=None, note=None,
+                       detected=None, regions=None):
         if len(self.conversation) >= self.max_messages:
             error_message = f"Conversation exceeded maximum length of {self.max_messages} messages. Exiting task as failed."
             self.task_completed(False, error_message)
             self.logger.warning(error_message)
             return None
 
-        # 验证图片数据格式
-        try:
-            # 检查base64数据是否有效
-            base64.b64decode(screenshot_data)
-        except Exception as e:
-            self.logger.error(f"Invalid base64 image data: {str(e)}")
-            return None
-
         content = []
-        
-        if tool_results:
+        if screenshot_png is None and tool_results:
+            # Only zoom was used, so the screen is as last sent
             content.extend(tool_results)
-            screenshot_message = f"Here's the latest screenshot after running the tool(s) for the task: {self.task_description}"
+            content.append(TextBlockParam(
+                type="text",
+                text=f"Nothing was done on the device; the screen is unchanged. Continue the task: {self.task_description}"
+            ))
+            ui_xml = None
+        # 验证图片数据格式
+        elif not screenshot_png or not screenshot_png.startswith(b'\x89PNG'):
+            self.logger.error("Invalid screenshot data: not a PNG image")
+            return None
         else:
-            screenshot_message = f"Here's the initial screenshot for the task: {self.task_description}"
+            if tool_results:
+                content.extend(tool_results)
+                screenshot_message = f"Here's the latest screenshot after running the tool(s) for the task: {self.task_description}"
+            else:
+                screenshot_message = f"Here's the initial screenshot for the task: {self.task_description}"
+            if note:
+                screenshot_message = f"{note}\n{screenshot_message}"
+            self.last_frame = screenshot_png
+            if regions is not None:
+                content.extend(self.region_blocks(screenshot_png, screenshot_message, regions))
+            else:
+                image_png, scale = overview(screenshot_png, self.overview_long_side)
+                if scale < 1.0:
+                    width, height = png_size(screenshot_png)
+                    screenshot_message += (f"\nThe screenshot is scaled to {scale:.2f}x of the {width}x{height} screen; "
+                                           "give coordinates in screen pixels and use zoom for fine detail.")
+
+                # 确保图片格式正确
+                content.extend([
+                    TextBlockParam(
+                        type="text",
+                        text=f"{screenshot_message}\nPlease analyze the image and UI structure to suggest the next action."
+                    ),
+                    self.conversation.image_block(image_png, "image/png")
+                ])
 
-        # 确保图片格式正确
-        content.extend([
-            TextBlockParam(
-                type="text",
-                text=f"{screenshot_message}\nPlease analyze the image and UI structure to suggest the next action."
-            ),
-            ImageBlockParam(
-                type="image",
-                source={
-                    "type": "base64",
-                    "media_type": "image/png",  # 改为 image/png
-                    "data": screenshot_data
-                }
-            )
-        ])
-        
         if ui_xml:
             content.append(TextBlockParam(
                 type="text",
                 text=f"UI XML Structure:\n{ui_xml}"
             ))
+        if detected:
+            content.append(TextBlockParam(type="text", text=detected))
 
         message = MessageParam(role="user", content=content)
         
-        self.conversation.append(message)
+        # The journal keeps the captured frame too: the model may only have seen a scaled copy
+        self.append_message(message, screenshot_png)
         self.logger.info(f"Sent {'tool results and ' if tool_results else ''}screenshot for analysis. Cursor position: {cursor_position}")
 
         try:
-            # Log request parameters
-            request_params = {
-                "model": self.model,
-                "max_tokens": self.max_tokens,
-                "temperature": self.temperature,
-                "system": self.system_prompt,
-                "tools": TOOLS,
-                "messages": self.conversation
-            }
-           # self.logger.info(f"Sending request to Claude with parameters: {request_params}")
-            
-            response = self.client.messages.create(
+            response = self.client.create_message(
                 model=self.model,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
                 system=self.system_prompt,
                 tools=TOOLS,
-                messages=self.conversation
+                messages=self.conversation.to_api_messages(self.max_history_images)
             )
             self.logger.info("Received response from Claude")
             return response
@@ -133,20 +200,521 @@ class PhoneMirroringAgent:
             self.logger.error(f"Error communicating with Claude: {str(e)}")
             return None
 
+    def region_blocks(self, screenshot_png, screenshot_message, regions):
+        """Content for a screenshot of which only ``regions`` changed since the previous one: each region
+        cropped at the overview's scale, preceded by its bounds in screen pixels."""
+        if not regions:
+            return [TextBlockParam(
+                type="text",
+                text=f"{screenshot_message}\nThe screen has not changed since the previous screenshot. "
+                     "Please analyze the UI structure to suggest the next action."
+            )]
+        width, height = png_size(screenshot_png)
+        scale = min(1.0, self.overview_long_side / max(width, height)) if self.overview_long_side else 1.0
+        scaled = f", scaled to {scale:.2f}x" if scale < 1.0 else ""
+        blocks = [TextBlockParam(
+            type="text",
+            text=f"{screenshot_message}\nOnly part of the {width}x{height} screen changed since the previous "
+                 f"screenshot, so only the changed regions are attached{scaled}; the rest of the screen is as "
+                 "previously shown. Give coordinates in screen pixels.\n"
+                 "Please analyze the images and UI structure to suggest the next action."
+        )]
+        for left, top, right, bottom in regions:
+            blocks.append(TextBlockParam(type="text", text=f"Changed region [{left},{top}][{right},{bottom}]:"))
+            blocks.append(self.conversation.image_block(self.frame_diff.crop((left, top, right, bottom), scale),
+                                                        "image/png", (left, top, right, bottom)))
+        self.logger.info(f"Sending {len(regions)} changed region(s) instead of the full screenshot: {regions}")
+        return blocks
+
+    def append_message(self, message, frame=None):
+        self.conversation.append(message)
+        if self.journal is not None:
+            self.journal.record_message(self.conversation[-1], self.conversation, frame)
+
+    def record_event(self, event, **fields):
+        if self.journal is not None:
+            self.journal.record(event, **fields)
+
+    def record_step(self, response, timings):
+        self.logger.info(f"Step timings: {timings.summary()}",
+                         extra={"fields": {"event": "step", "step": self.step, "timings": timings.durations()}})
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.usage["input_tokens"] += usage.input_tokens
+            self.usage["output_tokens"] += usage.output_tokens
+        if self.metrics is not None:
+            self.metrics.step(timings.durations(), response is not None)
+        if self.journal is None:
+            return
+        self.journal.record(
+            "step",
+            step=self.step,
+            tool_calls=[{"id": block.id, "name": block.name, "input": block.input}
+                        for block in getattr(response, "content", []) if isinstance(block, ToolUseBlock)],
+            stop_reason=getattr(response, "stop_reason", None),
+            usage=usage.model_dump() if usage is not None else None,
+            timings=timings.durations()
+        )
+
+    def checkpoint(self, pending, ui_xml):
+        """Save what's needed to pick the task up after this step: the conversation, the response about to
+        be executed and a signature of the screen it was chosen on. Written atomically by the journal thread."""
+        if self.journal is None:
+            return
+        self._checkpoint = {
+            "version": 1,
+            "task": self.task_description,
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "max_messages": self.max_messages,
+            "system_prompt": self.system_prompt,
+            "step": self.step,
+            "usage": dict(self.usage),
+            "signature": resume_signature(ui_xml),
+            "pending": pending.model_dump(mode="json") if pending is not None else None,
+            "messages": list(self.journal.messages),
+            "status": "running",
+            "time": time.time(),
+        }
+        self.journal.checkpoint(self._checkpoint)
+
+    def execute_tool(self, tool_use):
+        if tool_use.name == "move_cursor":
+            return move_cursor(tool_use.input["direction"], tool_use.input["distance"])
+        elif tool_use.name == "click_cursor":
+            return click_cursor()
+        elif tool_use.name == "batch":
+            actions = []
+            for action in tool_use.input["actions"]:
+                if action["name"] not in BATCHABLE_TOOLS:
+                    raise ValueError(f"Tool {action['name']} cannot be used in a batch")
+                actions.append((action["name"], action.get("input", {}),
+                                action.get("delay_ms", DEFAULT_ACTION_DELAY_MS)))
+            self.notify_actions((name, params) for name, params, _ in actions)
+            results = self.device.execute_batch(actions)
+            return "\n".join(f"{i + 1}. {r}" for i, r in enumerate(results))
+        raise ValueError(f"Unknown tool: {tool_use.name}")
+
+    def notify_actions(self, actions):
+        if not self.action_listeners:
+            return
+        for name, params in actions:
+            for listener in self.action_listeners:
+                try:
+                    listener(name, params)
+                except Exception as e:
+                    self.logger.debug(f"Action listener failed: {str(e)}")
+
+    def execute_actions(self, tool_uses, tool_results, timings):
+        if not tool_uses:
+            return
+        names = ", ".join(tool_use.name for tool_use in tool_uses)
+        try:
+            self.update_status(f"Executing {names}...")
+            self.notify_actions((tool_use.name, tool_use.input) for tool_use in tool_uses)
+            with timings.stage("action"):
+                self.scheduler.action_sent(timings)
+                if len(tool_uses) == 1:
+                    results = [self.device.execute_action(tool_uses[0].name, tool_uses[0].input)]
+                else:
+                    # Consecutive input actions run in one adb round trip, followed by a single capture
+                    results = self.device.execute_batch([
+                        (tool_use.name, tool_use.input, DEFAULT_ACTION_DELAY_MS) for tool_use in tool_uses
+                    ])
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.adb_error("action")
+            raise ToolExecutionError(names, str(e))
+
+        for tool_use, result in zip(tool_uses, results):
+            tool_result = ToolResultBlockParam(
+                type="tool_result",
+                tool_use_id=tool_use.id,
+                content=[TextBlockParam(type="text", text=f"{result}")]
+            )
+            if isinstance(result, RejectedAction):
+                # Nothing was sent for this action; the rest of the batch ran
+                tool_result["is_error"] = True
+            tool_results.append(tool_result)
+            self.logger.info(f"Executed {tool_use.name}: {result}")
+
+    def execute_tool_uses(self, tool_uses, timings):
+        """Run tool calls in order; returns the tool results and the done tool use, if one was reached."""
+        tool_results = []
+        pending_actions = []
+        for tool_use in tool_uses:
+            if tool_use.name in BATCHABLE_TOOLS:
+                pending_actions.append(tool_use)
+                continue
+
+            self.execute_actions(pending_actions, tool_results, timings)
+            pending_actions = []
+
+            if tool_use.name == "done":
+                return tool_results, tool_use
+            if tool_use.name == "zoom":
+                tool_results.append(self.zoom(tool_use))
+                continue
+
+            try:
+                self.update_status(f"Executing {tool_use.name}...")
+                with timings.stage("action"):
+                    self.scheduler.action_sent(timings)
+                    result = self.execute_tool(tool_use)
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.adb_error("action")
+                raise ToolExecutionError(tool_use.name, str(e))
+
+            tool_results.append(ToolResultBlockParam(
+                type="tool_result",
+                tool_use_id=tool_use.id,
+                content=[TextBlockParam(type="text", text=f"{result}")]
+            ))
+            self.logger.info(f"Executed {tool_use.name}: {result}")
+
+        self.execute_actions(pending_actions, tool_results, timings)
+        return tool_results, None
+
+    def zoom(self, tool_use):
+        """Answer a zoom call with a crop of the frame the model last saw; no device round trip.
+
+        A region that can't be cropped is reported back as an error result instead of ending the task.
+        """
+        if self.last_frame is None:
+            return ToolResultBlockParam(type="tool_result", tool_use_id=tool_use.id, is_error=True,
+                                        content=[TextBlockParam(type="text", text="No screenshot to zoom into yet")])
+        params = tool_use.input
+        try:
+            png, bounds, scale = crop_region(self.last_frame, params["x"], params["y"], params["width"],
+                                             params["height"])
+        except Exception as e:
+            self.logger.warning(f"Zoom failed for {params}: {str(e)}")
+            return ToolResultBlockParam(type="tool_result", tool_use_id=tool_use.id, is_error=True, content=[
+                TextBlockParam(type="text", text=f"Invalid zoom region {params}: {str(e)}")])
+        self.logger.info(f"Zoomed into {bounds} at {scale:.2f}x")
+        return ToolResultBlockParam(type="tool_result", tool_use_id=tool_use.id, content=[
+            TextBlockParam(type="text", text=describe_crop(bounds, scale)),
+            self.conversation.image_block(png, "image/png")])
+
+    def request_next_action(self, screenshot_png, cursor_position, ui_xml, tool_results, timings, note=None):
+        # Keep a fresh frame ready while the model is thinking so a no-tool turn doesn't re-send a stale one
+        detected = None
+        if self.grounder is not None:
+            with timings.stage("grounding"):
+                detected = self.grounder.describe(screenshot_png, ui_xml)
+        regions = None
+        if self.frame_diff is not None:
+            tool_images = sum(self.conversation.image_count(block) for block in tool_results or [])
+            if screenshot_png is None:
+                self.frame_diff.add_images(tool_images)
+            elif screenshot_png.startswith(b'\x89PNG'):
+                with timings.stage("frame_diff"):
+                    regions = self.frame_diff.changes(screenshot_png, tool_images)
+        started = time.perf_counter()
+        with self.scheduler.refreshing(timings), timings.stage("model"):
+            response = self.send_to_claude(screenshot_png, cursor_position, ui_xml, tool_results, note, detected,
+                                           regions)
+        if self.metrics is not None:
+            self.metrics.model_call(response)
+        if response is not None:
+            elapsed = time.perf_counter() - started
+            self._model_latency = elapsed if self._model_latency is None else 0.8 * self._model_latency + 0.2 * elapsed
+        return response
+
+    def remember_actions(self, tool_uses):
+        # Cached only once the next observation shows the actions changed the screen
+        if self.action_cache is None or self.cache_signature is None:
+            return
+        actions = [{"name": tool_use.name, "input": tool_use.input} for tool_use in tool_uses
+                   if tool_use.name not in ("done", "zoom")]
+        self._pending_cache_entry = (self.cache_signature, actions) if actions else None
+
+    def commit_cache_entries(self):
+        # A screen changing only shows the actions did something; the task succeeding shows they were right
+        entries, self._cache_entries = self._cache_entries, []
+        if self.action_cache is None or not entries:
+            return
+        intent = task_key(self.task_description)
+        for signature, actions in entries:
+            self.action_cache.store(signature, actions, intent)
+        self.logger.info(f"Stored {len(entries)} screens in the action cache")
+
+    def apply_cached_actions(self, screenshot_png, cursor_position, ui_xml, timings, max_steps=5):
+        """Resolve known screens locally from the action cache instead of asking the model.
+
+        Returns the latest observation and a note describing what was done, if anything.
+        """
+        if self.action_cache is None:
+            return screenshot_png, cursor_position, ui_xml, None
+        intent = task_key(self.task_description)
+        signature = cache_signature(ui_xml, self.device.foreground_activity())
+        if self._pending_cache_entry is not None:
+            previous_signature, actions = self._pending_cache_entry
+            if signature != previous_signature:
+                self._cache_entries.append((previous_signature, actions))
+            self._pending_cache_entry = None
+
+        resolved = []
+        seen = set()
+        while len(seen) < max_steps and signature not in seen and not self._is_cancelled:
+            seen.add(signature)
+            actions = self.action_cache.lookup(signature, intent)
+            if not actions:
+                break
+            tool_uses = [ToolUseBlock(type="tool_use", id=f"cached_{len(resolved)}_{i}", name=action["name"],
+                                      input=action["input"])
+                         for i, action in enumerate(actions)]
+            self.update_status("Resolving known screen from cache...")
+            try:
+                tool_results, _ = self.execute_tool_uses(tool_uses, timings)
+            except ToolExecutionError as e:
+                self.logger.warning(f"Cached actions failed: {str(e)}")
+                break
+            if self.macro_recorder is not None:
+                self.macro_recorder.record_step(ui_xml, tool_uses)
+            resolved.extend(f"{tool_use.name} {tool_use.input}: {result['content'][0]['text']}"
+                            for tool_use, result in zip(tool_uses, tool_results))
+            self.action_cache.record_saved_latency(self._model_latency or 0.0)
+            if self.metrics is not None:
+                self.metrics.cache_hit()
+            self.record_event("cache_hit", signature=signature, actions=actions)
+            self.logger.info(f"Resolved screen {signature[:12]} from the action cache: {actions}")
+
+            screenshot_png, cursor_position, ui_xml = self.capture_screenshot(timings)
+            if screenshot_png is None:
+                return None, None, None, None
+            signature = cache_signature(ui_xml, self.device.foreground_activity())
+
+        self.cache_signature = signature
+        if not resolved:
+            return screenshot_png, cursor_position, ui_xml, None
+        note = ("These actions were applied automatically because the screen matched a known one:\n" +
+                "\n".join(f"{i + 1}. {action}" for i, action in enumerate(resolved)))
+        return screenshot_png, cursor_position, ui_xml, note
+
+    def replay_macro(self, macro, screenshot_png, cursor_position, ui_xml):
+        """Re-execute a recorded macro while the live screen matches it.
+
+        Returns whether the macro ran to its recorded end, the latest observation and a description of
+        the replayed actions.
+        """
+        player = MacroPlayer(macro)
+        replayed = []
+        self.logger.info(f"Replaying macro with {len(macro['steps'])} steps")
+        while not self._is_cancelled and not player.finished:
+            while self._is_paused and not self._is_cancelled:
+                time.sleep(0.1)
+            step = player.match(ui_xml)
+            if step is None:
+                break
+            self.update_status(f"Replaying recorded step {player.index}/{len(macro['steps'])}...")
+            tool_uses = player.tool_uses(step)
+            timings = StageTimings()
+            try:
+                tool_results, _ = self.execute_tool_uses(tool_uses, timings)
+            except ToolExecutionError as e:
+                self.logger.warning(f"Macro replay stopped: {str(e)}")
+                break
+            if self.macro_recorder is not None:
+                self.macro_recorder.record_step(ui_xml, tool_uses)
+            replayed.extend(f"{tool_use.name} {tool_use.input}: {result['content'][0]['text']}"
+                            for tool_use, result in zip(tool_uses, tool_results))
+            screenshot_png, cursor_position, ui_xml = self.capture_screenshot(timings)
+            self.record_event("replay_step", step=player.index, actions=step["actions"], timings=timings.durations())
+            self.logger.info(f"Replay step timings: {timings.summary()}")
+            if screenshot_png is None:
+                break
+        finished = player.finished and screenshot_png is not None and player.matches_final(ui_xml)
+        return finished, (screenshot_png, cursor_position, ui_xml), replayed
+
+    def finish_with_done(self, done, ui_xml):
+        status = done.input["status"]
+        reason = done.input["reason"]
+        if status == "completed":
+            if self.macro_recorder is not None and self.macro_recorder.steps:
+                try:
+                    self.macro_library.save(self.macro_recorder.build(ui_xml, reason))
+                except OSError as e:
+                    self.logger.warning(f"Could not save macro: {str(e)}")
+            self.task_completed(True, reason)
+        else:
+            self.task_completed(False, reason)
+        self.logger.info(f"Task {status}. Reason: {reason}")
+
     def run(self, task_completed, update_status):
-        self.task_completed = task_completed
+        if self.frame_grabber is not None:
+            self.frame_grabber.start()
+        checkpoint, self._resume_from = self._resume_from, None
+        if self.frame_diff is not None:
+            self.frame_diff.reset()
+        if self.journal_dir:
+            self.journal = StepJournal(self.journal_dir, checkpoint["messages"] if checkpoint else None)
+        if self.metrics is not None:
+            self.metrics.watch(self.journal, self.client)
+            self.metrics.set_state("running")
+        try:
+            if checkpoint is not None:
+                self._resume_run(checkpoint, task_completed, update_status)
+            else:
+                self._run(task_completed, update_status)
+        finally:
+            self.scheduler.shutdown()
+            if self.frame_grabber is not None:
+                self.frame_grabber.stop()
+            if self.action_cache is not None:
+                stats = self.action_cache.stats()
+                self.logger.info(f"Action cache stats: {stats}")
+                self.record_event("cache_stats", **stats)
+            if isinstance(self.client, RoutedClient):
+                stats = self.client.stats()
+                self.logger.info(f"Model provider stats: {stats}")
+                self.record_event("provider_stats", providers=stats)
+            if self.grounder is not None:
+                stats = self.grounder.stats()
+                self.logger.info(f"Vision grounding stats: {stats}")
+                self.record_event("grounding_stats", **stats)
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if self.metrics is not None:
+                self.metrics.watch(None)
+                self.metrics.set_state("idle")
+
+    def _set_callbacks(self, task_completed, update_status):
+        finished = []
+        self._pending_cache_entry = None
+        self._cache_entries = []
+
+        # ``interrupted`` marks a stop caused by the device or the API rather than by the task itself; only
+        # those runs, and ones that never got this far, are offered for resume
+        def finish(success, reason, interrupted=False):
+            if finished:
+                # e.g. the conversation limit, reported again when the request it blocked comes back empty
+                return
+            finished.append(reason)
+            if success:
+                self.commit_cache_entries()
+                status = "completed"
+            elif self._is_cancelled:
+                status = "cancelled"
+            else:
+                status = "interrupted" if interrupted else "failed"
+            self.record_event("task_finished", success=success, status=status, reason=reason, steps=self.step)
+            if self.metrics is not None:
+                self.metrics.task_finished(status)
+            if self.journal is not None and self._checkpoint is not None:
+                self.journal.checkpoint({**self._checkpoint, "status": status, "reason": reason, "time": time.time()})
+            task_completed(success, reason)
+
+        self.task_completed = finish
         self.update_status = update_status
 
+    def _run(self, task_completed, update_status):
+        self._set_callbacks(task_completed, update_status)
+
         self.logger.info(f"Starting task: {self.task_description}")
         self.update_status("Capturing initial screenshot...")
-        screenshot_data, cursor_position, ui_xml = self.capture_screenshot()
-        if screenshot_data is None:
-            self.task_completed(False, "Screenshot capture failed")
+        timings = StageTimings()
+        # The first observation of the task also provides the resolution for the system prompt
+        screenshot_png, cursor_position, ui_xml = self.capture_screenshot(timings)
+        if self.system_prompt is None:
+            self.system_prompt = self.build_system_prompt()
+        self.record_event("task_started", task=self.task_description, model=self.model,
+                          max_tokens=self.max_tokens, temperature=self.temperature,
+                          max_messages=self.max_messages, system_prompt=self.system_prompt)
+        if screenshot_png is None:
+            self.task_completed(False, "Screenshot capture failed", interrupted=True)
             self.logger.error("Failed to capture screenshot. Exiting task.")
             return
+
+        note = None
+        if self.macro_library is not None:
+            self.macro_recorder = MacroRecorder(self.task_description)
+            macro = self.macro_library.load(self.task_description) if self.replay_macros else None
+            if macro:
+                finished, observation, replayed = self.replay_macro(macro, screenshot_png, cursor_position, ui_xml)
+                screenshot_png, cursor_position, ui_xml = observation
+                if finished:
+                    reason = f"{macro.get('reason', 'Task completed')} (replayed {len(macro['steps'])} recorded steps)"
+                    self.record_event("macro_replayed", steps=len(macro["steps"]))
+                    self.task_completed(True, reason)
+                    self.logger.info(f"Task completed by macro replay: {reason}")
+                    return
+                if screenshot_png is None:
+                    self.task_completed(False, "Screenshot capture failed", interrupted=True)
+                    self.logger.error("Failed to capture screenshot during macro replay. Exiting task.")
+                    return
+                if replayed:
+                    # Hand control to the model with what the replay already did
+                    note = ("These steps were already performed by replaying a recorded run of this task:\n" +
+                            "\n".join(f"{i + 1}. {action}" for i, action in enumerate(replayed)) +
+                            "\nThe replay stopped because the screen no longer matched the recording.")
+
+        screenshot_png, cursor_position, ui_xml, cache_note = self.apply_cached_actions(
+            screenshot_png, cursor_position, ui_xml, timings)
+        if screenshot_png is None:
+            self.task_completed(False, "Screenshot capture failed", interrupted=True)
+            self.logger.error("Failed to capture screenshot after cached actions. Exiting task.")
+            return
+        note = "\n".join(part for part in (note, cache_note) if part) or None
+
         self.update_status("Analyzing initial screenshot...")
-        message = self.send_to_claude(screenshot_data, cursor_position, ui_xml)
-        
+        message = self.request_next_action(screenshot_png, cursor_position, ui_xml, None, timings, note)
+        self.record_step(None, timings)
+        self.checkpoint(message, ui_xml)
+        self._step_loop(message, screenshot_png, cursor_position, ui_xml)
+
+    def _resume_run(self, checkpoint, task_completed, update_status):
+        """Continue a checkpointed task on the live device.
+
+        If the screen still matches the one the pending response was chosen on, that response is executed
+        without asking the model again. Otherwise the interrupted step's tool results are re-sent with a
+        fresh screenshot, which costs one model call instead of redoing every step.
+        """
+        self._set_callbacks(task_completed, update_status)
+        self.step = checkpoint["step"]
+        self.usage = dict(checkpoint["usage"])
+        self.system_prompt = checkpoint["system_prompt"]
+        self.conversation = JournalReader(self.journal_dir).restore(checkpoint["messages"])
+        self._checkpoint = checkpoint
+
+        self.logger.info(f"Resuming task after step {self.step}: {self.task_description}")
+        self.update_status("Capturing screenshot to resume...")
+        timings = StageTimings()
+        screenshot_png, cursor_position, ui_xml = self.capture_screenshot(timings)
+        if screenshot_png is None:
+            self.task_completed(False, "Screenshot capture failed", interrupted=True)
+            self.logger.error("Failed to capture screenshot. Exiting task.")
+            return
+
+        pending = Message.model_validate(checkpoint["pending"]) if checkpoint.get("pending") else None
+        unchanged = pending is not None and checkpoint.get("signature") == resume_signature(ui_xml)
+        if unchanged:
+            self.journal.rewind(len(self.conversation), step=self.step, reused_response=True)
+            self.logger.info("Screen unchanged since the checkpoint; continuing with the pending response")
+            self.checkpoint(pending, ui_xml)
+            self._step_loop(pending, screenshot_png, cursor_position, ui_xml)
+            return
+
+        # The last user message describes a screen that is gone; its tool results still answer the
+        # assistant's last tool calls, so they go out again with the current screenshot
+        tool_results = None
+        if len(self.conversation) and self.conversation[-1]['role'] == 'user':
+            stale = self.conversation.messages.pop()
+            tool_results = [block for block in stale['content']
+                            if isinstance(block, dict) and block.get('type') == 'tool_result'] or None
+        self.journal.rewind(len(self.conversation), step=self.step, reused_response=False)
+        note = (f"The task was interrupted after step {self.step} and has been resumed. "
+                "The screen may have changed since; check it before continuing.")
+        self.update_status("Analyzing screenshot after resuming...")
+        message = self.request_next_action(screenshot_png, cursor_position, ui_xml, tool_results, timings, note)
+        self.record_step(None, timings)
+        self.checkpoint(message, ui_xml)
+        self._step_loop(message, screenshot_png, cursor_position, ui_xml)
+
+    def _step_loop(self, message, screenshot_png, cursor_position, ui_xml):
         while not self._is_cancelled:
             while self._is_paused:
                 time.sleep(0.1)
@@ -157,133 +725,71 @@ class PhoneMirroringAgent:
                 break
 
             if message is None:
-                self.task_completed(False, "Failed to communicate with Claude")
+                self.task_completed(False, "Failed to communicate with Claude", interrupted=True)
                 self.logger.error("Failed to communicate with Claude")
                 return
 
-            self.logger.info("Claude's response received")
-            self.logger.info(f"Claude's response content: {message.content}")
+            self.step += 1
+            response = message
+            tool_names = [block.name for block in message.content if isinstance(block, ToolUseBlock)]
+            self.logger.info(f"Claude's response received: stop_reason={message.stop_reason}, tools={tool_names}")
+            # The full content can be many kilobytes per step; the log pipeline truncates it
+            self.logger.debug(f"Claude's response content: {message.content}")
             self.update_status("Received response from Claude, processing...")
             
-            self.conversation.append(MessageParam(
+            self.append_message(MessageParam(
                 role="assistant",
                 content=message.content
             ))
             
+            timings = StageTimings()
             if message.stop_reason == "tool_use":
                 tool_uses = [block for block in message.content if isinstance(block, ToolUseBlock)]
-                tool_results = []
-                for tool_use in tool_uses:
-                    if tool_use.name == "done":
-                        status = tool_use.input["status"]
-                        reason = tool_use.input["reason"]
-                        if status == "completed":
-                            self.task_completed(True, reason)
-                        else:
-                            self.task_completed(False, reason)
-                        self.logger.info(f"Task {status}. Reason: {reason}")
-                        return
-                    
-                    try:
-                        self.update_status(f"Executing {tool_use.name}...")
-                        if tool_use.name == "move_cursor":
-                            result = move_cursor(tool_use.input["direction"], tool_use.input["distance"])
-                        elif tool_use.name == "click_cursor":
-                            result = click_cursor()
-                        elif tool_use.name == "tap":
-                            try:
-                                # Execute tap command
-                                process = subprocess.run([
-                                    'adb', 'shell', 'input', 'tap',
-                                    str(tool_use.input["x"]), str(tool_use.input["y"])
-                                ], capture_output=True, text=True, check=True)
-                                
-                                # Check if there was any error output
-                                if process.stderr:
-                                    raise Exception(f"ADB error: {process.stderr}")
-                                    
-                                # Verify the command executed
-                                if process.returncode == 0:
-                                    result = f"Successfully tapped at coordinates ({tool_use.input['x']}, {tool_use.input['y']})"
-                                    # Add small delay to ensure tap is registered
-                                    time.sleep(0.5)
-                                else:
-                                    raise Exception(f"ADB command failed with return code {process.returncode}")
-                                
-                            except subprocess.CalledProcessError as e:
-                                raise Exception(f"Failed to execute tap command: {str(e)}")
-                            except Exception as e:
-                                raise Exception(f"Error during tap operation: {str(e)}")
-                        elif tool_use.name == "swipe":
-                            result = subprocess.check_output([
-                                'adb', 'shell', 'input', 'swipe',
-                                str(tool_use.input["start_x"]), str(tool_use.input["start_y"]),
-                                str(tool_use.input["end_x"]), str(tool_use.input["end_y"]),
-                                str(tool_use.input.get("duration", 300))
-                            ], text=True)
-                            result = f"Swiped from ({tool_use.input['start_x']}, {tool_use.input['start_y']}) to ({tool_use.input['end_x']}, {tool_use.input['end_y']})"
-                        elif tool_use.name == "input_text":
-                            result = subprocess.check_output([
-                                'adb', 'shell', 'input', 'text',
-                                tool_use.input["text"].replace(' ', '%s')
-                            ], text=True)
-                            result = f"Input text: {tool_use.input['text']}"
-                        elif tool_use.name == "press_key":
-                            key_mapping = {
-                                "home": "KEYCODE_HOME",
-                                "back": "KEYCODE_BACK",
-                                "menu": "KEYCODE_MENU",
-                                "power": "KEYCODE_POWER",
-                                "volume_up": "KEYCODE_VOLUME_UP",
-                                "volume_down": "KEYCODE_VOLUME_DOWN",
-                                "enter": "KEYCODE_ENTER",
-                                "delete": "KEYCODE_DEL"
-                            }
-                            android_key = key_mapping[tool_use.input["key"]]
-                            result = subprocess.check_output([
-                                'adb', 'shell', 'input', 'keyevent',
-                                android_key
-                            ], text=True)
-                            result = f"Pressed key: {tool_use.input['key']}"
-                        elif tool_use.name == "long_press":
-                            duration = tool_use.input.get("duration", 1000)
-                            result = subprocess.check_output([
-                                'adb', 'shell', 'input', 'swipe',
-                                str(tool_use.input["x"]), str(tool_use.input["y"]),
-                                str(tool_use.input["x"]), str(tool_use.input["y"]),
-                                str(duration)
-                            ], text=True)
-                            result = f"Long pressed at ({tool_use.input['x']}, {tool_use.input['y']}) for {duration}ms"
-                        else:
-                            raise ValueError(f"Unknown tool: {tool_use.name}")
-                        
-                        tool_results.append(ToolResultBlockParam(
-                            type="tool_result",
-                            tool_use_id=tool_use.id,
-                            content=[TextBlockParam(type="text", text=f"{result}")]
-                        ))
-                        
-                        self.logger.info(f"Executed {tool_use.name}: {result}")
-                    except Exception as e:
-                        self.task_completed(False, f"Error executing {tool_use.name}")
-                        self.logger.error(f"Error executing {tool_use.name}: {str(e)}")
-                        return
+                if self.macro_recorder is not None:
+                    self.macro_recorder.record_step(ui_xml, tool_uses)
+                try:
+                    tool_results, done = self.execute_tool_uses(tool_uses, timings)
+                except ToolExecutionError as e:
+                    self.task_completed(False, f"Error executing {e.tool_names}", interrupted=True)
+                    self.logger.error(str(e))
+                    return
+
+                if done is not None:
+                    self.finish_with_done(done, ui_xml)
+                    return
+                if all(tool_use.name == "zoom" for tool_use in tool_uses):
+                    # Nothing changed on the device: no capture, and no new screenshot in the request
+                    self.update_status("Analyzing zoomed region...")
+                    message = self.request_next_action(None, cursor_position, ui_xml, tool_results, timings)
+                    self.record_step(response, timings)
+                    self.checkpoint(message, ui_xml)
+                    continue
+                self.remember_actions(tool_uses)
                 
                 self.update_status("Capturing new screenshot after action...")
-                new_screenshot_data, new_cursor_position, new_ui_xml = self.capture_screenshot()
-                if new_screenshot_data is None:
-                    self.task_completed(False, "Screenshot capture failed")
+                screenshot_png, cursor_position, ui_xml = self.capture_screenshot(timings)
+                if screenshot_png is not None:
+                    screenshot_png, cursor_position, ui_xml, note = self.apply_cached_actions(
+                        screenshot_png, cursor_position, ui_xml, timings)
+                if screenshot_png is None:
+                    self.task_completed(False, "Screenshot capture failed", interrupted=True)
                     self.logger.error("Failed to capture screenshot after tool execution. Exiting task.")
                     return
                 
                 self.update_status("Analyzing new screenshot...")
-                message = self.send_to_claude(new_screenshot_data, new_cursor_position, new_ui_xml, tool_results)
+                message = self.request_next_action(screenshot_png, cursor_position, ui_xml, tool_results, timings, note)
             else:
                 self.logger.info("Claude did not request to use any tools. Continuing...")
                 self.update_status("Analyzing current state...")
-                message = self.send_to_claude(screenshot_data, cursor_position, ui_xml, None)
-            
-            time.sleep(1)
+                latest = self.scheduler.latest()
+                if latest is not None:
+                    screenshot_png, cursor_position, ui_xml = latest.png, latest.cursor_position, latest.ui_xml
+                    # Actions chosen on an unsigned frame aren't safe to cache
+                    self.cache_signature = None
+                message = self.request_next_action(screenshot_png, cursor_position, ui_xml, None, timings)
+
+            self.record_step(response, timings)
+            self.checkpoint(message, ui_xml)
 
         if self._is_cancelled:
             self.task_completed(False, "Task cancelled by user")
@@ -291,14 +797,24 @@ class PhoneMirroringAgent:
 
     def pause(self):
         self._is_paused = True
+        if self.metrics is not None:
+            self.metrics.set_state("paused")
+        if self.frame_grabber is not None:
+            self.frame_grabber.pause()
         self.logger.info("Task paused")
 
     def resume(self):
         self._is_paused = False
+        if self.metrics is not None:
+            self.metrics.set_state("running")
+        if self.frame_grabber is not None:
+            self.frame_grabber.resume()
         self.logger.info("Task resumed")
 
     def cancel(self):
         self._is_cancelled = True
+        if self.frame_grabber is not None:
+            self.frame_grabber.stop()
         self.logger.info("Task cancellation requested")
 
     def isPaused(self):
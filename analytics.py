@@ -0,0 +1,410 @@
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from journal import JOURNAL_FILE
+from ui_tree import parse_ui_xml, screen_signature
+
+EXPORT_FILE = "conversation.json"
+# USD per million tokens: (input, output). Cache reads bill at 10% of input, cache writes at 125%.
+MODEL_PRICES = {
+    "claude-3-5-sonnet-20241022": (3.0, 15.0),
+    "claude-3-5-sonnet-20240620": (3.0, 15.0),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-sonnet-20240229": (3.0, 15.0),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+}
+# Taps within this many device pixels of each other count as the same target
+TAP_RADIUS = 24
+SCROLL_LOOP_LENGTH = 3
+
+_UI_XML_PREFIX = "UI XML Structure:\n"
+_EVENT_RE = re.compile(r'^\{"event": "([a-z_]+)"')
+_QUOTED_RE = re.compile(r'"[^"]*"|\'[^\']*\'')
+_NUMBER_RE = re.compile(r'\d+')
+
+
+def task_type(task):
+    """Group tasks that differ only in quoted values and numbers, e.g. who a message is sent to."""
+    normalized = " ".join(task.lower().split())
+    return _NUMBER_RE.sub('#', _QUOTED_RE.sub('"…"', normalized))[:80]
+
+
+def token_cost(model, usage):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    input_price, output_price = prices
+    return round((usage.get("input_tokens", 0) * input_price
+                  + usage.get("cache_read_input_tokens", 0) * input_price * 0.1
+                  + usage.get("cache_creation_input_tokens", 0) * input_price * 1.25
+                  + usage.get("output_tokens", 0) * output_price) / 1e6, 6)
+
+
+def iter_json_array(path, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array one at a time without reading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        position = 0
+        started = False
+        while True:
+            chunk = f.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if not started:
+                    if position == len(buffer):
+                        break
+                    if buffer[position] != "[":
+                        raise ValueError(f"{path} is not a JSON array")
+                    started = True
+                    position += 1
+                    continue
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # The item continues in the next chunk
+                    break
+                yield item
+                position = end
+            if not chunk:
+                if buffer[position:].strip():
+                    raise ValueError(f"Truncated JSON array in {path}")
+                return
+
+
+class _RunScanner:
+    """Collects one run's screens, actions and step events, then derives its summary.
+
+    Screen ``k`` is what the model saw before choosing actions ``k``, which led to screen ``k + 1``.
+    """
+
+    def __init__(self, path, source):
+        self.summary = {"path": path, "source": source, "task": "", "model": None, "success": None,
+                        "reason": None, "steps": 0, "model_calls": 0, "resumes": 0,
+                        "usage": {"input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0,
+                                  "cache_creation_input_tokens": 0},
+                        "phases": defaultdict(list), "screen_labels": {}}
+        self.images = []
+        self.signatures = []
+        self.states = []
+        self.actions = []
+
+    def screen(self, image, ui_xml):
+        if image is None and ui_xml is None and self.images:
+            # A turn that only answered zoom calls: the model is still looking at the same screen
+            image, signature, state = self.images[-1], self.signatures[-1], self.states[-1]
+            self.images.append(image)
+            self.signatures.append(signature)
+            self.states.append(state)
+            return
+        signature = state = None
+        if ui_xml:
+            elements = parse_ui_xml(ui_xml)
+            signature = screen_signature(elements=elements)[:12]
+            # Exact content: a status bar clock changes the screenshot but not the app's UI dump
+            state = screen_signature(elements=elements, include_text=True, mask_digits=False)
+            if signature not in self.summary["screen_labels"]:
+                package = next((element.package for element in elements if element.package), "")
+                texts = [element.text for element in elements if element.text][:3]
+                self.summary["screen_labels"][signature] = f"{package}: {' | '.join(texts)}" if texts else package
+        self.images.append(image)
+        self.signatures.append(signature)
+        self.states.append(state)
+
+    def _unchanged(self, index):
+        """Whether the action taken on screen ``index`` left it as it was."""
+        if index + 1 >= len(self.images):
+            return False
+        if self.states[index] is not None and self.states[index] == self.states[index + 1]:
+            return True
+        return self.images[index] is not None and self.images[index] == self.images[index + 1]
+
+    def step(self, entry):
+        summary = self.summary
+        timings = entry.get("timings") or {}
+        summary["steps"] = max(summary["steps"], entry.get("step") or 0)
+        for phase, seconds in timings.items():
+            summary["phases"][phase].append(seconds)
+        if "model" in timings:
+            summary["model_calls"] += 1
+        for key, value in (entry.get("usage") or {}).items():
+            if key in summary["usage"] and isinstance(value, int):
+                summary["usage"][key] += value
+        # The step recorded with the first request has no response yet
+        if entry.get("stop_reason") is not None:
+            self.actions.append(entry.get("tool_calls") or [])
+
+    def rewind(self, screens, actions):
+        """A resumed run replaced everything after its checkpoint; keep what led up to it."""
+        del self.images[screens:], self.signatures[screens:], self.states[screens:]
+        del self.actions[actions:]
+        self.summary["resumes"] += 1
+        self.summary["success"] = self.summary["reason"] = None
+
+    def finish(self):
+        summary = self.summary
+        summary["task_type"] = task_type(summary["task"])
+        summary["cost"] = token_cost(summary["model"], summary["usage"])
+        summary["phases"] = dict(summary["phases"])
+        summary["screen_calls"] = dict(Counter(signature for signature in self.signatures if signature))
+        summary["unchanged_screens"] = sum(1 for index, calls in enumerate(self.actions)
+                                           if calls and self._unchanged(index))
+        summary["repeated_taps"] = self._repeated_taps()
+        summary["scroll_loops"] = self._scroll_loops()
+        return summary
+
+    def _repeated_taps(self):
+        # The same spot tapped again because the previous tap didn't change the screen
+        streaks = []
+        last, count = None, 0
+        for index, calls in enumerate(self.actions + [[]]):
+            point = None
+            if len(calls) == 1 and calls[0]["name"] in ("tap", "long_press"):
+                point = (calls[0]["input"].get("x", 0), calls[0]["input"].get("y", 0))
+            if point is not None and last is not None and self._unchanged(index - 1) and \
+                    max(abs(point[0] - last[0]), abs(point[1] - last[1])) <= TAP_RADIUS:
+                count += 1
+                continue
+            if count > 1:
+                streaks.append([*last, count])
+            last, count = point, 1
+        return streaks
+
+    def _scroll_loops(self):
+        # Runs of consecutive swipes that come back to a screen already seen during the same run
+        loops = 0
+        start = None
+        for index, calls in enumerate(self.actions + [[]]):
+            swiping = bool(calls) and all(call["name"] == "swipe" for call in calls)
+            if swiping and start is None:
+                start = index
+            elif not swiping and start is not None:
+                screens = [signature for signature in self.signatures[start:index + 1] if signature]
+                if index - start >= SCROLL_LOOP_LENGTH and len(set(screens)) < len(screens):
+                    loops += 1
+                start = None
+        return loops
+
+
+def _user_screen(message):
+    image = ui_xml = None
+    for block in message.get("content") or []:
+        if not isinstance(block, dict):
+            continue
+        if block.get("type") == "image" and "region" not in block:
+            image = block.get("key") or (block.get("source") or {}).get("path")
+        elif block.get("type") == "text" and block["text"].startswith(_UI_XML_PREFIX):
+            ui_xml = block["text"][len(_UI_XML_PREFIX):]
+    return image, ui_xml
+
+
+def summarize_journal(run_dir):
+    scanner = _RunScanner(run_dir, "journal")
+    summary = scanner.summary
+    # Roles of the journaled messages, to find where a resumed run picked up
+    roles = []
+    with open(os.path.join(run_dir, JOURNAL_FILE), 'r', encoding='utf-8') as f:
+        for line in f:
+            match = _EVENT_RE.match(line)
+            event = match.group(1) if match else None
+            # Assistant messages are skipped unparsed: their tool calls are in the step events
+            if event == "message" and '"role": "user"' not in line[:200]:
+                roles.append("assistant")
+                continue
+            if event not in ("message", "step", "task_started", "task_finished", "resumed", None):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can leave the last line half written
+                continue
+            event = entry.get("event")
+            if event == "message":
+                roles.append(entry["message"].get("role"))
+                if entry["message"].get("role") == "user":
+                    image, ui_xml = _user_screen(entry["message"])
+                    # The captured frame, when journaled, even if only changed regions were sent
+                    scanner.screen(entry.get("frame") or image, ui_xml)
+            elif event == "step":
+                scanner.step(entry)
+            elif event == "task_started":
+                summary["task"] = entry.get("task", "")
+                summary["model"] = entry.get("model")
+            elif event == "task_finished":
+                summary["success"] = entry.get("success")
+                summary["reason"] = entry.get("reason")
+            elif event == "resumed":
+                del roles[entry["messages"]:]
+                scanner.rewind(roles.count("user"), roles.count("assistant"))
+    return scanner.finish()
+
+
+def summarize_export(export_dir):
+    """Exports carry no timings, usage or outcome; model calls are counted from assistant turns."""
+    scanner = _RunScanner(export_dir, "export")
+    summary = scanner.summary
+    for message in iter_json_array(os.path.join(export_dir, EXPORT_FILE)):
+        if message.get("role") == "user":
+            if not summary["task"]:
+                for block in message.get("content") or []:
+                    if isinstance(block, dict) and block.get("type") == "text" and "for the task: " in block["text"]:
+                        summary["task"] = block["text"].split("for the task: ", 1)[1].split("\n", 1)[0]
+            scanner.screen(*_user_screen(message))
+        elif message.get("role") == "assistant":
+            summary["model_calls"] += 1
+            summary["steps"] += 1
+            content = message.get("content") or []
+            scanner.actions.append([block for block in content
+                                    if isinstance(block, dict) and block.get("type") == "tool_use"])
+    return scanner.finish()
+
+
+def summarize_run(path):
+    try:
+        if os.path.exists(os.path.join(path, JOURNAL_FILE)):
+            return summarize_journal(path)
+        return summarize_export(path)
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+
+def find_runs(root):
+    """Directories under ``root`` (at any depth) holding a step journal or an exported conversation."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        names = {entry.name for entry in entries}
+        if JOURNAL_FILE in names or EXPORT_FILE in names:
+            yield directory
+            continue
+        stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+def distribution(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    return {"count": len(values), "mean_ms": round(statistics.fmean(values) * 1000, 1),
+            "p50_ms": round(at(0.5) * 1000, 1), "p95_ms": round(at(0.95) * 1000, 1),
+            "p99_ms": round(at(0.99) * 1000, 1), "max_ms": round(values[-1] * 1000, 1)}
+
+
+def analyze(summaries, top=10):
+    """Aggregate per-run summaries into the report; consumes ``summaries`` as a stream."""
+    phases = defaultdict(list)
+    tasks = defaultdict(lambda: {"runs": 0, "succeeded": 0, "failed": 0, "resumed": 0, "model_calls": 0,
+                                 "tokens": 0, "cost": 0.0, "priced_runs": 0})
+    screen_calls = Counter()
+    screen_runs = Counter()
+    screen_labels = {}
+    taps = []
+    errors = []
+    totals = Counter()
+    for summary in summaries:
+        if "error" in summary:
+            errors.append(summary)
+            continue
+        totals["runs"] += 1
+        totals[summary["source"] + "_runs"] += 1
+        for phase, values in summary["phases"].items():
+            phases[phase].extend(values)
+        task = tasks[summary["task_type"]]
+        task["runs"] += 1
+        if summary["success"] is True:
+            task["succeeded"] += 1
+        elif summary["success"] is False:
+            task["failed"] += 1
+        if summary.get("resumes"):
+            # Exports don't record resumes, so only journaled runs are counted
+            task["resumed"] += 1
+            totals["resumed_runs"] += 1
+            totals["resumes"] += summary["resumes"]
+        tokens = summary["usage"]["input_tokens"] + summary["usage"]["output_tokens"]
+        task["model_calls"] += summary["model_calls"]
+        task["tokens"] += tokens
+        if summary["cost"] is not None:
+            task["cost"] += summary["cost"]
+            task["priced_runs"] += 1
+        totals["model_calls"] += summary["model_calls"]
+        totals["tokens"] += tokens
+        totals["unchanged_screens"] += summary["unchanged_screens"]
+        totals["scroll_loops"] += summary["scroll_loops"]
+        totals["repeated_tap_streaks"] += len(summary["repeated_taps"])
+        screen_calls.update(summary["screen_calls"])
+        screen_runs.update(summary["screen_calls"].keys())
+        for signature, label in summary["screen_labels"].items():
+            screen_labels.setdefault(signature, label)
+        for x, y, count in summary["repeated_taps"]:
+            taps.append({"path": summary["path"], "x": x, "y": y, "taps": count})
+        for key in ("unchanged_screens", "scroll_loops"):
+            if summary[key]:
+                totals[f"runs_with_{key}"] += 1
+
+    task_report = {}
+    for name, task in sorted(tasks.items(), key=lambda item: -item[1]["runs"]):
+        finished = task["succeeded"] + task["failed"]
+        task_report[name] = {
+            "runs": task["runs"],
+            "success_rate": round(task["succeeded"] / finished, 3) if finished else None,
+            "resumed_runs": task["resumed"],
+            "model_calls_per_run": round(task["model_calls"] / task["runs"], 1),
+            "tokens_per_run": round(task["tokens"] / task["runs"]),
+            "cost_per_run": round(task["cost"] / task["priced_runs"], 4) if task["priced_runs"] else None,
+        }
+    total_calls = sum(screen_calls.values()) or 1
+    return {
+        "totals": dict(totals),
+        "phases": {phase: distribution(values) for phase, values in sorted(phases.items())},
+        "tasks": task_report,
+        # Screens that cost the most calls across runs: the best candidates for caching or local handling
+        "top_screens": [{"signature": signature, "label": screen_labels.get(signature, ""), "model_calls": calls,
+                         "runs": screen_runs[signature], "share": round(calls / total_calls, 3)}
+                        for signature, calls in screen_calls.most_common(top)],
+        "repeated_taps": sorted(taps, key=lambda tap: -tap["taps"])[:top],
+        "errors": errors[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency, cost and retry analytics over recorded runs")
+    parser.add_argument("paths", nargs="+", help="Run directories, or directories containing them (e.g. runs/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel worker processes")
+    parser.add_argument("--top", type=int, default=10, help="Entries to list for screens and hotspots")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [run for path in args.paths for run in find_runs(path)]
+    if args.workers > 1 and len(runs) > 1:
+        with ProcessPoolExecutor(args.workers) as executor:
+            report = analyze(executor.map(summarize_run, runs, chunksize=max(1, len(runs) // (args.workers * 8))),
+                             args.top)
+    else:
+        report = analyze(map(summarize_run, runs), args.top)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    return 0 if runs else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
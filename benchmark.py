@@ -0,0 +1,1426 @@
+import io
+import os
+import re
+import sys
+import json
+import base64
+import hashlib
+import time
+import random
+import argparse
+import tempfile
+import resource
+import statistics
+import threading
+import tracemalloc
+import xml.etree.ElementTree as ET
+import numpy as np
+from PIL import Image, ImageDraw
+from anthropic.types import MessageParam, TextBlockParam, ImageBlockParam, ToolUseBlock
+from conversation_store import BlobTable, ConversationStore
+from model_client import ScriptedClient
+from simulator import ScreenGraph, ScreenState, SimulatedDevice, fake_adb, tap_next_policy
+from frame_grabber import encode_png
+from ui_tree import parse_ui_xml, format_elements, screen_signature
+from export_utils import export_run, generate_html_content
+from constants import DEFAULT_MAX_HISTORY_IMAGES
+
+
+def make_screenshots(count, width=1080, height=2400, seed=0):
+    rng = random.Random(seed)
+    screenshots = []
+    for _ in range(count):
+        image = Image.new('RGB', (width, height), (250, 250, 250))
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.rectangle([x, y, x + rng.randrange(50, 400), y + rng.randrange(20, 150)], fill=color)
+            draw.text((x + 5, y + 5), f"Item {rng.randrange(1000)}", fill=(0, 0, 0))
+        # A noisy region stands in for photos and icons so PNG sizes are realistic
+        noise = Image.frombytes('RGB', (300, 300), rng.randbytes(300 * 300 * 3))
+        image.paste(noise, (rng.randrange(width - 300), rng.randrange(height - 300)))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        screenshots.append(buffer.getvalue())
+    return screenshots
+
+
+def make_ui_xml(nodes=400, width=1080, height=2400, seed=0, package="com.example.feed"):
+    """A uiautomator-style dump of a long list screen with ``nodes`` rows of nested views."""
+    rng = random.Random(seed)
+    hierarchy = ET.Element('hierarchy', rotation="0")
+    root = ET.SubElement(hierarchy, 'node', {"class": "android.widget.FrameLayout", "package": package,
+                                             "bounds": f"[0,0][{width},{height}]", "text": "", "resource-id": "",
+                                             "content-desc": "", "clickable": "false", "enabled": "true"})
+    row_height = max(1, height // max(1, nodes // 3))
+    for index in range(nodes // 3):
+        top = index * row_height
+        row = ET.SubElement(root, 'node', {"class": "android.widget.LinearLayout", "package": package,
+                                           "bounds": f"[0,{top}][{width},{top + row_height}]", "text": "",
+                                           "resource-id": f"{package}:id/row", "content-desc": "",
+                                           "clickable": "true", "enabled": "true"})
+        ET.SubElement(row, 'node', {"class": "android.widget.ImageView", "package": package,
+                                    "bounds": f"[0,{top}][{row_height},{top + row_height}]", "text": "",
+                                    "resource-id": f"{package}:id/icon", "content-desc": f"Avatar {index}",
+                                    "clickable": "false", "enabled": "true"})
+        ET.SubElement(row, 'node', {"class": "android.widget.TextView", "package": package,
+                                    "bounds": f"[{row_height},{top}][{width},{top + row_height}]",
+                                    "text": f"Message {rng.randrange(10 ** 6)} from contact {index}",
+                                    "resource-id": f"{package}:id/title", "content-desc": "",
+                                    "clickable": "false", "enabled": "true"})
+    return "<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>" + ET.tostring(hierarchy, encoding='unicode')
+
+
+def timed(fn, repeat=5, warmup=1):
+    """Median wall time of ``fn`` in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _simulate_steps(screenshots, steps, append, build_payload):
+    for step in range(steps):
+        # Fresh bytes every step, like a real capture; revisited screens repeat earlier frames
+        png = bytes(bytearray(screenshots[step % len(screenshots)]))
+        append(step, png)
+        json.dumps(build_payload())
+
+
+def bench_conversation_memory(steps=100, unique_screens=40, max_history_images=DEFAULT_MAX_HISTORY_IMAGES,
+                              max_resident_mb=4):
+    """Memory of a 100-step task: base64 messages kept in the conversation, the blob store sending every
+    screenshot, and the blob store sending the most recent ones (the GUI's default)."""
+    screenshots = make_screenshots(unique_screens)
+    results = {
+        "steps": steps,
+        "unique_screens": unique_screens,
+        "png_bytes_per_step": sum(len(s) for s in screenshots) // len(screenshots),
+    }
+
+    def run(name, append, build_payload, holder):
+        tracemalloc.start()
+        _simulate_steps(screenshots, steps, append, build_payload)
+        resident, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"{name}_resident_mb"] = round(resident / 2 ** 20, 2)
+        results[f"{name}_peak_mb"] = round(peak / 2 ** 20, 2)
+        holder.clear()
+
+    legacy = []
+
+    def legacy_append(step, png):
+        legacy.append(MessageParam(role="user", content=[
+            TextBlockParam(type="text", text=f"Screenshot for step {step}"),
+            ImageBlockParam(type="image", source={
+                "type": "base64", "media_type": "image/png", "data": base64.b64encode(png).decode('utf-8')})
+        ]))
+        legacy.append(MessageParam(role="assistant", content=[TextBlockParam(type="text", text="Next action")]))
+
+    run("legacy", legacy_append, lambda: legacy, legacy)
+
+    for name, history in (("store", None), ("store_recent", max_history_images)):
+        store = ConversationStore(BlobTable(max_resident_bytes=max_resident_mb * 2 ** 20))
+        holder = []
+
+        def store_append(step, png, store=store):
+            store.append(MessageParam(role="user", content=[
+                TextBlockParam(type="text", text=f"Screenshot for step {step}"),
+                store.image_block(png)
+            ]))
+            store.append(MessageParam(role="assistant", content=[TextBlockParam(type="text", text="Next action")]))
+
+        run(name, store_append, lambda store=store, history=history: store.to_api_messages(history), holder)
+
+    results["resident_reduction"] = round(results["legacy_resident_mb"] / max(results["store_resident_mb"], 0.01), 1)
+    results["peak_reduction"] = round(results["legacy_peak_mb"] / max(results["store_recent_peak_mb"], 0.01), 1)
+    return results
+
+
+def bench_screenshot_encoding(repeat=5):
+    png = make_screenshots(1)[0]
+    frame = np.asarray(Image.open(io.BytesIO(png)).convert('RGB'))
+    ui_xml = make_ui_xml()
+    results = {
+        "png_kb": round(len(png) / 1024, 1),
+        "encode_png_fast_ms": timed(lambda: encode_png(frame), repeat),
+        "encode_png_default_ms": timed(lambda: encode_png(frame, compress_level=6), repeat),
+        "decode_png_ms": timed(lambda: np.asarray(Image.open(io.BytesIO(png)).convert('RGB')), repeat),
+        "base64_encode_ms": timed(lambda: base64.b64encode(png).decode('utf-8'), repeat),
+    }
+    encoded = base64.b64encode(png).decode('utf-8')
+    results["base64_decode_ms"] = timed(lambda: base64.b64decode(encoded), repeat)
+
+    from screen import dump_ui_xml, capture_png, get_screen_dimensions
+
+    def capture_screenshot():
+        # One observation's adb round trips: UI dump, base64 PNG and screen size
+        return dump_ui_xml(), base64.b64encode(capture_png()).decode('utf-8'), get_screen_dimensions("android")
+
+    # The real subprocess code paths against a shell-script adb, so only process and pipe overhead is timed
+    with fake_adb(png, ui_xml):
+        results["capture_screenshot_fake_adb_ms"] = timed(capture_screenshot, repeat)
+    return results
+
+
+def bench_ui_xml(nodes=400, repeat=20):
+    ui_xml = make_ui_xml(nodes)
+    elements = parse_ui_xml(ui_xml)
+    compact = format_elements(elements)
+    return {
+        "nodes": nodes,
+        "xml_kb": round(len(ui_xml) / 1024, 1),
+        "compact_kb": round(len(compact) / 1024, 1),
+        "etree_parse_ms": timed(lambda: ET.fromstring(ui_xml), repeat),
+        "etree_serialize_ms": timed(lambda: ET.tostring(ET.fromstring(ui_xml), encoding='unicode'), repeat),
+        "parse_ui_xml_ms": timed(lambda: parse_ui_xml(ui_xml), repeat),
+        "format_elements_ms": timed(lambda: format_elements(elements), repeat),
+        "screen_signature_ms": timed(lambda: screen_signature(elements=elements), repeat),
+        "json_text_block_ms": timed(lambda: json.dumps({"type": "text", "text": f"UI XML Structure:\n{ui_xml}"}),
+                                    repeat),
+    }
+
+
+def bench_request_building(history_steps=(10, 50, 100), max_history_images=5, unique_screens=10):
+    from agent import PhoneMirroringAgent
+
+    screenshots = make_screenshots(unique_screens)
+    ui_xml = make_ui_xml()
+    payload_sizes = []
+
+    def serializing_policy(params):
+        # What the SDK does to every request before it goes on the wire
+        payload_sizes.append(len(json.dumps(params["messages"], default=lambda block: block.model_dump())))
+        return [("tap", {"x": 540, "y": 1200})]
+
+    agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 10 ** 6, max_history_images=max_history_images,
+                                client=ScriptedClient(serializing_policy),
+                                device=SimulatedDevice(ScreenGraph.generate(2), time_scale=0))
+    agent.task_description = "Scroll through the feed"
+    results = {"max_history_images": max_history_images}
+    step = 0
+    for target in sorted(history_steps):
+        samples = []
+        while step < target:
+            png = screenshots[step % len(screenshots)]
+            started = time.perf_counter()
+            response = agent.send_to_claude(png, (540, 1200), ui_xml)
+            samples.append(time.perf_counter() - started)
+            agent.append_message(MessageParam(role="assistant", content=response.content))
+            step += 1
+        results[f"send_at_{target}_steps_ms"] = round(statistics.median(samples[-5:]) * 1000, 3)
+        results[f"payload_at_{target}_steps_kb"] = round(payload_sizes[-1] / 1024, 1)
+    agent.scheduler.shutdown()
+    return results
+
+
+def bench_frame_grabber(frames=8, scale=0.25, timeout=10.0):
+    """FrameGrabber throughput over a recorded raw screencap file, and over an H.264 stream when PyAV is
+    installed."""
+    from frame_grabber import FrameGrabber, RawStreamSource, H264StreamSource, write_raw_frame
+
+    graph = ScreenGraph.generate(frames)
+    images = []
+    for state in graph.states.values():
+        image = Image.open(io.BytesIO(state.png)).convert("RGB")
+        images.append(np.asarray(image.resize((round(image.width * scale), round(image.height * scale)))))
+
+    def wait(condition):
+        deadline = time.perf_counter() + timeout
+        while not condition() and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def measure(label, source, results):
+        grabber = FrameGrabber(source, capacity=len(images), max_fps=None)
+        started = time.perf_counter()
+        grabber.start()
+        wait(lambda: not grabber.is_running)
+        elapsed = time.perf_counter() - started
+        results[f"{label}_frames_per_s"] = round(grabber.frames_captured / elapsed, 1)
+        grabber.stop()
+
+    results = {"frames": len(images)}
+    with tempfile.TemporaryDirectory() as directory:
+        raw_path = os.path.join(directory, "frames.raw")
+        with open(raw_path, 'wb') as f:
+            for frame in images:
+                write_raw_frame(f, frame)
+        measure("raw", RawStreamSource(raw_path, loop=False), results)
+
+        try:
+            import av
+        except ImportError:
+            results["h264_available"] = 0
+            return results
+        h264_path = os.path.join(directory, "frames.h264")
+        with av.open(h264_path, mode='w', format='h264') as container:
+            stream = container.add_stream('libx264', rate=10)
+            stream.height, stream.width = images[0].shape[:2]
+            stream.pix_fmt = 'yuv420p'
+            for frame in images:
+                for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format='rgb24')):
+                    container.mux(packet)
+            for packet in stream.encode():
+                container.mux(packet)
+        results["h264_available"] = 1
+        measure("h264", H264StreamSource.from_file(h264_path), results)
+    return results
+
+
+def bench_export(steps=50, unique_screens=10, repeat=3):
+    screenshots = make_screenshots(unique_screens)
+    ui_xml = make_ui_xml(120)
+    store = ConversationStore()
+    for step in range(steps):
+        store.append(MessageParam(role="user", content=[
+            TextBlockParam(type="text", text=f"Screenshot for step {step}"),
+            store.image_block(screenshots[step % len(screenshots)]),
+            TextBlockParam(type="text", text=f"UI XML Structure:\n{ui_xml}")
+        ]))
+        store.append(MessageParam(role="assistant", content=[
+            {"type": "tool_use", "id": f"toolu_{step}", "name": "tap", "input": {"x": 540, "y": 1200}}
+        ]))
+    parameters = {"Model": "benchmark", "Task Description": "Export benchmark"}
+
+    def run_export():
+        with tempfile.TemporaryDirectory() as folder:
+            export_run(store, folder, parameters)
+
+    def run_generate():
+        with tempfile.TemporaryDirectory() as folder:
+            generate_html_content(store, folder, parameters)
+
+    return {
+        "steps": steps,
+        "export_run_ms": timed(run_export, repeat),
+        "generate_html_content_ms": timed(run_generate, repeat),
+    }
+
+
+def bench_frame_diff(screens=12, max_history_images=5, repeat=10):
+    """The simulated flow, whose screens differ only in a step counter, with every screenshot sent in full
+    versus only the changed regions."""
+    from agent import PhoneMirroringAgent
+    from frame_diff import FrameDiff
+    from screen import png_size
+
+    graph = ScreenGraph.generate(screens)
+    states = list(graph.states.values())
+    frames = iter(states[i % 2].png for i in range(repeat + 1))
+    frame_diff = FrameDiff(full_frame_every=repeat + 2)
+    frame_diff.changes(next(frames))
+    diff_ms = timed(lambda: frame_diff.changes(next(frames)), repeat, warmup=0)
+
+    def run(full_frame_every):
+        tokens, new_bytes = [], []
+
+        def counting_policy(params):
+            for message in params["messages"]:
+                for block in message["content"] if message["role"] == "user" else []:
+                    if block.get("type") == "image":
+                        size = png_size(base64.b64decode(block["source"]["data"]))
+                        tokens.append(image_tokens(*size))
+            for block in params["messages"][-1]["content"]:
+                if block.get("type") == "image":
+                    new_bytes.append(len(base64.b64decode(block["source"]["data"])))
+            return tap_next_policy(params)
+
+        client = ScriptedClient(counting_policy)
+        device = SimulatedDevice(graph, time_scale=0)
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, client=client, device=device,
+                                    max_history_images=max_history_images, full_frame_every=full_frame_every)
+        agent.task_description = "Go through the setup flow"
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+        return sum(tokens), sum(new_bytes)
+
+    full_tokens, full_bytes = run(None)
+    diff_tokens, diff_bytes = run(5)
+    return {
+        "diff_ms": diff_ms,
+        "full_image_tokens": round(full_tokens),
+        "diff_image_tokens": round(diff_tokens),
+        "image_token_reduction": round(1 - diff_tokens / full_tokens, 3),
+        "image_bytes_reduction": round(1 - diff_bytes / full_bytes, 3),
+    }
+
+
+def bench_grounding_server(requests=32, concurrency=8, max_batch_size=8, max_new_tokens=16, image_size=112):
+    """Tiny random PaliGemma on CPU: one-at-a-time inference versus the batching server, then cache hits."""
+    from concurrent.futures import ThreadPoolExecutor
+    from grounding import GroundingClient
+    from grounding_server import GroundingService, create_server, load_tiny_random_model
+    from paligemma_inference import infer
+
+    started = time.perf_counter()
+    model, processor, device = load_tiny_random_model(image_size)
+    results = {"requests": requests, "concurrency": concurrency, "load_ms": round((time.perf_counter() - started) * 1000, 1)}
+    rng = random.Random(0)
+    pngs = []
+    for _ in range(requests):
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (image_size, image_size), rng.randbytes(image_size * image_size * 3)).save(buffer, 'PNG')
+        pngs.append(buffer.getvalue())
+
+    started = time.perf_counter()
+    for png in pngs[:max(1, requests // 4)]:
+        infer(Image.open(io.BytesIO(png)).convert("RGB"), "detect button", max_new_tokens, model, processor, device)
+    results["sequential_ms_per_request"] = round((time.perf_counter() - started) / max(1, requests // 4) * 1000, 1)
+
+    service = GroundingService(model, processor, device, max_batch_size=max_batch_size)
+    server = create_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = GroundingClient(f"http://127.0.0.1:{server.server_address[1]}")
+
+    def request(png):
+        started = time.perf_counter()
+        client.element_boxes(png, "button", max_new_tokens)
+        return time.perf_counter() - started
+
+    try:
+        for name in ("server", "cached"):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                latencies = list(executor.map(request, pngs))
+            wall = time.perf_counter() - started
+            results[f"{name}_requests_per_s"] = round(len(pngs) / wall, 1)
+            results[f"{name}_p50_ms"] = round(percentile(latencies, 0.5) * 1000, 1)
+            results[f"{name}_p95_ms"] = round(percentile(latencies, 0.95) * 1000, 1)
+        results["mean_batch_size"] = service.stats()["mean_batch_size"]
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+    results["sequential_requests_per_s"] = round(1000 / results["sequential_ms_per_request"], 1)
+    return results
+
+
+def box_iou(a, b):
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def toggle_ui_xml(checked, label="Wi-Fi"):
+    """A settings screen with one switch row."""
+    return ("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">"
+            "<node text=\"\" resource-id=\"\" class=\"android.widget.FrameLayout\" package=\"com.android.settings\" "
+            "content-desc=\"\" clickable=\"false\" enabled=\"true\" bounds=\"[0,0][1080,2400]\">"
+            f"<node text=\"{label}\" resource-id=\"android:id/title\" class=\"android.widget.TextView\" "
+            "package=\"com.android.settings\" content-desc=\"\" clickable=\"false\" enabled=\"true\" "
+            "bounds=\"[60,400][700,480]\" />"
+            f"<node text=\"\" resource-id=\"android:id/switch_widget\" class=\"android.widget.Switch\" "
+            f"package=\"com.android.settings\" content-desc=\"\" checkable=\"true\" checked=\"{str(checked).lower()}\" "
+            "clickable=\"true\" enabled=\"true\" bounds=\"[880,400][1020,480]\" /></node></hierarchy>")
+
+
+def bench_macros(repeat=200):
+    """Matching a "turn on Wi-Fi" recording against the screen it was recorded on."""
+    from macros import MacroRecorder, MacroPlayer
+
+    off, on = toggle_ui_xml(False), toggle_ui_xml(True)
+    recorder = MacroRecorder("Turn on Wi-Fi")
+    recorder.record_step(off, [ToolUseBlock(type="tool_use", id="t0", name="tap", input={"x": 950, "y": 440})])
+    macro = recorder.build(on, "Wi-Fi is on")
+    return {
+        "match_ms": timed(lambda: MacroPlayer(macro).match(off), repeat),
+        "matches_final_ms": timed(lambda: MacroPlayer(macro).matches_final(on), repeat),
+    }
+
+
+def bench_model_failover(requests=400, concurrency=8, latency=0.05, stall_rate=0.03, stall_latency=0.6,
+                         error_rate=0.05):
+    """Requests against a degraded primary endpoint (slow stalls and errors) on their own, and through
+    RoutedClient with a healthy secondary: latency tail, failed requests and hedging overhead. Then a
+    full primary outage, where the router should stop sending it traffic after a few errors."""
+    from concurrent.futures import ThreadPoolExecutor
+    from model_client import RoutedClient
+
+    def primary(**profile):
+        return ScriptedClient(["ok"], latency=latency, jitter=latency / 4, loop=True, seed=1, **profile)
+
+    def secondary():
+        return ScriptedClient(["ok"], latency=latency * 1.2, jitter=latency / 4, loop=True, seed=2)
+
+    def measure(client):
+        def request(index):
+            started = time.perf_counter()
+            try:
+                client.create_message(model="claude-3-5-sonnet-20241022", max_tokens=64,
+                                      messages=[{"role": "user", "content": f"request {index}"}])
+                return time.perf_counter() - started, False
+            except Exception:
+                return time.perf_counter() - started, True
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            outcomes = list(executor.map(request, range(requests)))
+        latencies = [elapsed for elapsed, failed in outcomes if not failed]
+        return latencies, sum(failed for _, failed in outcomes)
+
+    degraded = dict(stall_rate=stall_rate, stall_latency=stall_latency, error_rate=error_rate)
+    single, single_failed = measure(primary(**degraded))
+    primary_client, secondary_client = primary(**degraded), secondary()
+    router = RoutedClient([("primary", primary_client), ("secondary", secondary_client)], failure_threshold=1000)
+    routed, routed_failed = measure(router)
+    calls = primary_client.calls + secondary_client.calls
+
+    down = primary(error_rate=1.0)
+    outage_router = RoutedClient([("primary", down), ("secondary", secondary())], failure_threshold=3, cooldown=60)
+    _, outage_failed = measure(outage_router)
+
+    results = {}
+    for label, latencies in (("single", single), ("routed", routed)):
+        results[f"{label}_p50_ms"] = round(percentile(latencies, 0.5) * 1000, 1)
+        results[f"{label}_p95_ms"] = round(percentile(latencies, 0.95) * 1000, 1)
+        results[f"{label}_p99_ms"] = round(percentile(latencies, 0.99) * 1000, 1)
+    results.update({
+        "single_failed_requests": single_failed,
+        "routed_failed_requests": routed_failed,
+        "p99_speedup": round(results["single_p99_ms"] / results["routed_p99_ms"], 2),
+        "extra_calls_per_request": round(calls / requests - 1, 3),
+        "outage_failed_requests": outage_failed,
+        "outage_calls_to_down_provider": down.calls,
+    })
+    return results
+
+
+def bench_paligemma_cpu(images=8, model_id=None, image_size=112, threads=None):
+    """CPU variants against fp32: detect latency, share of identical outputs and box IoU parity.
+
+    Uses the tiny random model unless ``model_id`` is given, so parity there only shows whether the
+    variant changes greedy decoding, not detection quality.
+    """
+    import copy
+    import torch
+    from grounding_server import load_tiny_random_model
+    from transformers import PaliGemmaForConditionalGeneration, PaliGemmaProcessor
+    from paligemma_inference import configure_cpu_threads, optimize_for_cpu, infer, max_new_tokens_for
+    from paligemma_postprocess import parse_objects
+
+    configure_cpu_threads(threads)
+    if model_id:
+        model = PaliGemmaForConditionalGeneration.from_pretrained(model_id).eval()
+        processor = PaliGemmaProcessor.from_pretrained(model_id)
+        processor.tokenizer.padding_side = "left"
+    else:
+        model, processor, _ = load_tiny_random_model(image_size)
+    device = torch.device("cpu")
+    max_new_tokens = max_new_tokens_for("detect", "button", limit=True)
+    screens = [Image.open(io.BytesIO(png)).convert("RGB")
+               for png in make_screenshots(images, width=540, height=1200)]
+
+    def run(variant):
+        infer(screens[0], "detect button", max_new_tokens, variant, processor, device)
+        outputs = []
+        started = time.perf_counter()
+        for screen in screens:
+            outputs.append(infer(screen, "detect button", max_new_tokens, variant, processor, device))
+        return outputs, (time.perf_counter() - started) / len(screens)
+
+    reference, reference_latency = run(model)
+    results = {"images": images, "max_new_tokens": max_new_tokens,
+               "fp32_ms_per_image": round(reference_latency * 1000, 1)}
+    variants = {
+        "int8": dict(quantize=True),
+        "bf16": dict(quantize=False, bf16=True),
+        "int8_bf16": dict(quantize=True, bf16=True),
+    }
+    for name, options in variants.items():
+        try:
+            outputs, latency = run(optimize_for_cpu(copy.deepcopy(model), **options))
+        except (RuntimeError, NotImplementedError) as e:
+            results[f"{name}_error"] = str(e)
+            continue
+        ious = []
+        sizes = [screen.size for screen in screens]
+        for expected, actual in zip(parse_objects(reference, sizes), parse_objects(outputs, sizes)):
+            expected_boxes = [obj["xyxy"] for obj in expected]
+            actual_boxes = [obj["xyxy"] for obj in actual]
+            ious.extend(max((box_iou(box, other) for other in actual_boxes), default=0.0) for box in expected_boxes)
+        results[f"{name}_ms_per_image"] = round(latency * 1000, 1)
+        results[f"{name}_speedup"] = round(reference_latency / latency, 2)
+        results[f"{name}_output_agreement"] = round(sum(a == b for a, b in zip(reference, outputs)) / len(outputs), 2)
+        results[f"{name}_boxes_compared"] = len(ious)
+        results[f"{name}_mean_iou"] = round(statistics.mean(ious), 3) if ious else None
+    return results
+
+
+def make_paligemma_output(objects, rng, mask_fraction=0.5, max_box=0.12):
+    """Synthetic detect/segment output with ``objects`` objects in PaliGemma's location/segmentation token format."""
+    parts = []
+    for _ in range(objects):
+        y1, x1 = rng.randrange(0, 900), rng.randrange(0, 900)
+        y2 = min(1023, y1 + rng.randrange(8, int(1024 * max_box)))
+        x2 = min(1023, x1 + rng.randrange(8, int(1024 * max_box)))
+        tokens = "".join(f"<loc{value:04d}>" for value in (y1, x1, y2, x2))
+        if rng.random() < mask_fraction:
+            tokens += "".join(f"<seg{rng.randrange(128):03d}>" for _ in range(16))
+        parts.append(f"{tokens} {rng.choice(['button', 'icon', 'text field', 'switch', 'image'])}")
+    return " ; ".join(parts)
+
+
+def _legacy_overlay(image, objects):
+    # The per-object crop/mask/paste loop save_results used before overlay_objects
+    from paligemma_postprocess import COLORS, color_index
+    output_image = image.copy()
+    draw = ImageDraw.Draw(output_image)
+    for obj in objects:
+        if 'xyxy' not in obj:
+            continue
+        x1, y1, x2, y2 = obj['xyxy']
+        color = COLORS[color_index(obj.get('name'))]
+        if obj['mask'] is not None:
+            colored_mask = np.array(Image.new('RGB', (x2 - x1, y2 - y1), color))
+            masked_area = np.where(obj['mask'][..., None], colored_mask, np.array(output_image.crop((x1, y1, x2, y2))))
+            output_image.paste(Image.fromarray(masked_area), (x1, y1))
+        else:
+            draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
+        draw.text((x1, y1), str(obj.get('name', 'Unknown')), fill=color)
+    return output_image
+
+
+def bench_paligemma_postprocess(images=12, objects_per_image=200, width=540, height=1200):
+    """Per-object parse/decode/paste versus batched parsing, vectorized mask decoding and one-pass overlays."""
+    from paligemma_postprocess import parse_segmentation, parse_outputs, decode_masks, overlay_objects
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        for index, png in enumerate(make_screenshots(images, width, height)):
+            with open(f"{directory}/screen_{index}.png", 'wb') as f:
+                f.write(png)
+        screens = [Image.open(f"{directory}/screen_{index}.png").convert("RGB") for index in range(images)]
+    outputs = [make_paligemma_output(objects_per_image, rng) for _ in range(images)]
+    sizes = [screen.size for screen in screens]
+    total = images * objects_per_image
+
+    def legacy_parse():
+        return [parse_segmentation(output, *size) for output, size in zip(outputs, sizes)]
+
+    def legacy_all():
+        for screen, objects in zip(screens, legacy_parse()):
+            _legacy_overlay(screen, objects)
+
+    def batched_parse():
+        parsed = parse_outputs(outputs, sizes)
+        return parsed, decode_masks(parsed.seg, parsed.boxes)
+
+    def batched_all():
+        parsed, masks = batched_parse()
+        for index, screen in enumerate(screens):
+            selected = parsed.select(index)
+            overlay_objects(screen, parsed.boxes[selected], [parsed.names[i] for i in selected],
+                            masks[selected], parsed.has_mask[selected])
+
+    results = {
+        "images": images,
+        "objects": total,
+        "legacy_parse_ms": timed(legacy_parse, 3),
+        "batched_parse_ms": timed(batched_parse, 3),
+        "legacy_total_ms": timed(legacy_all, 3),
+        "batched_total_ms": timed(batched_all, 3),
+    }
+    results["parse_speedup"] = round(results["legacy_parse_ms"] / results["batched_parse_ms"], 1)
+    results["total_speedup"] = round(results["legacy_total_ms"] / results["batched_total_ms"], 1)
+    results["batched_objects_per_s"] = round(total / results["batched_total_ms"] * 1000)
+    return results
+
+
+class SlowStream:
+    """Text stream whose writes block for ``latency`` seconds, like stdout on a busy terminal or pipe."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def bench_logging(records=2000, payload_chars=20000, stream_latency_ms=0.2, flood=20000):
+    """Caller-side cost of logging step-sized payloads to a file and a slow stream, synchronously
+    versus through log_pipeline, and how a high-frequency event is throttled."""
+    import logging
+    from log_pipeline import setup_logging, HUMAN_FORMAT
+
+    payload = repr([{"type": "text", "text": "x" * 200}] * (payload_chars // 230))
+    stream = SlowStream(stream_latency_ms / 1000)
+
+    def run(logger, count, message):
+        calls = []
+        for index in range(count):
+            started = time.perf_counter()
+            logger.info(f"{message} {index}")
+            calls.append(time.perf_counter() - started)
+        return statistics.mean(calls) * 1e6, percentile(calls, 0.99) * 1e6
+
+    def isolated(name):
+        logger = logging.getLogger(f"benchmark.{name}")
+        logger.propagate = False
+        logger.handlers.clear()
+        return logger
+
+    results = {"records": records, "payload_chars": len(payload)}
+    with tempfile.TemporaryDirectory() as directory:
+        logger = isolated("sync")
+        logger.setLevel(logging.INFO)
+        for handler in (logging.FileHandler(f"{directory}/sync.log"), logging.StreamHandler(stream)):
+            handler.setFormatter(logging.Formatter(HUMAN_FORMAT))
+            logger.addHandler(handler)
+        mean, p99 = run(logger, records, payload)
+        results["sync_call_us"], results["sync_call_p99_us"] = round(mean, 1), round(p99, 1)
+        for handler in list(logger.handlers):
+            handler.close()
+        results["sync_file_mb"] = round(os.path.getsize(f"{directory}/sync.log") / 2 ** 20, 2)
+
+        logger = isolated("async")
+        listener = setup_logging(f"{directory}/async.log", stream=stream, rate=1e9, burst=1e9, logger=logger)
+        mean, p99 = run(logger, records, payload)
+        results["async_call_us"], results["async_call_p99_us"] = round(mean, 1), round(p99, 1)
+        listener.stop()
+        results["async_file_mb"] = round(os.path.getsize(f"{directory}/async.log") / 2 ** 20, 2)
+
+        logger = isolated("flood")
+        listener = setup_logging(f"{directory}/flood.log", stream=None, logger=logger)
+        results["flood_call_us"] = round(run(logger, flood, "Screen cursor position updated")[0], 2)
+        listener.stop()
+        with open(f"{directory}/flood.log", encoding='utf-8') as f:
+            results["flood_written"] = sum(1 for _ in f)
+        logger.handlers.clear()
+    results["call_speedup"] = round(results["sync_call_us"] / results["async_call_us"], 1)
+    return results
+
+def bench_text_entry(lengths=(10, 100, 1000), command_ms=150, text_char_ms=5, time_scale=0.2):
+    """input_text through the real adb code path against fake_adb, where every on-device command costs
+    ``command_ms`` and ``input text`` a further ``text_char_ms`` per character (scaled by ``time_scale``).
+
+    Compares the old single unescaped ``input text``, the escaped and chunked fallback, and the ADB Keyboard
+    broadcast.
+    """
+    import subprocess
+    from actions import execute_action, TEXT_ENTRY
+    from text_entry import ADB_KEYBOARD_IME
+
+    graph = ScreenGraph.generate(2)
+    state = graph.states[graph.initial]
+    rng = random.Random(0)
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789 "
+    results = {"time_scale": time_scale}
+    costs = {"command_ms": command_ms * time_scale, "text_char_ms": text_char_ms * time_scale}
+
+    for ime, label in (("com.android.inputmethod.latin/.LatinIME", "chunked"), (ADB_KEYBOARD_IME, "broadcast")):
+        with fake_adb(state.png, state.ui_xml, ime=ime, **costs):
+            TEXT_ENTRY._ime = None
+            for length in lengths:
+                text = "".join(rng.choice(alphabet) for _ in range(length))
+                if label == "chunked":
+                    results[f"legacy_{length}_ms"] = timed(lambda: subprocess.run(
+                        ['adb', 'shell', 'input', 'text', text.replace(' ', '%s')], check=True), 3, warmup=0)
+                results[f"{label}_{length}_ms"] = timed(lambda: execute_action("input_text", {"text": text}), 3,
+                                                        warmup=0)
+    TEXT_ENTRY._ime = None
+    longest = max(lengths)
+    results[f"broadcast_{longest}_speedup"] = round(results[f"legacy_{longest}_ms"] / results[f"broadcast_{longest}_ms"], 1)
+    return results
+
+
+def bench_analytics(runs=2000, screens=20, stuck_share=0.25, workers=None):
+    """analytics.py over a corpus of step journals, some with a retry hotspot (a dead tap repeated on an
+    unchanged screen): sequential and parallel throughput."""
+    import shutil
+    from concurrent.futures import ProcessPoolExecutor
+    from agent import PhoneMirroringAgent
+    from analytics import analyze, find_runs, summarize_run
+
+    workers = workers or os.cpu_count()
+    graph = ScreenGraph.generate(screens)
+
+    def record(run_dir, stuck):
+        retries = []
+
+        def policy(params):
+            if stuck and len(retries) < 3:
+                retries.append(1)
+                return [("tap", {"x": 20, "y": 20})]
+            return tap_next_policy(params)
+
+        agent = PhoneMirroringAgent(None, "claude-3-5-sonnet-20241022", 1024, 0.0, 200, journal_dir=run_dir,
+                                    client=ScriptedClient(policy), device=SimulatedDevice(graph, time_scale=0))
+        agent.task_description = f"Finish setup for account {random.randint(1, 99)}"
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+
+    with tempfile.TemporaryDirectory() as directory:
+        templates = {}
+        for stuck in (False, True):
+            templates[stuck] = os.path.join(directory, f"template_{int(stuck)}")
+            record(templates[stuck], stuck)
+        corpus = os.path.join(directory, "runs")
+        for index in range(runs):
+            stuck = index < runs * stuck_share
+            os.makedirs(os.path.join(corpus, f"run_{index:05d}"))
+            shutil.copy(os.path.join(templates[stuck], "journal.jsonl"), os.path.join(corpus, f"run_{index:05d}"))
+
+        paths = list(find_runs(corpus))
+        for path in paths:
+            # Both passes read from the page cache
+            with open(os.path.join(path, "journal.jsonl"), 'rb') as f:
+                f.read()
+        started = time.perf_counter()
+        analyze(map(summarize_run, find_runs(corpus)))
+        sequential_s = time.perf_counter() - started
+        started = time.perf_counter()
+        with ProcessPoolExecutor(workers) as executor:
+            analyze(executor.map(summarize_run, find_runs(corpus), chunksize=max(1, runs // (workers * 8))))
+        parallel_s = time.perf_counter() - started
+
+    return {
+        "runs": runs,
+        "workers": workers,
+        "sequential_runs_per_s": round(runs / sequential_s, 1),
+        "parallel_runs_per_s": round(runs / parallel_s, 1),
+        "parallel_speedup": round(sequential_s / parallel_s, 2),
+    }
+
+
+def bench_step_latency(screens=12, time_scale=0.25, model_latency=2.0, model_jitter=0.5):
+    """One agent against the simulated device; reports per-step wall time and where it goes, and how many
+    UI dumps each step costs."""
+    from agent import PhoneMirroringAgent
+
+    device = SimulatedDevice(ScreenGraph.generate(screens), time_scale=time_scale, seed=0)
+    dumps = []
+    dump_ui_xml = device.dump_ui_xml
+
+    def counted_dump():
+        dumps.append(1)
+        return dump_ui_xml()
+
+    device.dump_ui_xml = counted_dump
+    agent = PhoneMirroringAgent(
+        None, "scripted", 1024, 0.0, 200,
+        client=ScriptedClient(tap_next_policy, latency=model_latency * time_scale,
+                              jitter=model_jitter * time_scale, seed=0),
+        device=device)
+    agent.task_description = "Go through the setup flow"
+    steps = []
+    record_step = agent.record_step
+
+    def timed_record_step(response, timings):
+        steps.append(timings)
+        record_step(response, timings)
+
+    agent.record_step = timed_record_step
+    agent.run(lambda success, reason: None, lambda status: None)
+    agent.scheduler.shutdown()
+
+    walls = [timings.wall_time() for timings in steps]
+    results = {
+        "time_scale": time_scale,
+        "steps": len(steps),
+        "ui_dumps_per_step": round(len(dumps) / len(steps), 2),
+        "step_p50_ms": round(percentile(walls, 0.5) * 1000, 1),
+        "step_p95_ms": round(percentile(walls, 0.95) * 1000, 1),
+        "overlap_mean_ms": round(statistics.mean(timings.overlap() for timings in steps) * 1000, 1),
+    }
+    for stage in sorted({name for timings in steps for name in timings.durations()}):
+        results[f"{stage}_mean_ms"] = round(
+            statistics.mean(timings.durations().get(stage, 0.0) for timings in steps) * 1000, 1)
+    return results
+
+
+def bench_resume(screens=40, fail_at=30, time_scale=0.05, model_latency=2.0):
+    """A flow that fails at step ``fail_at``, then either restarts from its first screen or resumes from the
+    checkpoint. Covers a lost capture after the action ran (screen changed) and a failed action (screen
+    unchanged, so the pending response is reused)."""
+    import tempfile
+    from agent import PhoneMirroringAgent
+
+    graph = ScreenGraph.generate(screens)
+
+    def client():
+        return ScriptedClient(tap_next_policy, latency=model_latency * time_scale, seed=0)
+
+    def interrupted_run(run_dir, operation):
+        device = SimulatedDevice(graph, time_scale=time_scale, seed=0)
+        original = getattr(device, operation)
+        failed = []
+
+        def failing(*args):
+            if agent.step == fail_at and not failed:
+                failed.append(1)
+                raise Exception("Simulated device disconnect")
+            return original(*args)
+
+        setattr(device, operation, failing)
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, journal_dir=run_dir, client=client(),
+                                    device=device)
+        agent.task_description = "Go through the setup flow"
+        checkpoint_ms = []
+        checkpoint = agent.checkpoint
+
+        def timed_checkpoint(pending, ui_xml):
+            started = time.perf_counter()
+            checkpoint(pending, ui_xml)
+            checkpoint_ms.append((time.perf_counter() - started) * 1000)
+
+        agent.checkpoint = timed_checkpoint
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+        setattr(device, operation, original)
+        return device, agent.client.calls, checkpoint_ms
+
+    def finish(agent):
+        started = time.perf_counter()
+        agent.run(lambda success, reason: None, lambda status: None)
+        elapsed = time.perf_counter() - started
+        agent.scheduler.shutdown()
+        return agent.client.calls, elapsed
+
+    results = {"screens": screens, "fail_at": fail_at}
+    for label, operation in (("changed", "capture_png"), ("unchanged", "execute_action")):
+        with tempfile.TemporaryDirectory() as runs_dir:
+            run_dir = os.path.join(runs_dir, label)
+            device, calls_before, checkpoint_ms = interrupted_run(run_dir, operation)
+            restart = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, client=client(),
+                                          device=SimulatedDevice(graph, time_scale=time_scale, seed=0))
+            restart.task_description = "Go through the setup flow"
+            restart_calls, restart_s = finish(restart)
+            resumed = PhoneMirroringAgent.from_checkpoint(run_dir, None, client=client(), device=device)
+            resume_calls, resume_s = finish(resumed)
+        results[f"{label}_calls_before_failure"] = calls_before
+        results[f"{label}_restart_model_calls"] = restart_calls
+        results[f"{label}_resume_model_calls"] = resume_calls
+        results[f"{label}_restart_s"] = round(restart_s, 2)
+        results[f"{label}_resume_s"] = round(resume_s, 2)
+        results[f"{label}_model_call_reduction"] = round(1 - resume_calls / restart_calls, 3)
+        results["checkpoint_call_ms"] = round(statistics.median(checkpoint_ms), 3)
+    return results
+
+
+def image_tokens(width, height):
+    """Approximate Messages API image tokens: images are fit within 1568px and 1.15 megapixels, then
+    billed at about one token per 750 pixels."""
+    scale = min(1.0, 1568 / max(width, height), (1_150_000 / (width * height)) ** 0.5)
+    return round(width * scale) * round(height * scale) / 750
+
+
+def bench_zoom(screens=12, zoom_every=3, max_history_images=3, repeat=10):
+    """The simulated flow with full-resolution screenshots versus a low-resolution overview plus zoom,
+    where the model zooms into the Next button on every ``zoom_every``-th screen before tapping it."""
+    from agent import PhoneMirroringAgent
+    from screen import png_size
+    from zoom import overview, crop_region
+
+    graph = ScreenGraph.generate(screens)
+    state = graph.states[graph.initial]
+    overview_ms = timed(lambda: overview.__wrapped__(state.png), repeat)
+    crop_ms = timed(lambda: crop_region(state.png, 200, 1900, 680, 300), repeat)
+
+    def policy(params):
+        last = params["messages"][-1]["content"]
+        zoomed = any(block.get("type") == "tool_result" and any(
+            item.get("type") == "text" and item["text"].startswith("Zoomed region") for item in block["content"])
+            for block in last)
+        screen_index = sum(1 for message in params["messages"] if message["role"] == "user")
+        for block in last:
+            if block.get("type") == "text" and block["text"].startswith("UI XML Structure:\n"):
+                for element in parse_ui_xml(block["text"][len("UI XML Structure:\n"):]):
+                    if element.text == "Next" and screen_index % zoom_every == 0 and not zoomed:
+                        left, top, right, bottom = element.bounds
+                        return [("zoom", {"x": left, "y": top, "width": right - left, "height": bottom - top})]
+        if zoomed:
+            # The answer to a zoom carries no new screenshot; act on the screen zoomed into
+            for message in reversed(params["messages"][:-1]):
+                for block in message["content"] if message["role"] == "user" else []:
+                    if block.get("type") == "text" and block["text"].startswith("UI XML Structure:\n"):
+                        return tap_next_policy({"messages": [{"content": [block]}]})
+        return tap_next_policy(params)
+
+    def run(long_side):
+        sent = []
+
+        def counting_policy(params):
+            for message in params["messages"]:
+                for block in message["content"] if message["role"] == "user" else []:
+                    items = block.get("content") if block.get("type") == "tool_result" else [block]
+                    for item in items if isinstance(items, list) else []:
+                        if item.get("type") == "image":
+                            sent.append(png_size(base64.b64decode(item["source"]["data"])))
+            return policy(params)
+
+        client = ScriptedClient(counting_policy)
+        device = SimulatedDevice(graph, time_scale=0)
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, client=client, device=device,
+                                    max_history_images=max_history_images, overview_long_side=long_side,
+                                    full_frame_every=None)
+        agent.task_description = "Go through the setup flow"
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+        return sum(image_tokens(*size) for size in sent), client.calls
+
+    full_tokens, _ = run(None)
+    overview_tokens, overview_calls = run(800)
+    return {
+        "overview_ms": overview_ms,
+        "crop_ms": crop_ms,
+        "full_image_tokens": round(full_tokens),
+        "overview_image_tokens": round(overview_tokens),
+        "image_token_reduction": round(1 - overview_tokens / full_tokens, 3),
+        "model_calls": overview_calls,
+    }
+
+
+WEBVIEW_XML = ("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">"
+               "<node text=\"\" resource-id=\"com.example.web:id/webview\" class=\"android.webkit.WebView\" "
+               "package=\"com.example.web\" content-desc=\"\" clickable=\"false\" enabled=\"true\" "
+               "bounds=\"[0,0][1080,2400]\"></node></hierarchy>")
+
+
+def webview_graph(screens):
+    """ScreenGraph.generate with every UI dump replaced by a single opaque WebView node."""
+    graph = ScreenGraph.generate(screens)
+    buttons = {}
+    states = []
+    for state in graph.states.values():
+        button = next((element.bounds for element in state.elements if element.text == "Next"), None)
+        transitions = [{**transition, "bounds": list(button)} if "match" in transition else transition
+                       for transition in state.transitions]
+        for transition in transitions:
+            transition.pop("match", None)
+        buttons[hashlib.sha1(state.png).hexdigest()] = button
+        states.append(ScreenState(state.name, state.png, WEBVIEW_XML, state.activity, transitions))
+    return ScreenGraph(states, graph.initial), buttons
+
+
+def bench_vision_fallback(screens=8, time_scale=0.1, model_latency=2.0, detect_latency=0.6, guess_accuracy=0.4):
+    """A flow whose UI dumps are empty, with and without detected elements injected into the prompt.
+
+    Without them the scripted model guesses coordinates from the image and hits the button with
+    probability ``guess_accuracy``; the detector stands in for PaliGemma with a fixed latency.
+    """
+    from agent import PhoneMirroringAgent
+    from vision_grounding import VisionGrounder
+
+    graph, buttons = webview_graph(screens)
+    final = list(graph.states)[-1]
+
+    def detector(png, queries):
+        time.sleep(detect_latency * time_scale)
+        button = buttons[hashlib.sha1(png).hexdigest()]
+        if button is None:
+            return []
+        return [{"name": "button", "bounds": button, "center": ((button[0] + button[2]) // 2, (button[1] + button[3]) // 2)}]
+
+    def run(grounder):
+        device = SimulatedDevice(graph, time_scale=time_scale, seed=0)
+        rng = random.Random(0)
+
+        def policy(params):
+            if device.state == final:
+                return [("done", {"status": "completed", "reason": "Reached the last screen"})]
+            for block in params["messages"][-1]["content"]:
+                if block.get("type") == "text" and block["text"].startswith("Detected elements"):
+                    match = re.search(r"button center=(\d+),(\d+)", block["text"])
+                    if match:
+                        return [("tap", {"x": int(match.group(1)), "y": int(match.group(2))})]
+            left, top, right, bottom = buttons[hashlib.sha1(device.graph.states[device.state].png).hexdigest()]
+            y = (top + bottom) // 2 if rng.random() < guess_accuracy else top - 150
+            return [("tap", {"x": (left + right) // 2, "y": y})]
+
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 400, device=device, grounder=grounder,
+                                    client=ScriptedClient(policy, latency=model_latency * time_scale, seed=0))
+        agent.task_description = "Go through the web checkout"
+        result = {}
+        started = time.perf_counter()
+        agent.run(lambda success, reason: result.update(success=success), lambda status: None)
+        agent.scheduler.shutdown()
+        retries = device.action_count - (len(device.visited) - 1)
+        return result.get("success", False), time.perf_counter() - started, agent.step, retries
+
+    grounder = VisionGrounder(detector)
+    baseline = run(None)
+    grounded = run(grounder)
+    return {
+        "screens": screens,
+        "time_scale": time_scale,
+        "guessing_turns": baseline[2],
+        "grounded_turns": grounded[2],
+        "guessing_retries": baseline[3],
+        "grounded_retries": grounded[3],
+        "guessing_task_s": round(baseline[1], 2),
+        "grounded_task_s": round(grounded[1], 2),
+        "detections": grounder.detections,
+        "detection_cache_hits": grounder.cache_hits,
+    }
+
+
+def bench_startup(repeat=5, time_scale=0.25):
+    """Cold import of the agent module, and time from constructing an agent to its first model request.
+
+    ``eager_first_request_ms`` adds back the capture and dimensions query the constructor used to make.
+    """
+    import subprocess
+    from agent import PhoneMirroringAgent
+
+    probe = ("import sys, time; started = time.perf_counter(); import agent; "
+             "print(time.perf_counter() - started, sum(name in sys.modules for name in ('pyautogui', 'PyQt5')))")
+    imports = []
+    gui_modules = 0
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         text=True)
+        seconds, loaded = output.split()
+        imports.append(float(seconds))
+        gui_modules = max(gui_modules, int(loaded))
+
+    graph = ScreenGraph.generate(2)
+
+    def first_request(eager):
+        requested = []
+
+        def policy(params):
+            requested.append(time.perf_counter())
+            return [("done", {"status": "completed", "reason": "Measured"})]
+
+        started = time.perf_counter()
+        device = SimulatedDevice(graph, time_scale=time_scale, seed=0)
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 20, client=ScriptedClient(policy), device=device)
+        if eager:
+            device.capture_png()
+            device.screen_dimensions()
+        constructed = time.perf_counter()
+        agent.task_description = "Measure startup"
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+        return constructed - started, requested[0] - started
+
+    lazy = [first_request(False) for _ in range(repeat)]
+    eager = [first_request(True) for _ in range(repeat)]
+    return {
+        "time_scale": time_scale,
+        "import_agent_ms": round(statistics.median(imports) * 1000, 1),
+        "gui_modules_loaded": gui_modules,
+        "construct_ms": round(statistics.median(constructed for constructed, _ in lazy) * 1000, 2),
+        "first_request_ms": round(statistics.median(first for _, first in lazy) * 1000, 1),
+        "eager_construct_ms": round(statistics.median(constructed for constructed, _ in eager) * 1000, 1),
+        "eager_first_request_ms": round(statistics.median(first for _, first in eager) * 1000, 1),
+    }
+
+
+def bench_preview(screens=12, time_scale=0.25, model_latency=2.0, max_fps=8):
+    """Live preview fed from the agent's own observations: render cost per frame (off the UI thread),
+    how many frames get coalesced, and whether the preview adds device captures or step latency."""
+    from agent import PhoneMirroringAgent
+    from preview import PreviewFeed, decode_thumbnail, draw_action_overlay
+
+    graph = ScreenGraph.generate(screens)
+    png = graph.states[graph.initial].png
+    render_ms = timed(lambda: draw_action_overlay(*decode_thumbnail(png, (240, 520)),
+                                                  ("tap", {"x": 540, "y": 2075}, (270, 2000, 810, 2150))), 20)
+    thumbnail, _ = decode_thumbnail(png, (240, 520))
+    ui_copy_ms = timed(lambda: thumbnail.tobytes("raw", "RGB"), 50)
+
+    def run(with_preview):
+        device = SimulatedDevice(graph, time_scale=time_scale, seed=0)
+        captures = []
+        capture_png = device.capture_png
+
+        def counted_capture():
+            captures.append(1)
+            return capture_png()
+
+        device.capture_png = counted_capture
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, device=device,
+                                    client=ScriptedClient(tap_next_policy, latency=model_latency * time_scale, seed=0))
+        agent.task_description = "Go through the setup flow"
+        feed = None
+        frames = []
+        if with_preview:
+            feed = PreviewFeed(frames.append, max_size=(240, 520), max_fps=max_fps)
+            agent.scheduler.add_listener(feed.frame)
+            agent.action_listeners.append(feed.action)
+            feed.start()
+        started = time.perf_counter()
+        agent.run(lambda success, reason: None, lambda status: None)
+        elapsed = time.perf_counter() - started
+        agent.scheduler.shutdown()
+        if feed is not None:
+            feed.stop()
+        return len(captures), elapsed, feed
+
+    baseline_captures, baseline_s, _ = run(False)
+    preview_captures, preview_s, feed = run(True)
+    return {
+        "render_ms": render_ms,
+        "ui_copy_ms": ui_copy_ms,
+        "updates_submitted": feed.submitted,
+        "updates_rendered": feed.rendered,
+        "extra_captures": preview_captures - baseline_captures,
+        "baseline_task_s": round(baseline_s, 2),
+        "preview_task_s": round(preview_s, 2),
+    }
+
+
+def bench_simulated_agents(agents=50, screens=6, time_scale=0.1, model_latency=2.0, model_jitter=0.5,
+                           max_history_images=5):
+    from agent import PhoneMirroringAgent
+
+    graph = ScreenGraph.generate(screens)
+    outcomes = []
+    lock = threading.Lock()
+
+    def run_agent(index):
+        agent = PhoneMirroringAgent(
+            None, "scripted", 1024, 0.0, 200, max_history_images=max_history_images,
+            client=ScriptedClient(tap_next_policy, latency=model_latency * time_scale,
+                                  jitter=model_jitter * time_scale, seed=index),
+            device=SimulatedDevice(graph, time_scale=time_scale, seed=index))
+        agent.task_description = "Go through the setup flow"
+        result = {}
+        started = time.perf_counter()
+        agent.run(lambda success, reason: result.update(success=success), lambda status: None)
+        agent.scheduler.shutdown()
+        with lock:
+            outcomes.append((result.get("success", False), time.perf_counter() - started,
+                             agent.device.action_count, agent.conversation.blobs.total_bytes))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run_agent, args=(i,), name=f"agent-{i}") for i in range(agents)]
+    for thread in threads:
+        thread.start()
+    peak_threads = threading.active_count()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    durations = sorted(duration for _, duration, _, _ in outcomes)
+    steps = sum(actions for _, _, actions, _ in outcomes)
+    return {
+        "agents": agents,
+        "screens": screens,
+        "time_scale": time_scale,
+        "wall_s": round(wall, 2),
+        "steps": steps,
+        "steps_per_s": round(steps / wall, 1),
+        "tasks_per_min": round(len(outcomes) / wall * 60, 1),
+        "task_p50_s": round(percentile(durations, 0.5), 2),
+        "task_p95_s": round(percentile(durations, 0.95), 2),
+        "history_mb_per_agent": round(sum(size for _, _, _, size in outcomes) / len(outcomes) / 2 ** 20, 2),
+        "peak_threads": peak_threads,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def bench_metrics(threads=8, updates=20000, agents=20, screens=6, time_scale=0.05, model_latency=2.0,
+                  scrape_interval=0.05):
+    """Hot-path cost of counter and histogram updates from many threads (per-thread shards versus one
+    locked dict), then a simulated fleet reporting to a live /metrics endpoint that is scraped while it
+    runs."""
+    import urllib.request
+    from agent import PhoneMirroringAgent
+    from metrics import AgentMetrics, MetricsRegistry, start_metrics_server
+
+    class LockedCounter:
+        def __init__(self):
+            self.values = {}
+            self.lock = threading.Lock()
+
+        def inc(self, amount=1, labels=()):
+            with self.lock:
+                self.values[labels] = self.values.get(labels, 0) + amount
+
+    def hammer(update):
+        def work(index):
+            labels = (f"device-{index}", "model")
+            for i in range(updates):
+                update(i * 0.001, labels)
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return threads * updates / (time.perf_counter() - started)
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "", ("device", "stage"))
+    histogram = registry.histogram("bench_seconds", "", ("device", "stage"))
+    locked = LockedCounter()
+    sharded_rate = hammer(lambda value, labels: (counter.inc(1, labels), histogram.observe(value, labels)))
+    locked_rate = hammer(lambda value, labels: (locked.inc(1, labels), locked.inc(value, labels)))
+
+    registry = MetricsRegistry()
+    server = start_metrics_server(registry, port=0)
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    graph = ScreenGraph.generate(screens)
+    actions = []
+    running = threading.Event()
+    running.set()
+    scrape_times = []
+
+    def scrape():
+        started = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode('utf-8')
+        scrape_times.append((time.perf_counter() - started) * 1000)
+        return text
+
+    def scrape_loop():
+        while running.is_set():
+            scrape()
+            time.sleep(scrape_interval)
+
+    def run_agent(index):
+        agent = PhoneMirroringAgent(
+            None, "scripted", 1024, 0.0, 200,
+            client=ScriptedClient(tap_next_policy, latency=model_latency * time_scale, seed=index),
+            device=SimulatedDevice(graph, time_scale=time_scale, seed=index),
+            metrics=AgentMetrics(f"sim-{index}", registry))
+        agent.task_description = "Go through the setup flow"
+        agent.run(lambda success, reason: None, lambda status: None)
+        agent.scheduler.shutdown()
+        actions.append(agent.device.action_count)
+
+    scraper = threading.Thread(target=scrape_loop)
+    scraper.start()
+    started = time.perf_counter()
+    fleet = [threading.Thread(target=run_agent, args=(i,)) for i in range(agents)]
+    for thread in fleet:
+        thread.start()
+    for thread in fleet:
+        thread.join()
+    wall = time.perf_counter() - started
+    running.clear()
+    scraper.join()
+    text = scrape()
+    server.shutdown()
+
+    return {
+        "threads": threads,
+        "sharded_updates_per_s": round(sharded_rate),
+        "locked_updates_per_s": round(locked_rate),
+        "update_speedup": round(sharded_rate / locked_rate, 2),
+        "agents": agents,
+        "fleet_wall_s": round(wall, 2),
+        "scrapes": len(scrape_times),
+        "scrape_p50_ms": round(percentile(sorted(scrape_times), 0.5), 2),
+        "scrape_p95_ms": round(percentile(sorted(scrape_times), 0.95), 2),
+        "scrape_bytes": len(text),
+        "steps": sum(actions),
+    }
+
+
+BENCHMARKS = {
+    "analytics": bench_analytics,
+    "conversation_memory": bench_conversation_memory,
+    "export": bench_export,
+    "frame_grabber": bench_frame_grabber,
+    "frame_diff": bench_frame_diff,
+    "grounding_server": bench_grounding_server,
+    "logging": bench_logging,
+    "macros": bench_macros,
+    "metrics": bench_metrics,
+    "model_failover": bench_model_failover,
+    "paligemma_cpu": bench_paligemma_cpu,
+    "paligemma_postprocess": bench_paligemma_postprocess,
+    "preview": bench_preview,
+    "request_building": bench_request_building,
+    "resume": bench_resume,
+    "screenshot_encoding": bench_screenshot_encoding,
+    "simulated_agents": bench_simulated_agents,
+    "startup": bench_startup,
+    "step_latency": bench_step_latency,
+    "text_entry": bench_text_entry,
+    "ui_xml": bench_ui_xml,
+    "vision_fallback": bench_vision_fallback,
+    "zoom": bench_zoom,
+}
+
+HIGHER_IS_BETTER = ("_per_s", "_per_min", "_reduction", "_speedup", "_iou", "_agreement")
+LOWER_IS_BETTER = ("_ms", "_s", "_mb")
+
+
+def metric_direction(metric):
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(results, baseline, tolerance=0.15):
+    """Compare timing and throughput metrics with a baseline; changes within ``tolerance`` count as unchanged."""
+    comparison = {}
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            direction = metric_direction(metric)
+            previous = baseline.get(name, {}).get(metric)
+            if not direction or not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                continue
+            change = (value - previous) / previous if previous else 0.0
+            if change * direction < -tolerance:
+                status = "regressed"
+            elif change * direction > tolerance:
+                status = "improved"
+            else:
+                status = "unchanged"
+            comparison[f"{name}.{metric}"] = {"baseline": previous, "current": value,
+                                              "change_pct": round(change * 100, 1), "status": status}
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Android Phone Agent benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(sorted(BENCHMARKS))}")
+    parser.add_argument("--output", help="Also write the results as JSON to this file (e.g. to save a baseline)")
+    parser.add_argument("--baseline", help="Compare against results previously saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Relative change treated as noise when comparing (default: 0.15)")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print(f"Running {name}...", file=sys.stderr)
+        try:
+            results[name] = BENCHMARKS[name]()
+        except ModuleNotFoundError as e:
+            # e.g. torch for the grounding server; the rest of the suite still runs
+            print(f"Skipping {name}: {str(e)}", file=sys.stderr)
+            results[name] = {"skipped": str(e)}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if not args.baseline:
+        print(json.dumps(results, indent=2))
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    comparison = compare(results, baseline, args.tolerance)
+    regressions = sorted(key for key, entry in comparison.items() if entry["status"] == "regressed")
+    print(json.dumps({"results": results, "comparison": comparison, "regressions": regressions}, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,8 @@ Core Instructions:
    - Error messages or system responses
    - Verify if previous coordinates were effective
    - DO NOT reuse coordinates that failed to produce results
-   - For text input, only use English characters and numbers
-   - Avoid using non-ASCII characters in input_text tool
+   - input_text can only type non-ASCII characters (accents, other scripts, emoji) when the ADB Keyboard
+     input method is active; if it reports the text was not executed, retry with ASCII text
 
 2. UI ELEMENT TARGETING:
    - Use UI XML structure to identify exact element bounds
@@ -26,6 +26,12 @@ Core Instructions:
      * center_y = (top + bottom) / 2
    - Verify element properties (clickable, enabled, etc.)
    - Use text attributes to confirm correct element
+   - If the UI XML is nearly empty (WebViews, games, Flutter apps), a "Detected elements" list found in the
+     screenshot may follow it. It is not XML: each line gives an element's class, label, center and bounds
+     in screen pixels; use those centers instead of guessing coordinates from the image
+   - The screenshot may be a scaled-down overview; coordinates are always in screen pixels, as in the
+     XML bounds. When small text or icons matter and the XML doesn't settle it, use the zoom tool on that
+     region instead of guessing
 
 3. PRECISE ACTIONS:
    - When interacting with UI elements (buttons, icons, text fields):
@@ -33,7 +39,6 @@ Core Instructions:
      * Verify element is interactive (clickable="true")
      * Check element state (enabled="true")
      * Use resource-id or content-desc for confirmation
-     * For text input, only use English characters and numbers
    - Verify each action's result before proceeding
    - If an action fails, try alternative approaches
    - Always wait for screen transitions or animations
@@ -97,8 +102,10 @@ Remember:
    - tap: For buttons and icons (at center)
    - long_press: For context menus (at center)
    - swipe: For scrolling (between centers)
-   - input_text: For text fields (English characters and numbers only)
+   - input_text: For text fields (non-ASCII needs the ADB Keyboard input method)
    - press_key: For system navigation
+   - batch: For a known sequence of actions that needs no screenshot in between (e.g. tap a field, input text, press enter)
+   - zoom: To read fine detail in part of the last screenshot (no action is taken on the device)
 4. If multiple attempts fail, consider using the "done" tool with appropriate failure reason
 """
 
@@ -211,6 +218,66 @@ TOOLS = [
             "required": ["x", "y"]
         }
     },
+    {
+        "name": "batch",
+        "description": "Execute a sequence of tap, swipe, input_text, press_key and long_press actions in a single round trip without intermediate screenshots. Only use it when the outcome of each action is predictable; a single screenshot is returned after the last action.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "actions": {
+                    "type": "array",
+                    "description": "Actions to execute in order",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {
+                                "type": "string",
+                                "enum": ["tap", "swipe", "input_text", "press_key", "long_press"],
+                                "description": "Tool to execute"
+                            },
+                            "input": {
+                                "type": "object",
+                                "description": "Input for the tool, using the same fields as the standalone tool"
+                            },
+                            "delay_ms": {
+                                "type": "integer",
+                                "description": "Delay after this action in milliseconds before the next one runs",
+                                "default": 500
+                            }
+                        },
+                        "required": ["name", "input"]
+                    }
+                }
+            },
+            "required": ["actions"]
+        }
+    },
+    {
+        "name": "zoom",
+        "description": "Get a full-resolution crop of a region of the last screenshot, for reading small text or icons. Nothing happens on the device. Coordinates are in screen pixels; the result explains how to map points in the crop back to the screen.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "x": {
+                    "type": "integer",
+                    "description": "Left edge of the region in screen pixels"
+                },
+                "y": {
+                    "type": "integer",
+                    "description": "Top edge of the region in screen pixels"
+                },
+                "width": {
+                    "type": "integer",
+                    "description": "Width of the region in screen pixels"
+                },
+                "height": {
+                    "type": "integer",
+                    "description": "Height of the region in screen pixels"
+                }
+            },
+            "required": ["x", "y", "width", "height"]
+        }
+    },
     {
         "name": "done",
         "description": "Indicate that the task is completed or cannot be completed",
@@ -236,6 +303,11 @@ DEFAULT_MODEL = "claude-3-5-sonnet-20241022"
 DEFAULT_MAX_TOKENS = 2048
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_MESSAGES = 20
+# Screenshots kept in each request; older ones are replaced by a placeholder so memory and tokens stay flat
+DEFAULT_MAX_HISTORY_IMAGES = 5
+DEFAULT_RUNS_DIR = "runs"
+DEFAULT_MACROS_DIR = "macros"
+DEFAULT_ACTION_CACHE_PATH = "action_cache.sqlite3"
 AVAILABLE_MODELS = [
     "claude-3-5-sonnet-20241022",
     "claude-3-5-sonnet-20240620",
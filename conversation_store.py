@@ -0,0 +1,179 @@
+import os
+import base64
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from anthropic.types import MessageParam, TextBlockParam, ImageBlockParam
+
+
+class BlobTable:
+    """Content-addressed store for binary blobs such as screenshots.
+
+    Identical blobs are stored once. When the resident size exceeds ``max_resident_bytes`` the least
+    recently used blobs are written to ``spill_dir`` (a temporary directory by default) and read back
+    on demand.
+    """
+
+    def __init__(self, spill_dir=None, max_resident_bytes=64 * 1024 * 1024):
+        self.spill_dir = spill_dir
+        self.max_resident_bytes = max_resident_bytes
+        self.resident_bytes = 0
+        self._resident = OrderedDict()
+        self._sizes = {}
+        self._spilled = set()
+        self._tempdir = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data):
+        key = self.key_for(data)
+        with self._lock:
+            if key in self._resident:
+                self._resident.move_to_end(key)
+            elif key not in self._spilled:
+                self._resident[key] = bytes(data)
+                self._sizes[key] = len(data)
+                self.resident_bytes += len(data)
+                self._evict()
+        return key
+
+    def get(self, key):
+        with self._lock:
+            data = self._resident.get(key)
+            if data is not None:
+                self._resident.move_to_end(key)
+                return data
+            if key not in self._spilled:
+                raise KeyError(key)
+            path = self._path(key)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def size(self, key):
+        return self._sizes[key]
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def _evict(self):
+        while self.resident_bytes > self.max_resident_bytes and len(self._resident) > 1:
+            if self.spill_dir is None:
+                self._tempdir = tempfile.TemporaryDirectory(prefix="phone_agent_blobs_")
+                self.spill_dir = self._tempdir.name
+            os.makedirs(self.spill_dir, exist_ok=True)
+            key, data = self._resident.popitem(last=False)
+            with open(self._path(key), 'wb') as f:
+                f.write(data)
+            self._spilled.add(key)
+            self.resident_bytes -= len(data)
+
+    def __contains__(self, key):
+        return key in self._resident or key in self._spilled
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+
+class ConversationStore:
+    """Conversation history that keeps screenshots once, as raw bytes, referenced by content hash.
+
+    Image blocks are stored as ``{"type": "image", "source": {"type": "blob", "media_type": ..., "key": ...}}``
+    and only turned back into base64 ``ImageBlockParam`` dicts when an API payload is built.
+    """
+
+    def __init__(self, blobs=None):
+        self.blobs = blobs if blobs is not None else BlobTable()
+        self.messages: list[MessageParam] = []
+
+    def image_block(self, data, media_type="image/png", region=None):
+        """``region`` tags a crop of the screen with its (left, top, right, bottom) bounds; it isn't sent."""
+        block = {
+            "type": "image",
+            "source": {"type": "blob", "media_type": media_type, "key": self.blobs.put(data)}
+        }
+        if region is not None:
+            block["region"] = list(region)
+        return block
+
+    def _compact_block(self, block):
+        if not isinstance(block, dict):
+            return block
+        if block.get('type') == 'image' and block['source'].get('type') == 'base64':
+            return self.image_block(base64.b64decode(block['source']['data']), block['source']['media_type'])
+        if block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+            return {**block, "content": [self._compact_block(item) for item in block['content']]}
+        return block
+
+    def append(self, message):
+        content = message.get('content')
+        if isinstance(content, list):
+            message = MessageParam(role=message['role'], content=[self._compact_block(block) for block in content])
+        self.messages.append(message)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def image_bytes(self, block):
+        source = block['source']
+        if source['type'] == 'blob':
+            return self.blobs.get(source['key'])
+        return base64.b64decode(source['data'])
+
+    def _materialize_block(self, block, keep_image):
+        if not isinstance(block, dict):
+            return block
+        if block.get('type') == 'image' and block['source'].get('type') == 'blob':
+            if not keep_image:
+                return TextBlockParam(type="text", text="[Earlier screenshot omitted]")
+            return ImageBlockParam(
+                type="image",
+                source={
+                    "type": "base64",
+                    "media_type": block['source']['media_type'],
+                    "data": base64.b64encode(self.blobs.get(block['source']['key'])).decode('utf-8')
+                }
+            )
+        if block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+            return {**block, "content": [self._materialize_block(item, keep_image) for item in block['content']]}
+        return block
+
+    def image_count(self, block):
+        if isinstance(block, dict):
+            if block.get('type') == 'image':
+                return 1
+            if block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+                return sum(self.image_count(item) for item in block['content'])
+        return 0
+
+    def to_api_messages(self, max_images=None):
+        """Build the API payload, optionally keeping only the ``max_images`` most recent screenshots."""
+        total_images = sum(self.image_count(block) for message in self.messages
+                           if isinstance(message.get('content'), list) for block in message['content'])
+        skip = max(0, total_images - max_images) if max_images is not None else 0
+        api_messages = []
+        for message in self.messages:
+            content = message.get('content')
+            if not isinstance(content, list) or not any(self.image_count(block) for block in content):
+                api_messages.append(message)
+                continue
+            blocks = []
+            for block in content:
+                count = self.image_count(block)
+                blocks.append(self._materialize_block(block, keep_image=skip < count or count == 0))
+                skip = max(0, skip - count)
+            api_messages.append(MessageParam(role=message['role'], content=blocks))
+        return api_messages
@@ -0,0 +1,48 @@
+from screen import dump_ui_xml, capture_png, get_screen_dimensions, get_foreground_activity
+from actions import execute_action, execute_batch
+
+
+class DeviceBackend:
+    """What the agent needs from a phone: frames, UI dumps, dimensions and input actions."""
+
+    def capture_png(self):
+        raise NotImplementedError
+
+    def dump_ui_xml(self):
+        raise NotImplementedError
+
+    def screen_dimensions(self):
+        raise NotImplementedError
+
+    def foreground_activity(self):
+        return ""
+
+    def execute_action(self, name, params):
+        raise NotImplementedError
+
+    def execute_batch(self, actions):
+        """Run (name, params, delay_ms) actions and return a result string per action."""
+        raise NotImplementedError
+
+
+class AdbDevice(DeviceBackend):
+    def __init__(self, device_type="android"):
+        self.device_type = device_type
+
+    def capture_png(self):
+        return capture_png()
+
+    def dump_ui_xml(self):
+        return dump_ui_xml()
+
+    def screen_dimensions(self):
+        return get_screen_dimensions(self.device_type)
+
+    def foreground_activity(self):
+        return get_foreground_activity()
+
+    def execute_action(self, name, params):
+        return execute_action(name, params)
+
+    def execute_batch(self, actions):
+        return execute_batch(actions)
@@ -1,12 +1,18 @@
+import io
 import os
-import datetime
 import json
 import base64
-from PyQt5.QtWidgets import QFileDialog, QMessageBox
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
 from anthropic.types import TextBlock, ToolUseBlock
 from constants import SYSTEM_PROMPT
 from jinja2 import Environment, FileSystemLoader
 
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAIL_SIZE = (360, 800)
+_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif"}
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, TextBlock):
@@ -23,69 +29,80 @@ class CustomJSONEncoder(json.JSONEncoder):
             }
         return super().default(obj)
 
-def export_conversation(parent, agent):
-    if not agent or not agent.conversation:
-        QMessageBox.warning(parent, "No Conversation", "There is no conversation to export.")
-        return
-
-    default_folder_name = f"phone_mirroring_conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    folder_path = QFileDialog.getExistingDirectory(parent, "Select Export Folder", "", QFileDialog.ShowDirsOnly)
-    
-    if not folder_path:
-        return
+def image_key(block):
+    source = block['source']
+    if source['type'] == 'blob':
+        return source['key']
+    return hashlib.sha256(base64.b64decode(source['data'])).hexdigest()
 
-    export_folder = os.path.join(folder_path, default_folder_name)
-    os.makedirs(export_folder, exist_ok=True)
+def collect_images(conversation):
+    # Identical frames share one file, keyed by content hash
+    images = {}
 
-    try:
-        parameters = {
-            "Model": agent.model,
-            "Max Tokens": agent.max_tokens,
-            "Temperature": agent.temperature,
-            "Max Messages": agent.max_messages,
-            "Task Description": agent.task_description
-        }
+    def visit(block):
+        if isinstance(block, dict) and block.get('type') == 'image':
+            key = image_key(block)
+            if key not in images:
+                extension = _EXTENSIONS.get(block['source']['media_type'], 'png')
+                images[key] = {
+                    "block": block,
+                    "filename": f"screenshot_{key[:16]}.{extension}",
+                    "thumbnail": f"thumbnail_{key[:16]}.jpg"
+                }
+        elif isinstance(block, dict) and block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+            for item in block['content']:
+                visit(item)
 
-        html_content = generate_html_content(agent.conversation, export_folder, parameters)
+    for message in conversation:
+        content = message.get('content')
+        if isinstance(content, list):
+            for block in content:
+                visit(block)
+    return images
 
-        with open(os.path.join(export_folder, "conversation.html"), 'w', encoding='utf-8') as f:
-            f.write(html_content)
+def write_image(data, export_folder, filename, thumbnail):
+    with open(os.path.join(export_folder, filename), 'wb') as f:
+        f.write(data)
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail(THUMBNAIL_SIZE)
+    image.convert('RGB').save(os.path.join(export_folder, thumbnail), format='JPEG', quality=80)
 
-        json_file_path = os.path.join(export_folder, "conversation.json")
-        with open(json_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(agent.conversation, json_file, cls=CustomJSONEncoder, indent=2)
+def write_images(conversation, images, export_folder, progress=None, max_workers=4):
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export") as executor:
+        futures = [
+            executor.submit(write_image, conversation.image_bytes(entry["block"]), export_folder,
+                            entry["filename"], entry["thumbnail"])
+            for entry in images.values()
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress:
+                progress(done)
 
-        QMessageBox.information(parent, "Export Successful", f"Conversation exported to {export_folder}")
-    except Exception as e:
-        QMessageBox.critical(parent, "Export Failed", f"Failed to export conversation: {str(e)}")
-
-def generate_html_content(conversation, export_folder, parameters):
-    env = Environment(loader=FileSystemLoader('.'))
-    template = env.get_template('conversation_template.html')
+def build_conversation_data(conversation, images):
+    def image_item(block):
+        entry = images[image_key(block)]
+        return {"type": "image", "filename": entry["filename"], "thumbnail": entry["thumbnail"]}
 
     conversation_data = []
-    screenshot_count = 0
-
     for message in conversation:
         content = []
-        for item in message.get('content', []):
+        items = message.get('content', [])
+        if isinstance(items, str):
+            items = [{"type": "text", "text": items}]
+        for item in items:
             if isinstance(item, TextBlock) or (isinstance(item, dict) and item.get('type') == 'text'):
                 content.append({
                     "type": "text",
                     "text": item.text if isinstance(item, TextBlock) else item['text']
                 })
             elif isinstance(item, dict) and item.get('type') == 'image':
-                screenshot_filename = f"screenshot_{screenshot_count}.jpg"
-                screenshot_path = os.path.join(export_folder, screenshot_filename)
-                with open(screenshot_path, 'wb') as f:
-                    f.write(base64.b64decode(item['source']['data']))
-                content.append({"type": "image", "filename": screenshot_filename})
-                screenshot_count += 1
-            elif isinstance(item, ToolUseBlock):
+                content.append(image_item(item))
+            elif isinstance(item, ToolUseBlock) or (isinstance(item, dict) and item.get('type') == 'tool_use'):
                 content.append({
                     "type": "tool_use",
-                    "name": item.name,
-                    "input": item.input
+                    "name": item.name if isinstance(item, ToolUseBlock) else item['name'],
+                    "input": item.input if isinstance(item, ToolUseBlock) else item['input']
                 })
             elif isinstance(item, dict) and item['type'] == 'tool_result':
                 tool_result_content = []
@@ -93,23 +110,78 @@ def generate_html_content(conversation, export_folder, parameters):
                     if content_item['type'] == 'text':
                         tool_result_content.append({"type": "text", "text": content_item['text']})
                     elif content_item['type'] == 'image':
-                        screenshot_filename = f"screenshot_{screenshot_count}.jpg"
-                        screenshot_path = os.path.join(export_folder, screenshot_filename)
-                        with open(screenshot_path, 'wb') as f:
-                            f.write(base64.b64decode(content_item['source']['data']))
-                        tool_result_content.append({"type": "image", "filename": screenshot_filename})
-                        screenshot_count += 1
+                        tool_result_content.append(image_item(content_item))
                 content.append({"type": "tool_result", "content": tool_result_content})
 
         conversation_data.append({
             "role": message.get('role', ''),
             "content": content
         })
+    return conversation_data
+
+def render_html(conversation_data, parameters, path):
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+    template = env.get_template('conversation_template.html')
+    # Stream the rendered template to disk instead of building the whole page in memory
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in template.generate(
+            parameters=parameters,
+            system_prompt=SYSTEM_PROMPT,
+            conversation=conversation_data
+        ):
+            f.write(chunk)
+
+def externalize_images(conversation, images):
+    def convert(block):
+        if isinstance(block, dict) and block.get('type') == 'image':
+            entry = images[image_key(block)]
+            return {"type": "image", "source": {"type": "file", "media_type": block['source']['media_type'],
+                                                "path": entry["filename"]}}
+        if isinstance(block, dict) and block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+            return {**block, "content": [convert(item) for item in block['content']]}
+        return block
 
-    html_content = template.render(
+    for message in conversation:
+        content = message.get('content')
+        if isinstance(content, list):
+            content = [convert(block) for block in content]
+        yield {"role": message['role'], "content": content}
+
+def write_json(conversation, images, path):
+    with open(path, 'w', encoding='utf-8') as json_file:
+        json.dump(list(externalize_images(conversation, images)), json_file, cls=CustomJSONEncoder, indent=2)
+
+def export_run(conversation, export_folder, parameters, progress=None, max_workers=4):
+    """Write screenshots, thumbnails, conversation.html and conversation.json; returns the step count.
+
+    ``progress(done, total)`` is called as each step finishes, from the calling thread. The agent may still
+    be appending to ``conversation``, so the export covers the messages present when it starts.
+    """
+    os.makedirs(export_folder, exist_ok=True)
+    messages = list(conversation)
+    images = collect_images(messages)
+    total = len(images) + 2
+
+    def report(done):
+        if progress:
+            progress(done, total)
+
+    write_images(conversation, images, export_folder, report, max_workers)
+    render_html(build_conversation_data(messages, images), parameters,
+                os.path.join(export_folder, "conversation.html"))
+    report(len(images) + 1)
+    write_json(messages, images, os.path.join(export_folder, "conversation.json"))
+    report(total)
+    return total
+
+def generate_html_content(conversation, export_folder, parameters):
+    messages = list(conversation)
+    images = collect_images(messages)
+    write_images(conversation, images, export_folder)
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+    template = env.get_template('conversation_template.html')
+    return template.render(
         parameters=parameters,
         system_prompt=SYSTEM_PROMPT,
-        conversation=conversation_data
+        conversation=build_conversation_data(messages, images)
     )
-
-    return html_content
\ No newline at end of file
@@ -0,0 +1,142 @@
+import io
+import numpy as np
+from PIL import Image
+
+# Frames are compared at 1/DOWNSAMPLE resolution in blocks of BLOCK_SIZE screen pixels
+DOWNSAMPLE = 4
+BLOCK_SIZE = 32
+# Largest grey level change (0-255) of a downsampled pixel still treated as unchanged. Downsampling averages,
+# so a digit changing in small text moves a pixel by only a few levels; screencap frames are lossless, and
+# noisy sources (screenrecord) exceed MAX_CHANGED_FRACTION and fall back to full frames
+DIFF_THRESHOLD = 2
+# Changed regions covering more of the screen than this are sent as a full frame instead
+MAX_CHANGED_FRACTION = 0.3
+MAX_REGIONS = 4
+FULL_FRAME_EVERY = 5
+
+
+def _merge(boxes):
+    """Union overlapping (left, top, right, bottom) boxes until none overlap."""
+    boxes = sorted(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def _area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def changed_blocks(previous, current, threshold=DIFF_THRESHOLD, cells=BLOCK_SIZE // DOWNSAMPLE):
+    """Boolean grid of blocks that differ between two downsampled greyscale frames of the same size."""
+    diff = np.abs(current.astype(np.int16) - previous.astype(np.int16))
+    height, width = diff.shape
+    rows, columns = -(-height // cells), -(-width // cells)
+    padded = np.zeros((rows * cells, columns * cells), dtype=np.int16)
+    padded[:height, :width] = diff
+    return padded.reshape(rows, cells, columns, cells).max(axis=(1, 3)) > threshold
+
+
+def block_regions(mask, block_size=BLOCK_SIZE, max_regions=MAX_REGIONS):
+    """Bounding boxes in screen pixels around the changed blocks, one per band of changed rows, grown by
+    one block and merged down to at most ``max_regions``."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return []
+    bands = np.split(rows, np.flatnonzero(np.diff(rows) > 2) + 1)
+    boxes = []
+    for band in bands:
+        columns = np.flatnonzero(mask[band[0]:band[-1] + 1].any(axis=0))
+        boxes.append((max(0, int(columns[0]) - 1), max(0, int(band[0]) - 1),
+                      min(mask.shape[1], int(columns[-1]) + 2), min(mask.shape[0], int(band[-1]) + 2)))
+    boxes = _merge(boxes)
+    while len(boxes) > max_regions:
+        # Join the pair whose union adds the least area
+        pairs = [(i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes))]
+        i, j = min(pairs, key=lambda pair: _area(_union(boxes[pair[0]], boxes[pair[1]]))
+                   - _area(boxes[pair[0]]) - _area(boxes[pair[1]]))
+        union = _union(boxes[i], boxes[j])
+        boxes = _merge([box for k, box in enumerate(boxes) if k not in (i, j)] + [union])
+    return [tuple(value * block_size for value in box) for box in boxes]
+
+
+class FrameDiff:
+    """Decides whether a screenshot goes to the model in full or as crops of the regions that changed since
+    the previous one.
+
+    Every frame is compared with the last frame sent, so the full frame plus the crops sent after it always
+    add up to the current screen. A full frame is sent at least every ``full_frame_every`` screenshots, when
+    the change is large, and before the last full frame would fall out of the ``max_images`` most recent
+    images kept in the request.
+    """
+
+    def __init__(self, full_frame_every=FULL_FRAME_EVERY, max_images=None, threshold=DIFF_THRESHOLD,
+                 max_changed_fraction=MAX_CHANGED_FRACTION, max_regions=MAX_REGIONS):
+        self.full_frame_every = full_frame_every
+        self.max_images = max_images
+        self.threshold = threshold
+        self.max_changed_fraction = max_changed_fraction
+        self.max_regions = max_regions
+        self.reset()
+
+    def reset(self):
+        self._previous = None
+        self._image = None
+        self._frames_since_full = 0
+        self._images_since_full = 0
+
+    def add_images(self, count):
+        """Count images sent outside ``changes``, such as zoom crops, against the kept window."""
+        self._images_since_full += count
+
+    def changes(self, png, extra_images=0):
+        """Changed regions of ``png`` as (left, top, right, bottom) screen pixels, an empty list if nothing
+        changed, or None when the full frame should be sent. ``extra_images`` are images going out in the
+        same message ahead of the screenshot."""
+        image = Image.open(io.BytesIO(png)).convert("RGB")
+        small = np.asarray(image.convert("L").reduce(DOWNSAMPLE))
+        previous, self._previous, self._image = self._previous, small, image
+        self._images_since_full += extra_images
+        regions = None
+        if previous is not None and previous.shape == small.shape and \
+                self._frames_since_full + 1 < (self.full_frame_every or 1):
+            regions = block_regions(changed_blocks(previous, small, self.threshold), max_regions=self.max_regions)
+            width, height = image.size
+            regions = [(left, top, min(right, width), min(bottom, height)) for left, top, right, bottom in regions]
+            if sum(_area(region) for region in regions) > self.max_changed_fraction * width * height:
+                regions = None
+            elif self.max_images is not None and 1 + self._images_since_full + len(regions) > self.max_images:
+                regions = None
+        if regions is None:
+            self._frames_since_full = 0
+            self._images_since_full = 0
+        else:
+            self._frames_since_full += 1
+            self._images_since_full += len(regions)
+        return regions
+
+    def crop(self, bounds, scale=1.0):
+        """PNG of a region of the frame last passed to ``changes``, resized by ``scale``."""
+        left, top, right, bottom = bounds
+        image = self._image.crop(bounds)
+        if scale < 1.0:
+            image = image.resize((max(1, round((right - left) * scale)), max(1, round((bottom - top) * scale))),
+                                 Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=1)
+        return buffer.getvalue()
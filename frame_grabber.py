@@ -0,0 +1,301 @@
+import io
+import time
+import struct
+import logging
+import threading
+import subprocess
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# screencap raw formats: RGBA_8888, RGBX_8888, RGB_888
+_BYTES_PER_PIXEL = {1: 4, 2: 4, 3: 3}
+
+
+def parse_raw_screencap(data):
+    width, height, pixel_format = struct.unpack_from('<III', data)
+    bpp = _BYTES_PER_PIXEL.get(pixel_format)
+    if bpp is None:
+        raise ValueError(f"Unsupported screencap pixel format: {pixel_format}")
+    # Android 9+ adds a colorspace field to the header
+    header_size = len(data) - width * height * bpp
+    if header_size not in (12, 16):
+        raise ValueError(f"Unexpected raw screencap size {len(data)} for {width}x{height}")
+    pixels = np.frombuffer(data, dtype=np.uint8, offset=header_size).reshape(height, width, bpp)
+    return pixels[:, :, :3]
+
+
+def encode_png(frame, compress_level=3):
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format='PNG', compress_level=compress_level)
+    return buffer.getvalue()
+
+
+class FrameRingBuffer:
+    """Fixed-size buffer of the most recent frames, allocated once when the frame size is known."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._frames = None
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._count = 0
+        # Frames pushed before clear() are no longer returned; sequence numbers keep increasing
+        self._first = 0
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+
+    def push(self, frame, timestamp=None):
+        timestamp = timestamp or time.time()
+        with self._lock:
+            if self._frames is None or self._frames.shape[1:] != frame.shape:
+                self._frames = np.empty((self.capacity,) + frame.shape, dtype=np.uint8)
+                self._first = self._count
+            slot = self._count % self.capacity
+            np.copyto(self._frames[slot], frame)
+            self._timestamps[slot] = timestamp
+            self._count += 1
+            self._new_frame.notify_all()
+
+    def clear(self):
+        with self._lock:
+            self._first = self._count
+
+    def __len__(self):
+        return min(self._count - self._first, self.capacity)
+
+    @property
+    def sequence(self):
+        return self._count
+
+    def latest(self):
+        with self._lock:
+            if self._count == self._first:
+                return None, None
+            slot = (self._count - 1) % self.capacity
+            return self._frames[slot].copy(), float(self._timestamps[slot])
+
+    def recent(self, n=None):
+        with self._lock:
+            n = min(n or self.capacity, len(self))
+            slots = [(self._count - i - 1) % self.capacity for i in reversed(range(n))]
+            return [(self._frames[slot].copy(), float(self._timestamps[slot])) for slot in slots]
+
+    def wait_for_frame(self, after_sequence, timeout=None):
+        with self._lock:
+            self._new_frame.wait_for(lambda: self._count > after_sequence, timeout)
+            return self._count
+
+
+class RawScreencapSource:
+    def __init__(self, serial=None):
+        self.command = ['adb'] + (['-s', serial] if serial else []) + ['exec-out', 'screencap']
+
+    def read(self):
+        return parse_raw_screencap(subprocess.check_output(self.command))
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RawStreamSource:
+    """Reads back-to-back raw screencap frames from a file; stands in for a device in tests."""
+
+    def __init__(self, path, header_size=16, loop=True):
+        self.path = path
+        self.header_size = header_size
+        self.loop = loop
+        self._file = None
+        self.open()
+
+    def open(self):
+        """Start reading from the beginning of the file again; called by FrameGrabber.start after a stop."""
+        if self._file is None or self._file.closed:
+            self._file = open(self.path, 'rb')
+
+    def read(self):
+        header = self._file.read(self.header_size)
+        if len(header) < self.header_size:
+            if not self.loop:
+                raise EOFError(f"End of raw stream {self.path}")
+            self._file.seek(0)
+            header = self._file.read(self.header_size)
+        width, height, pixel_format = struct.unpack_from('<III', header)
+        body = self._file.read(width * height * _BYTES_PER_PIXEL[pixel_format])
+        return parse_raw_screencap(header + body)
+
+    def close(self):
+        self._file.close()
+
+
+def write_raw_frame(stream, frame):
+    height, width = frame.shape[:2]
+    rgba = np.dstack([frame[:, :, :3], np.full((height, width), 255, dtype=np.uint8)])
+    stream.write(struct.pack('<IIII', width, height, 1, 0))
+    stream.write(rgba.tobytes())
+
+
+class H264StreamSource:
+    """Decodes an H.264 elementary stream, either from `screenrecord` on the device or from a file.
+
+    ``opener`` returns a fresh (stream, process) pair; with it the source can be reopened after it is
+    closed or ends (screenrecord stops after 3 minutes).
+    """
+
+    def __init__(self, stream, process=None, opener=None):
+        self._opener = opener
+        self._attach(stream, process)
+
+    def _attach(self, stream, process):
+        try:
+            import av
+        except ImportError:
+            raise ImportError("H.264 frame grabbing requires PyAV: pip install av")
+        self._process = process
+        self._stream = stream
+        self._container = av.open(stream, format='h264', mode='r')
+        self._container.streams.video[0].thread_count = 1
+        self._frames = self._container.decode(video=0)
+        self._closed = False
+
+    @classmethod
+    def from_device(cls, serial=None, size=None, bit_rate=4000000):
+        command = ['adb'] + (['-s', serial] if serial else []) + [
+            'exec-out', 'screenrecord', '--output-format=h264', f'--bit-rate={bit_rate}']
+        if size:
+            command.append(f'--size={size[0]}x{size[1]}')
+        command.append('-')
+
+        def opener():
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            return process.stdout, process
+        return cls(*opener(), opener=opener)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(open(path, 'rb'), opener=lambda: (open(path, 'rb'), None))
+
+    def open(self):
+        if not self._closed:
+            return
+        if self._opener is None:
+            raise Exception("This H.264 stream was closed and cannot be reopened; pass an opener")
+        self._attach(*self._opener())
+
+    def read(self):
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            raise EOFError("End of H.264 stream")
+        return frame.to_ndarray(format='rgb24')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._process is not None:
+            self._process.terminate()
+        self._container.close()
+        self._stream.close()
+
+
+class FrameGrabber:
+    """Background worker that keeps the last few frames from a source in a ring buffer.
+
+    Can be stopped and started again; the source is reopened on start. When the source ends the worker
+    exits and ``is_running`` turns false, so callers fall back to capturing frames themselves.
+    """
+
+    def __init__(self, source, capacity=4, max_fps=5.0):
+        self.source = source
+        self.buffer = FrameRingBuffer(capacity)
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.frames_captured = 0
+        self.errors = 0
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._source_closed = False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        if self._source_closed:
+            self.source.open()
+            self._source_closed = False
+        # Frames from before a stop would show the agent a screen that is long gone
+        self.buffer.clear()
+        self._stopped.clear()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+        logger.info(f"Frame grabber started with {type(self.source).__name__}")
+        return self
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._running.is_set():
+                self._running.wait(0.1)
+                continue
+            started = time.perf_counter()
+            try:
+                frame = self.source.read()
+            except EOFError:
+                logger.info("Frame source ended; falling back to direct captures")
+                self._close_source()
+                break
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                self.errors += 1
+                logger.debug(f"Frame grab failed: {str(e)}")
+                self._stopped.wait(1.0)
+                continue
+            self.buffer.push(frame)
+            self.frames_captured += 1
+            # Cap the frame rate to bound CPU and device load
+            remaining = self.min_interval - (time.perf_counter() - started)
+            if remaining > 0:
+                self._stopped.wait(remaining)
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def _close_source(self):
+        self._source_closed = True
+        try:
+            self.source.close()
+        except Exception as e:
+            logger.debug(f"Error closing frame source: {str(e)}")
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        self._running.set()
+        # Closing unblocks a pending read; the source is reopened by the next start()
+        self._close_source()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(f"Frame grabber stopped after {self.frames_captured} frames")
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and self._running.is_set()
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def latest_png(self):
+        frame, timestamp = self.buffer.latest()
+        if frame is None:
+            return None, None
+        return encode_png(frame), timestamp
+
+    def wait_for_frame(self, after_sequence, timeout=None):
+        return self.buffer.wait_for_frame(after_sequence, timeout)
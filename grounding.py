@@ -0,0 +1,110 @@
+import json
+import base64
+import socket
+import logging
+import http.client
+from urllib.parse import urlparse
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUNDING_URL = "http://127.0.0.1:8765"
+
+
+def encode_mask(mask):
+    if mask is None:
+        return None
+    mask = np.asarray(mask) > 0
+    return {"shape": list(mask.shape), "bits": base64.b64encode(np.packbits(mask)).decode('ascii')}
+
+
+def decode_mask(encoded):
+    if encoded is None:
+        return None
+    height, width = encoded["shape"]
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(encoded["bits"]), dtype=np.uint8))
+    return bits[:height * width].reshape(height, width).astype(bool)
+
+
+def detection_boxes(objects):
+    """Turn parsed detect output into dicts with ``name``, ``bounds`` (left, top, right, bottom) and ``center``."""
+    boxes = []
+    for obj in objects:
+        if "xyxy" not in obj:
+            continue
+        left, top, right, bottom = obj["xyxy"]
+        boxes.append({"name": (obj.get("name") or "").strip(), "bounds": (left, top, right, bottom),
+                      "center": ((left + right) // 2, (top + bottom) // 2)})
+    return boxes
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class GroundingClient:
+    """Client for grounding_server.py, over HTTP on localhost or a Unix socket."""
+
+    def __init__(self, url=DEFAULT_GROUNDING_URL, socket_path=None, timeout=60.0):
+        self.url = urlparse(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.socket_path:
+            return _UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        connection = self._connection()
+        try:
+            payload = json.dumps(body) if body is not None else None
+            connection.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise Exception(f"Grounding server error {response.status}: {data.get('error', data)}")
+        return data
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+    def infer(self, png, task, text, max_new_tokens=None):
+        body = {"image": base64.b64encode(png).decode('ascii'), "task": task, "text": text}
+        if max_new_tokens:
+            body["max_new_tokens"] = max_new_tokens
+        return self._request("POST", "/infer", body)["result"]
+
+    def generate(self, png, text, max_new_tokens=None):
+        return self.infer(png, "generate", text, max_new_tokens)
+
+    def detect(self, png, text, max_new_tokens=None):
+        return self.infer(png, "detect", text, max_new_tokens)
+
+    def segment(self, png, text, max_new_tokens=None):
+        objects = self.infer(png, "segment", text, max_new_tokens)
+        for obj in objects:
+            if "mask" in obj:
+                obj["mask"] = decode_mask(obj["mask"])
+        return objects
+
+    def element_boxes(self, png, queries, max_new_tokens=None):
+        """Detect the named kinds of elements (e.g. "button", "text field") in one request.
+
+        Returns dicts with ``name``, ``bounds`` as (left, top, right, bottom) in image pixels and ``center``.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        return detection_boxes(self.detect(png, " ; ".join(queries), max_new_tokens))
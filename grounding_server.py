@@ -0,0 +1,316 @@
+import io
+import os
+import json
+import time
+import queue
+import base64
+import string
+import hashlib
+import logging
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import torch
+from PIL import Image
+from paligemma_inference import (add_model_arguments, load_model_from_args, optimize_for_cpu, infer_batch,
+                                 task_prompt, max_new_tokens_for)
+from paligemma_postprocess import parse_objects
+from grounding import encode_mask
+
+logger = logging.getLogger(__name__)
+
+TASKS = ("generate", "detect", "segment")
+
+
+def serialize_objects(objects):
+    return [{**obj, "xyxy": list(obj["xyxy"]), "mask": encode_mask(obj["mask"])} for obj in objects]
+
+
+class _Request:
+    __slots__ = ("key", "image", "task", "prompt", "max_new_tokens", "future")
+
+    def __init__(self, key, image, task, prompt, max_new_tokens, future):
+        self.key = key
+        self.image = image
+        self.task = task
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.future = future
+
+
+class GroundingService:
+    """Keeps a PaliGemma model loaded and answers detect/segment/generate requests.
+
+    Concurrent requests are collected for up to ``max_wait_ms`` (or until ``max_batch_size``) and run
+    as one ``generate`` call per ``max_new_tokens`` value. Results are cached in an LRU keyed by image
+    hash, task, prompt and token budget; identical requests already in flight share one result.
+    Requests without a token budget get one sized from their queries; with ``limit_tokens`` larger ones are capped to it.
+    """
+
+    def __init__(self, model, processor, device, max_batch_size=8, max_wait_ms=10, cache_size=512,
+                 limit_tokens=False):
+        self.model = model
+        self.processor = processor
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.limit_tokens = limit_tokens
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._counters = {"requests": 0, "cache_hits": 0, "batches": 0, "batched_requests": 0,
+                          "inference_seconds": 0.0}
+        self._thread = threading.Thread(target=self._batch_loop, name="grounding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, png, task, text, max_new_tokens=None):
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task}")
+        max_new_tokens = max_new_tokens_for(task, text, max_new_tokens, self.limit_tokens)
+        prompt = task_prompt(task, text)
+        key = f"{hashlib.sha256(png).hexdigest()}|{task}|{max_new_tokens}|{prompt}"
+        with self._lock:
+            self._counters["requests"] += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._counters["cache_hits"] += 1
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if key in self._inflight:
+                return self._inflight[key]
+            future = Future()
+            self._inflight[key] = future
+        try:
+            image = Image.open(io.BytesIO(png)).convert("RGB")
+        except Exception as e:
+            self._finish(key, error=e)
+            raise
+        self._queue.put(_Request(key, image, task, prompt, max_new_tokens, future))
+        return future
+
+    def infer(self, png, task, text, max_new_tokens=None, timeout=None):
+        return self.submit(png, task, text, max_new_tokens).result(timeout)
+
+    def _finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            if error is None:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            groups = {}
+            for request in self._collect(first):
+                groups.setdefault(request.max_new_tokens, []).append(request)
+            for max_new_tokens, requests in groups.items():
+                self._run_batch(requests, max_new_tokens)
+
+    def _run_batch(self, requests, max_new_tokens):
+        started = time.perf_counter()
+        try:
+            outputs = infer_batch([request.image for request in requests], [request.prompt for request in requests],
+                                  max_new_tokens, self.model, self.processor, self.device)
+        except Exception as e:
+            logger.error(f"Batch of {len(requests)} failed: {str(e)}")
+            for request in requests:
+                self._finish(request.key, error=e)
+            return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["batched_requests"] += len(requests)
+            self._counters["inference_seconds"] += elapsed
+        logger.debug(f"Ran batch of {len(requests)} in {elapsed:.2f}s")
+        # Detect and segment outputs of the whole batch are parsed together
+        located = [index for index, request in enumerate(requests) if request.task != "generate"]
+        try:
+            objects = dict(zip(located, parse_objects([outputs[index] for index in located],
+                                                      [requests[index].image.size for index in located])))
+        except Exception as e:
+            logger.error(f"Parsing batch of {len(requests)} failed: {str(e)}")
+            for request in requests:
+                self._finish(request.key, error=e)
+            return
+        for index, (request, output) in enumerate(zip(requests, outputs)):
+            self._finish(request.key, serialize_objects(objects[index]) if index in objects else output)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["cached_results"] = len(self._cache)
+        batches = counters["batches"]
+        counters["mean_batch_size"] = round(counters["batched_requests"] / batches, 2) if batches else 0.0
+        counters["inference_seconds"] = round(counters["inference_seconds"], 3)
+        return counters
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class GroundingRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/infer":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            png = base64.b64decode(body["image"])
+            future = self.server.service.submit(png, body["task"], body["text"], body.get("max_new_tokens"))
+        except (KeyError, ValueError, OSError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            self._send_json(200, {"result": future.result()})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, GroundingRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), GroundingRequestHandler)
+    server.service = service
+    return server
+
+
+def load_tiny_random_model(image_size=112, seed=0):
+    """A randomly initialized PaliGemma small enough for CPU benchmarks; no weights are downloaded."""
+    from tokenizers import Tokenizer, Regex, decoders, models, pre_tokenizers
+    from transformers import (PaliGemmaConfig, PaliGemmaForConditionalGeneration, PaliGemmaProcessor,
+                              PreTrainedTokenizerFast, SiglipImageProcessor)
+
+    torch.manual_seed(seed)
+    vocab = {"<pad>": 0, "<eos>": 1, "<bos>": 2, "<unk>": 3}
+    for char in string.printable:
+        vocab.setdefault(char, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split(Regex("."), behavior="isolated")
+    tokenizer.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<bos>", eos_token="<eos>",
+                                        pad_token="<pad>", unk_token="<unk>", padding_side="left")
+
+    patch_size = 16
+    image_processor = SiglipImageProcessor(size={"height": image_size, "width": image_size})
+    image_processor.image_seq_length = (image_size // patch_size) ** 2
+    # Adds the <image>, <locNNNN> and <segNNN> tokens to the tokenizer
+    processor = PaliGemmaProcessor(image_processor=image_processor, tokenizer=tokenizer)
+
+    hidden_size = 64
+    config = PaliGemmaConfig(
+        vision_config={"model_type": "siglip_vision_model", "hidden_size": hidden_size, "intermediate_size": 128,
+                       "num_hidden_layers": 2, "num_attention_heads": 2, "image_size": image_size,
+                       "patch_size": patch_size, "projection_dim": hidden_size},
+        text_config={"model_type": "gemma", "hidden_size": hidden_size, "intermediate_size": 128,
+                     "num_hidden_layers": 2, "num_attention_heads": 2, "num_key_value_heads": 1, "head_dim": 32,
+                     "vocab_size": len(processor.tokenizer), "pad_token_id": 0, "eos_token_id": 1,
+                     "bos_token_id": 2},
+        image_token_index=processor.tokenizer.convert_tokens_to_ids("<image>"),
+        projection_dim=hidden_size,
+        hidden_size=hidden_size,
+        vocab_size=len(processor.tokenizer),
+        pad_token_id=0
+    )
+    model = PaliGemmaForConditionalGeneration(config).eval()
+    return model, processor, torch.device("cpu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm PaliGemma grounding server")
+    add_model_arguments(parser)
+    parser.add_argument("--tiny_random", action="store_true", help="Serve a tiny randomly initialized model for testing")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--socket", type=str, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--max_batch_size", type=int, default=8, help="Most requests run in one generate call")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="How long to wait for a batch to fill")
+    parser.add_argument("--cache_size", type=int, default=512, help="Number of results kept in the LRU cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.tiny_random:
+        model, processor, device = load_tiny_random_model()
+        if args.cpu:
+            model = optimize_for_cpu(model, not args.no_quantize, args.bf16, args.compile)
+    else:
+        model, processor, device = load_model_from_args(args)
+    service = GroundingService(model, processor, device, args.max_batch_size, args.max_wait_ms, args.cache_size,
+                               limit_tokens=args.cpu)
+    server = create_server(service, args.host, args.port, args.socket)
+    logger.info(f"Grounding server listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,28 @@
 import os
 import json
+import datetime
 import logging
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QLabel, QLineEdit, QTextEdit, QStatusBar,
-                             QMessageBox, QComboBox, QDoubleSpinBox, QSpinBox)
-from PyQt5.QtGui import QIcon, QFont
-from PyQt5.QtCore import Qt, QPoint, QTimer, QThread, pyqtSignal
-import pyautogui
+                             QMessageBox, QComboBox, QDoubleSpinBox, QSpinBox,
+                             QFileDialog, QProgressDialog, QCheckBox)
+from PyQt5.QtGui import QIcon, QFont, QImage, QPixmap
+from PyQt5.QtCore import Qt, QEvent, QPoint, QTimer, QThread, pyqtSignal
 from agent import PhoneMirroringAgent
-from export_utils import export_conversation
+from screen import cursor_position
+from action_cache import ActionCache
+from vision_grounding import VisionGrounder, server_detector
+from preview import PreviewFeed
+from export_utils import export_run
+from journal import latest_resumable_run
+from metrics import AgentMetrics
 from constants import (DEFAULT_MODEL, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE, 
-                       DEFAULT_MAX_MESSAGES, AVAILABLE_MODELS)
+                       DEFAULT_MAX_MESSAGES, DEFAULT_MAX_HISTORY_IMAGES, DEFAULT_RUNS_DIR, DEFAULT_MACROS_DIR, DEFAULT_ACTION_CACHE_PATH,
+                       AVAILABLE_MODELS)
+
+# A position readout doesn't need 60 updates a second
+CURSOR_POLL_INTERVAL_MS = 100
+PREVIEW_SIZE = (240, 520)
 
 class PasswordLineEdit(QLineEdit):
     def __init__(self, *args, **kwargs):
@@ -28,7 +40,26 @@ class AgentThread(QThread):
     def run(self):
         self.agent.run(self.task_completed_signal.emit, self.update_status_signal.emit)
 
+class ExportThread(QThread):
+    progress_signal = pyqtSignal(int, int)
+    export_finished_signal = pyqtSignal(bool, str)
+
+    def __init__(self, conversation, export_folder, parameters):
+        super().__init__()
+        self.conversation = conversation
+        self.export_folder = export_folder
+        self.parameters = parameters
+
+    def run(self):
+        try:
+            export_run(self.conversation, self.export_folder, self.parameters, self.progress_signal.emit)
+            self.export_finished_signal.emit(True, self.export_folder)
+        except Exception as e:
+            self.export_finished_signal.emit(False, str(e))
+
 class MainWindow(QMainWindow):
+    preview_frame_signal = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.logger = logging.getLogger(__name__)
@@ -36,7 +67,7 @@ class MainWindow(QMainWindow):
         
         self.setWindowFlags(self.windowFlags() & ~Qt.WindowMaximizeButtonHint)
         
-        self.setFixedSize(300, 600)
+        self.setFixedSize(300 + PREVIEW_SIZE[0] + 30, 600)
         
         self.setStyleSheet("""
             QMainWindow {
@@ -71,6 +102,10 @@ class MainWindow(QMainWindow):
         self.init_ui()
         self.agent = None
         self.agent_thread = None
+        self.preview_feed = None
+        self.preview_frame_signal.connect(self.show_preview_frame)
+        self.export_thread = None
+        self.export_progress = None
         self.settings_file = "settings.json"
         self.load_settings()
 
@@ -79,19 +114,34 @@ class MainWindow(QMainWindow):
         self.max_tokens_input.valueChanged.connect(self.save_settings)
         self.temperature_input.valueChanged.connect(self.save_settings)
         self.max_messages_input.valueChanged.connect(self.save_settings)
+        self.max_history_images_input.valueChanged.connect(self.save_settings)
         self.task_input.textChanged.connect(self.save_settings)
+        self.replay_macros_input.stateChanged.connect(self.save_settings)
+        self.action_cache_input.stateChanged.connect(self.save_settings)
+        self.vision_grounding_input.stateChanged.connect(self.save_settings)
 
+        # Polled only while the window is shown and not minimized; see showEvent/hideEvent/changeEvent
         self.cursor_timer = QTimer(self)
+        self.cursor_timer.setInterval(CURSOR_POLL_INTERVAL_MS)
         self.cursor_timer.timeout.connect(self.update_screen_cursor_position)
-        self.cursor_timer.start(16)
+        self._last_cursor_position = None
 
     def init_ui(self):
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
-        self.layout = QVBoxLayout(self.central_widget)
+        main_layout = QHBoxLayout(self.central_widget)
+        self.layout = QVBoxLayout()
+        main_layout.addLayout(self.layout)
 
         self.create_input_fields()
 
+        # Shows the frames the agent already captured; rendering happens on PreviewFeed's thread
+        self.preview_label = QLabel("No frames yet")
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setFixedSize(*PREVIEW_SIZE)
+        self.preview_label.setStyleSheet("background-color: #202020; color: #888888; border-radius: 4px;")
+        main_layout.addWidget(self.preview_label)
+
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         
@@ -139,6 +189,20 @@ class MainWindow(QMainWindow):
         self.max_messages_input.setValue(DEFAULT_MAX_MESSAGES)
         add_input_field("Max Messages", self.max_messages_input)
 
+        self.max_history_images_input = QSpinBox()
+        self.max_history_images_input.setRange(0, 1000)
+        self.max_history_images_input.setSpecialValueText("All")
+        self.max_history_images_input.setValue(DEFAULT_MAX_HISTORY_IMAGES)
+        add_input_field("Screenshots Kept", self.max_history_images_input)
+
+        self.replay_macros_input = QCheckBox("Replay recorded runs of this task")
+        layout.addWidget(self.replay_macros_input)
+        self.action_cache_input = QCheckBox("Resolve known screens from cache")
+        layout.addWidget(self.action_cache_input)
+        self.vision_grounding_input = QCheckBox("Detect elements when the UI dump is empty (grounding server)")
+        layout.addWidget(self.vision_grounding_input)
+        layout.addSpacing(10)
+
         layout.addWidget(QLabel("Task Description"))
         layout.addSpacing(2)
         self.task_input = QTextEdit()
@@ -152,6 +216,13 @@ class MainWindow(QMainWindow):
         self.start_button.clicked.connect(self.start_task)
         self.button_layout.addWidget(self.start_button)
 
+        # Continues the most recent interrupted run from its last checkpoint
+        self.resume_run_button = QPushButton("Resume Last Run")
+        self.resume_run_button.setIcon(QIcon.fromTheme("view-refresh"))
+        self.resume_run_button.clicked.connect(self.resume_last_run)
+        self.resume_run_button.setVisible(latest_resumable_run(DEFAULT_RUNS_DIR) is not None)
+        self.button_layout.addWidget(self.resume_run_button)
+
         self.pause_button = QPushButton("Pause")
         self.pause_button.setIcon(QIcon.fromTheme("media-playback-pause"))
         self.pause_button.clicked.connect(self.pause_task)
@@ -187,7 +258,12 @@ class MainWindow(QMainWindow):
                 self.max_tokens_input.setValue(int(settings.get("max_tokens", DEFAULT_MAX_TOKENS)))
                 self.temperature_input.setValue(float(settings.get("temperature", DEFAULT_TEMPERATURE)))
                 self.max_messages_input.setValue(int(settings.get("max_messages", DEFAULT_MAX_MESSAGES)))
+                self.max_history_images_input.setValue(int(settings.get("max_history_images",
+                                                                        DEFAULT_MAX_HISTORY_IMAGES)))
                 self.task_input.setPlainText(settings.get("task_description", ""))
+                self.replay_macros_input.setChecked(bool(settings.get("replay_macros", False)))
+                self.action_cache_input.setChecked(bool(settings.get("use_action_cache", False)))
+                self.vision_grounding_input.setChecked(bool(settings.get("use_vision_grounding", False)))
                 
                 pos = settings.get("window_position", None)
                 if pos:
@@ -198,6 +274,7 @@ class MainWindow(QMainWindow):
             self.max_tokens_input.setValue(DEFAULT_MAX_TOKENS)
             self.temperature_input.setValue(DEFAULT_TEMPERATURE)
             self.max_messages_input.setValue(DEFAULT_MAX_MESSAGES)
+            self.max_history_images_input.setValue(DEFAULT_MAX_HISTORY_IMAGES)
             self.logger.info("Default settings applied")
 
     def save_settings(self):
@@ -207,7 +284,11 @@ class MainWindow(QMainWindow):
             "max_tokens": self.max_tokens_input.value(),
             "temperature": self.temperature_input.value(),
             "max_messages": self.max_messages_input.value(),
+            "max_history_images": self.max_history_images_input.value(),
             "task_description": self.task_input.toPlainText(),
+            "replay_macros": self.replay_macros_input.isChecked(),
+            "use_action_cache": self.action_cache_input.isChecked(),
+            "use_vision_grounding": self.vision_grounding_input.isChecked(),
             "window_position": [self.pos().x(), self.pos().y()]
         }
         with open(self.settings_file, "w") as f:
@@ -215,6 +296,7 @@ class MainWindow(QMainWindow):
         self.logger.info("Settings saved successfully")
 
     def closeEvent(self, event):
+        self.stop_preview()
         self.save_settings()
         self.logger.info("Application closed")
         super().closeEvent(event)
@@ -233,19 +315,54 @@ class MainWindow(QMainWindow):
         temperature = self.temperature_input.value()
         max_messages = self.max_messages_input.value()
 
+        journal_dir = os.path.join(DEFAULT_RUNS_DIR, f"run_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
         self.agent = PhoneMirroringAgent(
-            api_key, model, max_tokens, temperature, max_messages
+            api_key, model, max_tokens, temperature, max_messages, journal_dir=journal_dir,
+            **self.agent_options()
         )
         self.agent.task_description = task_description
-        
+        self.launch_agent()
+        self.update_status("Task started...")
+        self.logger.info(f"Task started: {task_description}")
+
+    def resume_last_run(self):
+        api_key = self.api_key_input.text()
+        run_dir = latest_resumable_run(DEFAULT_RUNS_DIR)
+        if not api_key:
+            QMessageBox.warning(self, "Missing Information", "Please enter an API key.")
+            return
+        if run_dir is None:
+            QMessageBox.information(self, "Nothing to Resume", "There is no unfinished run to resume.")
+            self.resume_run_button.hide()
+            return
+        try:
+            self.agent = PhoneMirroringAgent.from_checkpoint(run_dir, api_key, **self.agent_options())
+        except Exception as e:
+            QMessageBox.warning(self, "Cannot Resume", f"Could not load the checkpoint: {str(e)}")
+            self.logger.error(f"Could not resume {run_dir}: {str(e)}")
+            return
+        self.task_input.setPlainText(self.agent.task_description)
+        self.launch_agent()
+        self.update_status("Resuming task...")
+        self.logger.info(f"Resuming run {run_dir}")
+
+    def agent_options(self):
+        return dict(
+            macro_dir=DEFAULT_MACROS_DIR, replay_macros=self.replay_macros_input.isChecked(),
+            # 0 ("All") sends every screenshot of the task with each request
+            max_history_images=self.max_history_images_input.value() or None,
+            action_cache=ActionCache(DEFAULT_ACTION_CACHE_PATH) if self.action_cache_input.isChecked() else None,
+            grounder=VisionGrounder(server_detector()) if self.vision_grounding_input.isChecked() else None,
+            metrics=AgentMetrics(os.environ.get("ANDROID_SERIAL", "android")) if os.environ.get("METRICS_PORT") else None
+        )
+
+    def launch_agent(self):
+        self.start_preview()
         self.agent_thread = AgentThread(self.agent)
         self.agent_thread.task_completed_signal.connect(self.on_task_completed)
         self.agent_thread.update_status_signal.connect(self.update_status)
         self.agent_thread.start()
-        
         self.update_button_visibility("running")
-        self.update_status("Task started...")
-        self.logger.info(f"Task started: {task_description}")
 
     def pause_task(self):
         if self.agent and self.agent_thread.isRunning():
@@ -270,6 +387,7 @@ class MainWindow(QMainWindow):
     def update_button_visibility(self, state):
         if state == "idle":
             self.start_button.show()
+            self.resume_run_button.setVisible(latest_resumable_run(DEFAULT_RUNS_DIR) is not None)
             self.pause_button.hide()
             self.resume_button.hide()
             self.cancel_button.hide()
@@ -277,6 +395,7 @@ class MainWindow(QMainWindow):
             self.set_fields_readonly(False)
         elif state == "running":
             self.start_button.hide()
+            self.resume_run_button.hide()
             self.pause_button.show()
             self.resume_button.hide()
             self.cancel_button.show()
@@ -284,6 +403,7 @@ class MainWindow(QMainWindow):
             self.set_fields_readonly(True)
         elif state == "paused":
             self.start_button.hide()
+            self.resume_run_button.hide()
             self.pause_button.hide()
             self.resume_button.show()
             self.cancel_button.show()
@@ -296,15 +416,60 @@ class MainWindow(QMainWindow):
         self.max_tokens_input.setDisabled(disabled)
         self.temperature_input.setDisabled(disabled)
         self.max_messages_input.setDisabled(disabled)
+        self.max_history_images_input.setDisabled(disabled)
         self.task_input.setDisabled(disabled)
+        self.replay_macros_input.setDisabled(disabled)
+        self.action_cache_input.setDisabled(disabled)
+        self.vision_grounding_input.setDisabled(disabled)
         self.logger.debug(f"Input fields set to disabled: {disabled}")
 
     def update_screen_cursor_position(self):
-        cursor_x, cursor_y = pyautogui.position()
-        self.cursor_position_label.setText(f"({cursor_x:4d},{cursor_y:4d})")
-        self.logger.debug(f"Screen cursor position updated: ({cursor_x}, {cursor_y})")
+        position = tuple(cursor_position())
+        if position == self._last_cursor_position:
+            return
+        self._last_cursor_position = position
+        self.cursor_position_label.setText(f"({position[0]:4d},{position[1]:4d})")
+
+    def update_cursor_polling(self):
+        if self.isVisible() and not self.isMinimized():
+            if not self.cursor_timer.isActive():
+                self.cursor_timer.start()
+        else:
+            self.cursor_timer.stop()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_cursor_polling()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.update_cursor_polling()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange:
+            self.update_cursor_polling()
+
+    def start_preview(self):
+        self.stop_preview()
+        self.preview_feed = PreviewFeed(self.preview_frame_signal.emit, max_size=PREVIEW_SIZE)
+        self.agent.scheduler.add_listener(self.preview_feed.frame)
+        self.agent.action_listeners.append(self.preview_feed.action)
+        self.preview_feed.start()
+
+    def stop_preview(self):
+        if self.preview_feed is not None:
+            self.preview_feed.stop()
+            self.preview_feed = None
+
+    def show_preview_frame(self, image):
+        # Already scaled and annotated, so this is only a small copy on the UI thread
+        data = image.tobytes("raw", "RGB")
+        qimage = QImage(data, image.width, image.height, image.width * 3, QImage.Format_RGB888)
+        self.preview_label.setPixmap(QPixmap.fromImage(qimage))
 
     def on_task_completed(self, success, reason):
+        self.stop_preview()
         self.update_button_visibility("idle")
         status = "completed successfully" if success else "failed"
         self.update_status(f"Task {status}")
@@ -315,11 +480,51 @@ class MainWindow(QMainWindow):
         self.logger.info(f"Task {status}. Reason: {reason}")
 
     def export_conversation(self):
-        if self.agent:
-            export_conversation(self, self.agent)
-        else:
+        if not self.agent:
             QMessageBox.warning(self, "No Agent", "There is no active agent with a conversation to export.")
-        self.logger.info("Conversation exported")
+            return
+        if not self.agent.conversation:
+            QMessageBox.warning(self, "No Conversation", "There is no conversation to export.")
+            return
+
+        default_folder_name = f"phone_mirroring_conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        folder_path = QFileDialog.getExistingDirectory(self, "Select Export Folder", "", QFileDialog.ShowDirsOnly)
+        if not folder_path:
+            return
+
+        parameters = {
+            "Model": self.agent.model,
+            "Max Tokens": self.agent.max_tokens,
+            "Temperature": self.agent.temperature,
+            "Max Messages": self.agent.max_messages,
+            "Task Description": self.agent.task_description
+        }
+
+        # Export runs off the UI thread so the window stays responsive on long conversations
+        self.export_progress = QProgressDialog("Exporting conversation...", None, 0, 0, self)
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.setMinimumDuration(300)
+        self.export_button.setDisabled(True)
+
+        self.export_thread = ExportThread(self.agent.conversation, os.path.join(folder_path, default_folder_name), parameters)
+        self.export_thread.progress_signal.connect(self.on_export_progress)
+        self.export_thread.export_finished_signal.connect(self.on_export_finished)
+        self.export_thread.start()
+        self.logger.info("Conversation export started")
+
+    def on_export_progress(self, done, total):
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(done)
+
+    def on_export_finished(self, success, detail):
+        self.export_progress.close()
+        self.export_button.setDisabled(False)
+        if success:
+            QMessageBox.information(self, "Export Successful", f"Conversation exported to {detail}")
+            self.logger.info(f"Conversation exported to {detail}")
+        else:
+            QMessageBox.critical(self, "Export Failed", f"Failed to export conversation: {detail}")
+            self.logger.error(f"Conversation export failed: {detail}")
 
     def update_status(self, status):
         self.status_label.setText(f"{status}...")
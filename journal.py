@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from anthropic.types import MessageParam
+from conversation_store import BlobTable, ConversationStore
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "journal.jsonl"
+PACK_FILE = "screenshots.pack"
+INDEX_FILE = "screenshots.idx"
+CHECKPOINT_FILE = "checkpoint.json"
+# Checkpoint statuses of runs that can be picked up again: still running when the process died, or stopped
+# by a device or API error
+RESUMABLE_STATUSES = ("running", "interrupted")
+
+_STOP = object()
+
+
+def serialize_block(block):
+    if hasattr(block, "model_dump"):
+        return block.model_dump(mode="json", exclude_none=True)
+    if isinstance(block, dict):
+        if block.get('type') == 'image' and block['source'].get('type') == 'blob':
+            serialized = {"type": "image", "key": block['source']['key'], "media_type": block['source']['media_type']}
+            if 'region' in block:
+                serialized["region"] = block['region']
+            return serialized
+        if block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+            return {**block, "content": [serialize_block(item) for item in block['content']]}
+    return block
+
+
+def serialize_message(message):
+    content = message.get('content')
+    if isinstance(content, list):
+        content = [serialize_block(block) for block in content]
+    return {"role": message['role'], "content": content}
+
+
+class StepJournal:
+    """Append-only record of a run, written by a background thread as steps finish.
+
+    Events go to ``journal.jsonl``; screenshots are appended once per content hash to
+    ``screenshots.pack`` with their offsets in ``screenshots.idx``. ``checkpoint.json`` is replaced
+    atomically with the latest resumable state. ``messages`` holds the serialized conversation so far,
+    seeded from a checkpoint when a run is resumed.
+    """
+
+    def __init__(self, run_dir, messages=None):
+        self.run_dir = run_dir
+        self.messages = list(messages or [])
+        os.makedirs(run_dir, exist_ok=True)
+        self._journal = open(os.path.join(run_dir, JOURNAL_FILE), 'a', encoding='utf-8')
+        self._pack = open(os.path.join(run_dir, PACK_FILE), 'ab')
+        self._index = open(os.path.join(run_dir, INDEX_FILE), 'a', encoding='utf-8')
+        self._written_keys = set(JournalReader(run_dir).image_index()) if self._pack.tell() else set()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, event, **fields):
+        self._queue.put(("event", {"event": event, "time": time.time(), **fields}))
+
+    def add_image(self, key, data, media_type="image/png"):
+        self._queue.put(("image", (key, data, media_type)))
+
+    def record_message(self, message, conversation, frame=None):
+        """Record a message with its images; ``frame`` is the full-resolution screenshot the message shows,
+        kept next to the scaled copy sent to the model so replays get the device's own dimensions."""
+        blocks = list(message.get('content') or [])
+        while blocks:
+            block = blocks.pop()
+            if not isinstance(block, dict):
+                continue
+            if block.get('type') == 'image' and block['source'].get('type') == 'blob':
+                key = block['source']['key']
+                self.add_image(key, conversation.blobs.get(key), block['source']['media_type'])
+            elif block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+                # Images returned by tools, such as zoom crops
+                blocks.extend(block['content'])
+        serialized = serialize_message(message)
+        self.messages.append(serialized)
+        if frame is None:
+            self.record("message", message=serialized)
+            return
+        key = BlobTable.key_for(frame)
+        self.add_image(key, frame)
+        self.record("message", message=serialized, frame=key)
+
+    def rewind(self, count, **fields):
+        """Drop the messages after the first ``count``; readers replay the journal up to this point."""
+        del self.messages[count:]
+        self.record("resumed", messages=count, **fields)
+
+    def checkpoint(self, state):
+        """Queue ``state`` to replace checkpoint.json once everything recorded before it is on disk."""
+        self._queue.put(("checkpoint", state))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    break
+                kind, payload = item
+                if kind == "image":
+                    self._write_image(*payload)
+                elif kind == "checkpoint":
+                    self._write_checkpoint(payload)
+                else:
+                    self._journal.write(json.dumps(payload, default=str) + "\n")
+                # Flush once the backlog is drained so a crash loses at most the events still queued
+                if self._queue.empty():
+                    self._flush()
+            except Exception as e:
+                logger.error(f"Error writing journal entry: {str(e)}")
+            finally:
+                self._queue.task_done()
+        self._flush()
+
+    def _write_image(self, key, data, media_type):
+        if key in self._written_keys:
+            return
+        offset = self._pack.tell()
+        self._pack.write(data)
+        self._pack.flush()
+        # The index entry is only written once the bytes it points to are in the pack
+        self._index.write(json.dumps({"key": key, "offset": offset, "length": len(data), "media_type": media_type}) + "\n")
+        self._written_keys.add(key)
+
+    def _write_checkpoint(self, state):
+        # Screenshots the checkpoint refers to must be durable before the checkpoint that points at them
+        self._flush()
+        os.fsync(self._pack.fileno())
+        path = os.path.join(self.run_dir, CHECKPOINT_FILE)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _flush(self):
+        self._pack.flush()
+        self._index.flush()
+        self._journal.flush()
+
+    def flush(self):
+        self._queue.join()
+
+    def pending(self):
+        """Entries queued but not yet written."""
+        return self._queue.qsize()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._journal.close()
+        self._pack.close()
+        self._index.close()
+
+
+class JournalReader:
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self._index = None
+
+    def events(self, event=None):
+        path = os.path.join(self.run_dir, JOURNAL_FILE)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line after a crash
+                    logger.warning(f"Skipping malformed journal line in {path}")
+                    continue
+                if event is None or entry.get("event") == event:
+                    yield entry
+
+    def image_index(self):
+        if self._index is None:
+            self._index = {}
+            path = os.path.join(self.run_dir, INDEX_FILE)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        self._index[entry["key"]] = entry
+        return self._index
+
+    def image(self, key):
+        entry = self.image_index()[key]
+        with open(os.path.join(self.run_dir, PACK_FILE), 'rb') as f:
+            f.seek(entry["offset"])
+            return f.read(entry["length"])
+
+    def conversation(self):
+        store = ConversationStore()
+        for entry in self.events():
+            if entry.get("event") == "message":
+                self._append_message(store, entry["message"])
+            elif entry.get("event") == "resumed":
+                # A resumed run replaced the messages after this point
+                del store.messages[entry["messages"]:]
+        return store
+
+    def restore(self, messages):
+        """Rebuild a conversation from serialized messages, such as those in a checkpoint."""
+        store = ConversationStore()
+        for message in messages:
+            self._append_message(store, message)
+        return store
+
+    def _append_message(self, store, message):
+        content = message["content"]
+        if isinstance(content, list):
+            content = [self._restore_block(store, block) for block in content]
+        store.append(MessageParam(role=message["role"], content=content))
+
+    def _restore_block(self, store, block):
+        if isinstance(block, dict):
+            if block.get('type') == 'image' and 'key' in block:
+                return store.image_block(self.image(block['key']), block.get('media_type', 'image/png'),
+                                         block.get('region'))
+            if block.get('type') == 'tool_result' and isinstance(block.get('content'), list):
+                return {**block, "content": [self._restore_block(store, item) for item in block['content']]}
+        return block
+
+
+def load_checkpoint(run_dir):
+    path = os.path.join(run_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def latest_resumable_run(runs_dir):
+    """The most recent run directory that was interrupted rather than finished, or None."""
+    if not os.path.isdir(runs_dir):
+        return None
+    candidates = sorted((entry for entry in os.scandir(runs_dir)
+                         if entry.is_dir() and os.path.exists(os.path.join(entry.path, CHECKPOINT_FILE))),
+                        key=lambda entry: os.path.getmtime(os.path.join(entry.path, CHECKPOINT_FILE)), reverse=True)
+    for entry in candidates:
+        try:
+            checkpoint = load_checkpoint(entry.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable checkpoint in {entry.path}: {str(e)}")
+            continue
+        if checkpoint.get("status") in RESUMABLE_STATUSES:
+            return entry.path
+    return None
@@ -0,0 +1,141 @@
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+DEFAULT_LOG_FILE = 'phone_mirroring_agent.log'
+HUMAN_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def truncate(text, max_chars):
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... ({len(text) - max_chars} more chars)"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, thread, message and any ``fields`` passed as extra."""
+
+    def format(self, record):
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            event.update(fields)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            event["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exc"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site: ``burst`` records at once, then ``rate`` per second.
+
+    Warnings and errors always pass. The next record let through from a throttled call site carries
+    the number dropped in between as ``suppressed``.
+    """
+
+    def __init__(self, rate=5.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a bounded queue without blocking; when the writer falls behind, records are dropped
+    and counted instead of stalling the caller."""
+
+    def __init__(self, log_queue, max_message_chars=4000):
+        super().__init__(log_queue)
+        self.max_message_chars = max_message_chars
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Runs on the caller's thread: render the message once and cap its size before it is queued.
+        # The traceback is kept separately so truncation never cuts it off.
+        message = truncate(record.getMessage(), self.max_message_chars)
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogWriter(logging.handlers.QueueListener):
+    def stop(self):
+        # Safe to call twice: once by the owner and again at exit
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(path=DEFAULT_LOG_FILE, level=logging.INFO, stream=sys.stdout, max_message_chars=4000,
+                  rate=5.0, burst=20, queue_size=10000, logger=None):
+    """Route the root logger through a background writer: JSON lines to ``path``, readable lines to ``stream``.
+
+    Callers only pay for formatting the message and a queue put. ``logger`` defaults to the root logger.
+    Returns the QueueListener; it is stopped (and the queue flushed) at exit.
+    """
+    handlers = []
+    if path:
+        file_handler = logging.FileHandler(path, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if stream is not None:
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(logging.Formatter(HUMAN_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = AsyncQueueHandler(log_queue, max_message_chars)
+    queue_handler.addFilter(RateLimitFilter(rate, burst))
+    logger = logger or logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+
+    listener = _LogWriter(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
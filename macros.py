@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from anthropic.types import ToolUseBlock
+from ui_tree import parse_ui_xml, element_at, screen_signature
+
+logger = logging.getLogger(__name__)
+
+
+def task_key(task):
+    normalized = " ".join(task.lower().split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def action_point(name, params):
+    if name in ("tap", "long_press", "input_text") and "x" in params and "y" in params:
+        return params["x"], params["y"]
+    if name == "swipe":
+        return params["start_x"], params["start_y"]
+    return None
+
+
+class MacroRecorder:
+    """Records the actions of a run, each keyed to the fingerprint of the screen it was taken on."""
+
+    def __init__(self, task):
+        self.task = task
+        self.steps = []
+
+    def record_step(self, ui_xml, tool_uses):
+        elements = parse_ui_xml(ui_xml)
+        actions = []
+        for tool_use in tool_uses:
+            # zoom only reads the last screenshot, so there is nothing to replay
+            if tool_use.name in ("done", "zoom"):
+                continue
+            action = {"name": tool_use.name, "input": dict(tool_use.input)}
+            point = action_point(tool_use.name, tool_use.input)
+            target = element_at(elements, *point) if point else None
+            if target is not None:
+                action["target"] = target.descriptor()
+            actions.append(action)
+        if actions:
+            self.steps.append({"fingerprint": screen_signature(elements=elements, include_state=True),
+                               "actions": actions})
+
+    def build(self, final_ui_xml, reason):
+        return {
+            "task": self.task,
+            "created": time.time(),
+            "steps": self.steps,
+            "final_fingerprint": screen_signature(final_ui_xml, include_state=True),
+            "reason": reason
+        }
+
+
+class MacroPlayer:
+    """Steps through a recorded macro while the live screen keeps matching the recording."""
+
+    def __init__(self, macro):
+        self.macro = macro
+        self.index = 0
+
+    @property
+    def finished(self):
+        return self.index >= len(self.macro["steps"])
+
+    def match(self, ui_xml):
+        step = self.macro["steps"][self.index]
+        elements = parse_ui_xml(ui_xml)
+        if screen_signature(elements=elements, include_state=True) != step["fingerprint"]:
+            logger.info(f"Macro step {self.index + 1}: screen fingerprint does not match the recording")
+            return None
+        for action in step["actions"]:
+            point = action_point(action["name"], action["input"])
+            if "target" not in action or point is None:
+                continue
+            target = element_at(elements, *point)
+            if target is None or target.descriptor() != action["target"]:
+                logger.info(f"Macro step {self.index + 1}: target of {action['name']} at {point} has changed")
+                return None
+        self.index += 1
+        return step
+
+    def tool_uses(self, step):
+        return [ToolUseBlock(type="tool_use", id=f"replay_{self.index}_{i}", name=action["name"], input=action["input"])
+                for i, action in enumerate(step["actions"])]
+
+    def matches_final(self, ui_xml):
+        return screen_signature(ui_xml, include_state=True) == self.macro["final_fingerprint"]
+
+
+class MacroLibrary:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, task):
+        return os.path.join(self.directory, f"{task_key(task)}.json")
+
+    def load(self, task):
+        path = self.path(task)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not load macro {path}: {str(e)}")
+            return None
+
+    def save(self, macro):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(macro["task"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(macro, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved macro with {len(macro['steps'])} steps to {path}")
+        return path
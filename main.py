@@ -1,28 +1,16 @@
+import os
 import sys
 import logging
+from log_pipeline import setup_logging
+from metrics import start_metrics_server
 from PyQt5.QtWidgets import QApplication
 from gui import MainWindow
 
-def setup_logging():
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    3
-    file_handler = logging.FileHandler('phone_mirroring_agent.log')
-    file_handler.setLevel(logging.INFO)
-    
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setLevel(logging.INFO)
-    
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    file_handler.setFormatter(formatter)
-    stream_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
-
 def main():
     setup_logging()
     logger = logging.getLogger(__name__)
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(host=os.environ.get("METRICS_HOST", "127.0.0.1"), port=int(os.environ["METRICS_PORT"]))
 
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
@@ -0,0 +1,360 @@
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_PORT = 9464
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+AGENT_STATES = ("idle", "running", "paused")
+# RoutedClient statistics reported as agent_model_provider_<stat>_total
+PROVIDER_COUNTERS = (
+    ("calls", "Requests sent to each model provider"),
+    ("errors", "Failed requests to each model provider"),
+    ("hedges", "Hedged requests sent to each model provider while another was still pending"),
+    ("retries", "Requests sent to each model provider after the previous provider failed"),
+    ("wins", "Requests answered first by each model provider"),
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class _Sharded:
+    """Per-thread dicts of values so updates from hot paths never take a lock; collection sums the shards.
+
+    Shards of threads that have exited are folded into one retired shard when collected.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _merge(self, total, shard):
+        raise NotImplementedError
+
+    def _collect(self):
+        total = {}
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                # dict.copy() is atomic, so a shard can be read while its thread keeps updating it
+                if thread.is_alive():
+                    live.append((thread, shard))
+                    self._merge(total, shard.copy())
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            self._merge(total, self._retired)
+        return total
+
+
+class Counter(_Sharded):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1, labels=()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total, shard):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def values(self):
+        return self._collect()
+
+    def samples(self):
+        for labels, value in sorted(self._collect().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Sharded):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            cell = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _merge(self, total, shard):
+        for labels, cell in shard.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(cell)
+            else:
+                for index, value in enumerate(cell):
+                    merged[index] += value
+
+    def samples(self):
+        for labels, cell in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), cell):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [le])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(cell[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Callbacks:
+    """Values read at scrape time from registered callbacks, each returning (labels, value) pairs.
+
+    A callback can be registered under the same key by several holders, such as agents sharing one
+    client; it is removed once the last of them removes it.
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._functions = {}
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    def set_function(self, key, function, holder=None):
+        with self._lock:
+            self._functions[key] = function
+            self._holders.setdefault(key, set()).add(holder)
+
+    def remove_function(self, key, holder=None):
+        with self._lock:
+            holders = self._holders.get(key, set())
+            holders.discard(holder)
+            if not holders:
+                self._holders.pop(key, None)
+                self._functions.pop(key, None)
+
+    def _read(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                yield from function()
+            except Exception as e:
+                logger.debug(f"Metrics callback {key} for {self.name} failed: {str(e)}")
+
+
+class Gauge(_Callbacks):
+    """A value that is set rather than accumulated, or read at scrape time from registered callbacks."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def samples(self):
+        values = dict(self._values)
+        values.update(self._read())
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class CallbackCounter(_Callbacks):
+    """A counter whose totals are kept elsewhere, such as a client's own statistics, and read at scrape
+    time. Callbacks must only ever report growing totals; those of separate callbacks are added up."""
+
+    type = "counter"
+
+    def samples(self):
+        totals = {}
+        for labels, value in self._read():
+            totals[labels] = totals.get(labels, 0) + value
+        for labels, value in sorted(totals.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def callback_counter(self, name, help, labelnames=()):
+        return self._get(CallbackCounter, name, help, labelnames)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class AgentMetrics:
+    """The metrics one PhoneMirroringAgent reports, labelled with its device name.
+
+    Agents in a fleet share a registry, so one endpoint covers all of them.
+    """
+
+    def __init__(self, device, registry=REGISTRY):
+        self.device = device
+        self.registry = registry
+        self.steps = registry.counter("agent_steps_total", "Agent steps completed", ("device",))
+        self.model_calls = registry.counter("agent_model_calls_total", "Model requests by outcome",
+                                            ("device", "outcome"))
+        self.tokens = registry.counter("agent_tokens_total", "Model tokens by kind (input, output, cache_read, "
+                                       "cache_creation)", ("device", "kind"))
+        self.stage_seconds = registry.histogram("agent_stage_seconds", "Time spent per step stage",
+                                                ("device", "stage"))
+        self.adb_errors = registry.counter("agent_adb_errors_total", "Failed device operations",
+                                           ("device", "operation"))
+        self.tasks = registry.counter("agent_tasks_total", "Finished tasks by outcome", ("device", "outcome"))
+        self.cache_hits = registry.counter("agent_cache_hits_total", "Screens resolved without the model",
+                                           ("device",))
+        self.state = registry.gauge("agent_state", "1 for the agent's current state", ("device", "state"))
+        self.last_step = registry.gauge("agent_last_step_timestamp_seconds",
+                                        "Unix time of the agent's last completed step", ("device",))
+        self.queue_depth = registry.gauge("agent_journal_queue_depth", "Journal entries waiting to be written",
+                                          ("device",))
+        self.provider_counters = {stat: registry.callback_counter(f"agent_model_provider_{stat}_total", help,
+                                                                  ("provider",))
+                                  for stat, help in PROVIDER_COUNTERS}
+        self._client = None
+        self.set_state("idle")
+
+    def step(self, durations, completed=True):
+        """Stage latencies of one step; the model request that opens a task isn't counted as a step."""
+        if completed:
+            self.steps.inc(1, (self.device,))
+            self.last_step.set(time.time(), (self.device,))
+        for stage, seconds in durations.items():
+            self.stage_seconds.observe(seconds, (self.device, stage))
+
+    def model_call(self, response):
+        if response is None:
+            self.model_calls.inc(1, (self.device, "failed"))
+            return
+        self.model_calls.inc(1, (self.device, "succeeded"))
+        usage = getattr(response, "usage", None)
+        for kind in ("input", "output", "cache_read_input", "cache_creation_input"):
+            count = getattr(usage, f"{kind}_tokens", None)
+            if count:
+                self.tokens.inc(count, (self.device, kind.replace("_input", "")))
+
+    def cache_hit(self):
+        self.cache_hits.inc(1, (self.device,))
+
+    def adb_error(self, operation):
+        self.adb_errors.inc(1, (self.device, operation))
+
+    def task_finished(self, outcome):
+        self.tasks.inc(1, (self.device, outcome))
+
+    def set_state(self, state):
+        for name in AGENT_STATES:
+            self.state.set(int(name == state), (self.device, name))
+
+    def watch(self, journal=None, client=None):
+        """Read queue depth from ``journal`` and per-provider counts from a RoutedClient at scrape time;
+        ``watch(None)`` stops reading both."""
+        key = ("agent", self.device)
+        if journal is None:
+            self.queue_depth.remove_function(key)
+        else:
+            self.queue_depth.set_function(key, lambda: [((self.device,), journal.pending())])
+        if self._client is not None:
+            for counter in self.provider_counters.values():
+                counter.remove_function(("client", id(self._client)), key)
+            self._client = None
+        if hasattr(client, "stats"):
+            self._client = client
+            for stat, counter in self.provider_counters.items():
+                # Keyed by client: agents sharing a RoutedClient report it once
+                counter.set_function(("client", id(client)),
+                                     lambda stat=stat: [((provider,), stats[stat])
+                                                        for provider, stats in client.stats().items()], key)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.client_address[0]} {format % args}")
+
+
+def start_metrics_server(registry=REGISTRY, host="127.0.0.1", port=DEFAULT_METRICS_PORT):
+    """Serve ``/metrics`` for Prometheus from a daemon thread; call ``shutdown()`` on the result to stop."""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import anthropic
+from anthropic.types import Message
+
+logger = logging.getLogger(__name__)
+
+# "failover" routes over every configured provider, "hedge" also duplicates slow requests (billed twice)
+ROUTING_ENV = "AGENT_MODEL_ROUTING"
+ROUTING_MODES = ("", "failover", "hedge")
+
+
+class ModelClient:
+    """Interface between the agent and a model: ``create_message`` takes Messages API parameters."""
+
+    def create_message(self, **params):
+        raise NotImplementedError
+
+
+class AnthropicClient(ModelClient):
+    def __init__(self, api_key=None, client=None, max_retries=2):
+        self.client = client or anthropic.Anthropic(api_key=api_key, max_retries=max_retries)
+
+    def create_message(self, **params):
+        return self.client.messages.create(**params)
+
+
+# First-party model names and their Bedrock and Vertex AI equivalents
+BEDROCK_MODEL_IDS = {
+    "claude-3-5-sonnet-20241022": "anthropic.claude-3-5-sonnet-20241022-v2:0",
+    "claude-3-5-sonnet-20240620": "anthropic.claude-3-5-sonnet-20240620-v1:0",
+    "claude-3-opus-20240229": "anthropic.claude-3-opus-20240229-v1:0",
+    "claude-3-sonnet-20240229": "anthropic.claude-3-sonnet-20240229-v1:0",
+    "claude-3-haiku-20240307": "anthropic.claude-3-haiku-20240307-v1:0",
+}
+VERTEX_MODEL_IDS = {
+    "claude-3-5-sonnet-20241022": "claude-3-5-sonnet-v2@20241022",
+    "claude-3-5-sonnet-20240620": "claude-3-5-sonnet@20240620",
+    "claude-3-opus-20240229": "claude-3-opus@20240229",
+    "claude-3-sonnet-20240229": "claude-3-sonnet@20240229",
+    "claude-3-haiku-20240307": "claude-3-haiku@20240307",
+}
+
+
+class BedrockClient(AnthropicClient):
+    """Claude on Amazon Bedrock; credentials and region come from the usual AWS configuration."""
+
+    def __init__(self, aws_region=None, client=None, max_retries=2, model_ids=BEDROCK_MODEL_IDS):
+        self.client = client or anthropic.AnthropicBedrock(aws_region=aws_region, max_retries=max_retries)
+        self.model_ids = model_ids
+
+    def create_message(self, **params):
+        return self.client.messages.create(**{**params, "model": self.model_ids.get(params["model"], params["model"])})
+
+
+class VertexClient(AnthropicClient):
+    """Claude on Google Vertex AI; uses application default credentials."""
+
+    def __init__(self, region=None, project_id=None, client=None, max_retries=2, model_ids=VERTEX_MODEL_IDS):
+        self.client = client or anthropic.AnthropicVertex(region=region, project_id=project_id,
+                                                          max_retries=max_retries)
+        self.model_ids = model_ids
+
+    def create_message(self, **params):
+        return self.client.messages.create(**{**params, "model": self.model_ids.get(params["model"], params["model"])})
+
+
+class ProviderHealth:
+    """Latency window and failure state of one provider, updated from the threads that call it."""
+
+    def __init__(self, name, window=200):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.hedges = 0
+        self.retries = 0
+        self.wins = 0
+        self.unavailable_until = 0.0
+
+    def percentile(self, fraction):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+    def stats(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {"calls": self.calls, "errors": self.errors, "hedges": self.hedges, "retries": self.retries,
+                "wins": self.wins, "p50_s": round(p50, 3) if p50 is not None else None,
+                "p95_s": round(p95, 3) if p95 is not None else None,
+                "available": time.monotonic() >= self.unavailable_until}
+
+
+class RoutedClient(ModelClient):
+    """Spreads one model's requests over several providers, e.g. first-party, Bedrock and Vertex.
+
+    ``providers`` is a list of (name, ModelClient) in order of preference; any ModelClient works, so
+    other vision models can sit behind the same interface. A request goes to the first available
+    provider. If it hasn't answered by that provider's observed ``hedge_percentile`` latency, the
+    same request is also sent to the next one and whichever answers first is used (both are billed;
+    ``hedge_percentile=None`` turns hedging off). A provider that
+    errors is skipped for the rest of the request, and after ``failure_threshold`` consecutive errors
+    it is taken out of rotation for ``cooldown`` seconds. Errors in the request itself (400s) are
+    raised without failing over. Give the provider clients ``max_retries=0`` so failover isn't
+    delayed by their own retries.
+    """
+
+    def __init__(self, providers, hedge_percentile=0.95, min_samples=20, failure_threshold=3, cooldown=30.0,
+                 max_workers=32):
+        if not providers:
+            raise ValueError("RoutedClient needs at least one provider")
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health = {name: ProviderHealth(name) for name, _ in self.providers}
+        self._lock = threading.Lock()
+        # Losing hedged requests can't be cancelled mid-flight; they finish here and still count as samples
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="model-request")
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            available = [provider for provider in self.providers if self.health[provider[0]].unavailable_until <= now]
+        return available or list(self.providers)
+
+    def _hedge_delay(self, name):
+        with self._lock:
+            health = self.health[name]
+            if self.hedge_percentile is None or len(health.latencies) < self.min_samples:
+                return None
+            return health.percentile(self.hedge_percentile)
+
+    def _call(self, name, client, params):
+        started = time.perf_counter()
+        try:
+            response = client.create_message(**params)
+        except Exception as e:
+            with self._lock:
+                health = self.health[name]
+                health.calls += 1
+                if not isinstance(e, anthropic.BadRequestError):
+                    health.errors += 1
+                    health.consecutive_errors += 1
+                    if health.consecutive_errors >= self.failure_threshold:
+                        now = time.monotonic()
+                        if health.unavailable_until <= now:
+                            logger.warning(f"Provider {name} failed {health.consecutive_errors} times in a row; "
+                                           f"skipping it for {self.cooldown:.0f}s")
+                        health.unavailable_until = now + self.cooldown
+            raise
+        with self._lock:
+            health = self.health[name]
+            health.calls += 1
+            health.consecutive_errors = 0
+            health.latencies.append(time.perf_counter() - started)
+        return response
+
+    def create_message(self, **params):
+        candidates = self._candidates()
+        pending = {}
+        last_error = None
+
+        def launch(hedge=False, retry=False):
+            name, client = candidates.pop(0)
+            if hedge:
+                with self._lock:
+                    self.health[name].hedges += 1
+                logger.info(f"Hedging model request on {name}")
+            elif retry:
+                with self._lock:
+                    self.health[name].retries += 1
+            pending[self._executor.submit(self._call, name, client, params)] = name
+
+        launch()
+        while pending:
+            # A hedge goes out when the only request in flight passes its provider's usual latency
+            delay = self._hedge_delay(next(iter(pending.values()))) if len(pending) == 1 and candidates else None
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                launch(hedge=True)
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    response = future.result()
+                except anthropic.BadRequestError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Provider {name} failed: {str(e)}")
+                    last_error = e
+                    continue
+                with self._lock:
+                    self.health[name].wins += 1
+                return response
+            if not pending and candidates:
+                launch(retry=True)
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            return {name: health.stats() for name, health in self.health.items()}
+
+
+def client_from_environment(api_key=None, routing=None):
+    """A client for the providers configured in the environment.
+
+    The first-party API is configured by an API key, Bedrock by ``AWS_REGION``, Vertex AI by
+    ``CLOUD_ML_REGION`` and ``ANTHROPIC_VERTEX_PROJECT_ID``. The first configured one is used on its own
+    unless ``routing`` (default: the AGENT_MODEL_ROUTING variable) is "failover" or "hedge", which route
+    over all of them with a RoutedClient; "hedge" also sends slow requests to a second provider.
+    """
+    routing = (os.environ.get(ROUTING_ENV, "") if routing is None else routing).strip().lower()
+    if routing not in ROUTING_MODES:
+        raise ValueError(f"Unknown model routing {routing!r}; use one of {', '.join(filter(None, ROUTING_MODES))}")
+    providers = []
+    if api_key or os.environ.get("ANTHROPIC_API_KEY"):
+        providers.append(("anthropic", lambda retries: AnthropicClient(api_key, max_retries=retries)))
+    if os.environ.get("AWS_REGION"):
+        providers.append(("bedrock", lambda retries: BedrockClient(os.environ["AWS_REGION"], max_retries=retries)))
+    if os.environ.get("CLOUD_ML_REGION") and os.environ.get("ANTHROPIC_VERTEX_PROJECT_ID"):
+        providers.append(("vertex", lambda retries: VertexClient(os.environ["CLOUD_ML_REGION"],
+                                                                 os.environ["ANTHROPIC_VERTEX_PROJECT_ID"],
+                                                                 max_retries=retries)))
+    if not providers:
+        return AnthropicClient(api_key)
+    if len(providers) == 1 or not routing:
+        name, make = providers[0]
+        if len(providers) > 1:
+            logger.info(f"Using {name} for model requests; set {ROUTING_ENV}=failover to route over "
+                        f"{', '.join(name for name, _ in providers)}")
+        return make(2)
+    logger.info(f"Routing model requests over {', '.join(name for name, _ in providers)} ({routing})")
+    # Provider clients don't retry on their own, so failover isn't delayed
+    return RoutedClient([(name, make(0)) for name, make in providers],
+                        hedge_percentile=0.95 if routing == "hedge" else None)
+
+
+def _normalize(value):
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and "data" in value:
+            # Images are keyed by content hash so cassettes stay small and stable
+            digest = hashlib.sha256(value["data"].encode('ascii')).hexdigest()
+            return {"type": "base64", "media_type": value.get("media_type"), "sha256": digest}
+        return {key: _normalize(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def request_key(params):
+    canonical = json.dumps(_normalize(params), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+class CassetteClient(ModelClient):
+    """Records model responses to disk keyed by a hash of the normalized request, and replays them.
+
+    ``mode`` is "record" (always call ``inner`` and save), "replay" (only serve recorded responses) or
+    "auto" (replay when recorded, otherwise record). Replays sleep for the recorded latency unless
+    ``replay_latency`` is "zero".
+    """
+
+    def __init__(self, directory, inner=None, mode="auto", replay_latency="original"):
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode != "replay" and inner is None:
+            raise ValueError(f"Cassette mode {mode} needs a client to record from")
+        self.directory = directory
+        self.inner = inner
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def create_message(self, **params):
+        key = request_key(params)
+        path = self._path(key)
+        if self.mode != "record" and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            self.hits += 1
+            if self.replay_latency == "original":
+                time.sleep(entry["latency"])
+            return Message.model_validate(entry["response"])
+
+        if self.mode == "replay":
+            self.misses += 1
+            raise CassetteMissError(f"No recorded response for request {key[:12]}")
+
+        started = time.perf_counter()
+        response = self.inner.create_message(**params)
+        latency = time.perf_counter() - started
+        self.misses += 1
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "key": key,
+                "model": params.get("model"),
+                "recorded": time.time(),
+                "latency": latency,
+                "response": response.model_dump(mode="json")
+            }, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.debug(f"Recorded response {key[:12]} in {latency:.2f}s")
+        return response
+
+
+def make_message(turn, model="scripted", input_tokens=0, output_tokens=0):
+    """Build a Message from a scripted turn: a text string, or a list of text strings and (tool, input) pairs."""
+    if isinstance(turn, str):
+        turn = [turn]
+    content = []
+    for index, item in enumerate(turn):
+        if isinstance(item, str):
+            content.append({"type": "text", "text": item})
+        else:
+            name, tool_input = item
+            content.append({"type": "tool_use", "id": f"toolu_scripted_{index}_{random.getrandbits(32):08x}",
+                            "name": name, "input": tool_input})
+    stop_reason = "tool_use" if any(block["type"] == "tool_use" for block in content) else "end_turn"
+    return Message.model_validate({
+        "id": f"msg_scripted_{random.getrandbits(48):012x}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    })
+
+
+class ScriptedClient(ModelClient):
+    """Stub client that answers from a script, for synthetic load without network or API keys.
+
+    ``script`` is a list of turns (see ``make_message``), cycled if ``loop`` is set, or a callable that
+    receives the request parameters and returns a turn. ``latency`` and ``jitter`` are in seconds.
+    To stand in for a degraded endpoint, ``error_rate`` of the calls raise after their latency and
+    ``stall_rate`` of them take ``stall_latency`` seconds instead.
+    """
+
+    def __init__(self, script, latency=0.0, jitter=0.0, loop=False, seed=None, error_rate=0.0, stall_rate=0.0,
+                 stall_latency=0.0):
+        self.script = script
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._turns = None if callable(script) else (itertools.cycle(script) if loop else iter(script))
+
+    def create_message(self, **params):
+        self.calls += 1
+        delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if self.stall_rate and self._rng.random() < self.stall_rate:
+            delay = self.stall_latency
+        failed = self.error_rate and self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise Exception("Scripted server error")
+        if self._turns is None:
+            turn = self.script(params)
+        else:
+            turn = next(self._turns, [("done", {"status": "failed", "reason": "Script exhausted"})])
+        # Rough token estimate so usage-based metrics have something to aggregate
+        input_tokens = len(json.dumps(_normalize(params.get("messages", [])))) // 4
+        return make_message(turn, params.get("model", "scripted"), input_tokens, 50)
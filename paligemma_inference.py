@@ -3,13 +3,19 @@ import PIL.Image
 from transformers import PaliGemmaForConditionalGeneration, PaliGemmaProcessor
 import torch
 import os
-import re
-from PIL import ImageDraw, Image
 import uuid
 import numpy as np
+from paligemma_postprocess import parse_objects, overlay_objects, stack_masks
 
 # Constants
-COLORS = ['#4285f4', '#db4437', '#f4b400', '#0f9d58', '#e48ef1']
+DEFAULT_MODEL_ID = "google/paligemma-3b-mix-448"
+# 256 image tokens instead of 1024, which is most of the prefill cost on CPU
+CPU_MODEL_ID = "google/paligemma-3b-mix-224"
+DEFAULT_MAX_NEW_TOKENS = 100
+# Each detection is 4 location tokens, a short label and the " ; " separator; a segmentation adds 16 mask tokens
+TOKENS_PER_OBJECT = {"detect": 12, "segment": 28}
+# Objects budgeted for each query of a "button ; text field" prompt
+OBJECTS_PER_QUERY = 4
 
 def load_model(model_id):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -17,88 +23,99 @@ def load_model(model_id):
     
     model = PaliGemmaForConditionalGeneration.from_pretrained(model_id).eval().to(device)
     processor = PaliGemmaProcessor.from_pretrained(model_id)
+    # Batched generation needs the prompts aligned on the right
+    processor.tokenizer.padding_side = "left"
     return model, processor, device
 
+def configure_cpu_threads(intra_op_threads=None, inter_op_threads=None):
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only allowed before the first parallel operation in the process
+            print(f"Could not set inter-op threads: {str(e)}")
+    print(f"CPU threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+def optimize_for_cpu(model, quantize=True, bf16=False, compile=False):
+    """Quantize the linear layers to int8 and optionally run in bf16 autocast and/or a compiled forward pass."""
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    # Read by infer_batch, so every caller (CLI, grounding server, benchmarks) picks it up
+    model.autocast_dtype = torch.bfloat16 if bf16 else None
+    if compile:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+def load_cpu_model(model_id=CPU_MODEL_ID, quantize=True, bf16=False, compile=False,
+                   intra_op_threads=None, inter_op_threads=None):
+    configure_cpu_threads(intra_op_threads, inter_op_threads)
+    model = PaliGemmaForConditionalGeneration.from_pretrained(model_id).eval()
+    processor = PaliGemmaProcessor.from_pretrained(model_id)
+    processor.tokenizer.padding_side = "left"
+    return optimize_for_cpu(model, quantize, bf16, compile), processor, torch.device("cpu")
+
+def add_model_arguments(parser):
+    parser.add_argument("--model_id", type=str, help=f"Model ID to use (default: {DEFAULT_MODEL_ID}, or {CPU_MODEL_ID} with --cpu)")
+    parser.add_argument("--cpu", action="store_true", help="CPU performance mode: int8 linear layers and the 224px model")
+    parser.add_argument("--no_quantize", action="store_true", help="Keep fp32 linear layers in CPU mode")
+    parser.add_argument("--bf16", action="store_true", help="Run CPU inference under bf16 autocast")
+    parser.add_argument("--compile", action="store_true", help="Compile the forward pass with torch.compile")
+    parser.add_argument("--threads", type=int, help="Intra-op CPU threads")
+    parser.add_argument("--interop_threads", type=int, help="Inter-op CPU threads")
+
+def load_model_from_args(args):
+    if args.cpu:
+        return load_cpu_model(args.model_id or CPU_MODEL_ID, not args.no_quantize, args.bf16, args.compile,
+                              args.threads, args.interop_threads)
+    return load_model(args.model_id or DEFAULT_MODEL_ID)
+
+def task_max_new_tokens(task, text):
+    if task == "generate":
+        return DEFAULT_MAX_NEW_TOKENS
+    return TOKENS_PER_OBJECT[task] * OBJECTS_PER_QUERY * len(text.split(";"))
+
+def max_new_tokens_for(task, text, requested=None, limit=False):
+    """Token budget for a request, sized from the number of queries in ``text``.
+
+    With ``limit`` (CPU mode) larger requests are capped to it; otherwise it only raises the default of 100
+    when that can't fit every query.
+    """
+    budget = task_max_new_tokens(task, text)
+    if limit:
+        return min(requested, budget) if requested else budget
+    return requested or max(budget, DEFAULT_MAX_NEW_TOKENS)
+
 def infer(image, text, max_new_tokens, model, processor, device):
-    inputs = processor(text=text, images=image, return_tensors="pt").to(device)
-    with torch.inference_mode():
+    return infer_batch([image], [text], max_new_tokens, model, processor, device)[0]
+
+def infer_batch(images, texts, max_new_tokens, model, processor, device):
+    inputs = processor(text=texts, images=images, return_tensors="pt", padding="longest").to(device)
+    autocast_dtype = getattr(model, "autocast_dtype", None)
+    with torch.inference_mode(), torch.autocast("cpu", dtype=autocast_dtype, enabled=autocast_dtype is not None):
         generated_ids = model.generate(
             **inputs,
             max_new_tokens=max_new_tokens,
             do_sample=False
         )
-    result = processor.batch_decode(generated_ids, skip_special_tokens=True)
-    return result[0][len(text):].lstrip("\n")
+    # Every row shares the padded prompt length, so the generated tokens start at the same offset
+    generated_ids = generated_ids[:, inputs["input_ids"].shape[1]:]
+    results = processor.batch_decode(generated_ids, skip_special_tokens=True)
+    return [result.lstrip("\n") for result in results]
 
-def decode_segmentation_mask(seg_indices, box_width, box_height):
-    # Convert string indices to integers
-    indices = [int(idx) for idx in seg_indices if idx is not None]
-    
-    # Create a 4x4 grid of the indices
-    grid = np.array(indices).reshape(4, 4)
-    
-    # Upsample to 64x64 using nearest neighbor interpolation
-    mask_64 = np.repeat(np.repeat(grid, 16, axis=0), 16, axis=1)
-    
-    # Resize to box dimensions
-    mask = Image.fromarray(mask_64.astype(np.uint8))
-    mask = mask.resize((box_width, box_height), Image.NEAREST)
-    
-    return np.array(mask)
-
-def parse_segmentation(output, image_width, image_height):
-    _SEGMENT_DETECT_RE = re.compile(
-        r'(.*?)' +
-        r'<loc(\d{4})>' * 4 + r'\s*' +
-        '(?:%s)?' % (r'<seg(\d{3})>' * 16) +
-        r'\s*([^;<>]+)? ?(?:; )?',
-    )
-
-    objs = []
-    seen = set()
-    while output:
-        m = _SEGMENT_DETECT_RE.match(output)
-        if not m:
-            break
-        gs = list(m.groups())
-        before = gs.pop(0)
-        name = gs.pop()
-        y1, x1, y2, x2 = [int(x) / 1024 for x in gs[:4]]
-        
-        y1, x1, y2, x2 = map(round, (y1*image_height, x1*image_width, y2*image_height, x2*image_width))
-        seg_indices = gs[4:20]
-
-        # Generate segmentation mask
-        box_width, box_height = x2 - x1, y2 - y1
-        if all(seg_indices):
-            mask = decode_segmentation_mask(seg_indices, box_width, box_height)
-        else:
-            mask = None
-        
-        content = m.group()
-        if before:
-            objs.append(dict(content=before))
-            content = content[len(before):]
-        while name in seen:
-            name = (name or '') + "'"
-        seen.add(name)
-        objs.append(dict(
-            content=content, xyxy=(x1, y1, x2, y2), mask=mask, name=name))
-        output = output[len(before) + len(content):]
-
-    if output:
-        objs.append(dict(content=output))
-
-    return objs
+def task_prompt(task, text):
+    if task == "generate":
+        return text
+    elif task in ["segment", "detect"]:
+        return f"{task} {text}"
+    raise ValueError(f"Unknown task: {task}")
 
 def process_image(image, text, task, model, processor, device, max_new_tokens=100):
+    output = infer(image, task_prompt(task, text), max_new_tokens, model, processor, device)
     if task == "generate":
-        return infer(image, text, max_new_tokens, model, processor, device)
-    elif task in ["segment", "detect"]:
-        output = infer(image, f"{task} {text}", max_new_tokens, model, processor, device)
-        return parse_segmentation(output, image.width, image.height)
-    else:
-        raise ValueError(f"Unknown task: {task}")
+        return output
+    return parse_objects([output], [image.size])[0]
 
 def save_results(image, results, task, output_dir):
     os.makedirs(output_dir, exist_ok=True)
@@ -108,41 +125,30 @@ def save_results(image, results, task, output_dir):
             f.write(f"Generated text: {results}")
         print(f"Generated text saved to: {output_path}")
     elif task in ["segment", "detect"]:
-        output_image = image.copy()
-        draw = ImageDraw.Draw(output_image)
-        for obj in results:
-            if 'xyxy' in obj:
-                x1, y1, x2, y2 = obj['xyxy']
-                color = COLORS[hash(str(obj.get('name', ''))) % len(COLORS)]
-                if obj['mask'] is not None:
-                    # Create a colored mask
-                    colored_mask = np.array(Image.new('RGB', (x2-x1, y2-y1), color))
-                    # Apply the mask
-                    masked_area = np.where(obj['mask'][..., None], colored_mask, np.array(output_image.crop((x1, y1, x2, y2))))
-                    # Paste the masked area back onto the image
-                    output_image.paste(Image.fromarray(masked_area), (x1, y1))
-                else:
-                    draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
-                label = str(obj.get('name', 'Unknown'))
-                draw.text((x1, y1), label, fill=color)
+        boxes = np.array([obj['xyxy'] for obj in results], dtype=np.int32).reshape(-1, 4)
+        masks = [obj['mask'] for obj in results]
+        has_mask = np.array([mask is not None for mask in masks], dtype=bool)
+        output_image = overlay_objects(image, boxes, [obj['name'] for obj in results],
+                                       stack_masks(masks, boxes), has_mask)
         output_path = os.path.join(output_dir, f"{task}_result_{uuid.uuid4()}.png")
         output_image.save(output_path)
         print(f"Annotated image saved to: {output_path}")
 
 def main():
     parser = argparse.ArgumentParser(description="PaliGemma Inference Script")
-    parser.add_argument("--model_id", type=str, default="google/paligemma-3b-mix-448", help="Model ID to use")
+    add_model_arguments(parser)
     parser.add_argument("--image_path", type=str, required=True, help="Path to input image")
     parser.add_argument("--text", type=str, required=True, help="Input text prompt")
     parser.add_argument("--task", type=str, choices=["generate", "segment", "detect"], default="generate", help="Task to perform")
-    parser.add_argument("--max_new_tokens", type=int, default=100, help="Maximum number of new tokens to generate")
+    parser.add_argument("--max_new_tokens", type=int, help="Maximum number of new tokens to generate (default: sized from the queries)")
     parser.add_argument("--output_dir", type=str, default="output", help="Directory to save output files")
     args = parser.parse_args()
 
-    model, processor, device = load_model(args.model_id)
+    model, processor, device = load_model_from_args(args)
     image = PIL.Image.open(args.image_path).convert("RGB")
     
-    results = process_image(image, args.text, args.task, model, processor, device, args.max_new_tokens)
+    max_new_tokens = max_new_tokens_for(args.task, args.text, args.max_new_tokens, args.cpu)
+    results = process_image(image, args.text, args.task, model, processor, device, max_new_tokens)
     save_results(image, results, args.task, args.output_dir)
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+import re
+import zlib
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw
+
+COLORS = ['#4285f4', '#db4437', '#f4b400', '#0f9d58', '#e48ef1']
+_PALETTE = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in COLORS], dtype=np.uint8)
+
+_SEGMENT_DETECT_RE = re.compile(
+    r'(.*?)' +
+    r'<loc(\d{4})>' * 4 + r'\s*' +
+    '(?:%s)?' % (r'<seg(\d{3})>' * 16) +
+    r'\s*([^;<>]+)? ?(?:; )?',
+)
+# Location and segmentation tokens have fixed widths, so their digits can be sliced out of the raw bytes
+_OBJECT_RE = re.compile(r'((?:<loc\d{4}>){4})\s*((?:<seg\d{3}>){16})?\s*([^;<>]+)? ?(?:; )?')
+_LOC_WIDTH = len("<loc0000>")
+_SEG_WIDTH = len("<seg000>")
+
+
+def color_index(name):
+    return zlib.crc32(str(name).encode('utf-8')) % len(COLORS)
+
+
+def decode_segmentation_mask(seg_indices, box_width, box_height):
+    # Convert string indices to integers
+    indices = [int(idx) for idx in seg_indices if idx is not None]
+
+    # Create a 4x4 grid of the indices
+    grid = np.array(indices).reshape(4, 4)
+
+    # Upsample to 64x64 using nearest neighbor interpolation
+    mask_64 = np.repeat(np.repeat(grid, 16, axis=0), 16, axis=1)
+
+    # Resize to box dimensions
+    mask = Image.fromarray(mask_64.astype(np.uint8))
+    mask = mask.resize((box_width, box_height), Image.NEAREST)
+
+    return np.array(mask)
+
+
+def parse_segmentation(output, image_width, image_height):
+    """Per-object reference parser, kept to check ``parse_outputs``/``decode_masks`` against; use ``parse_objects``.
+
+    Its names keep the space before " ; " and get a "'" appended per repeat (the second "button " comes out as
+    "button '"), which only served to tell overlay labels apart; ``parse_objects`` returns the plain label.
+    """
+    objs = []
+    seen = set()
+    while output:
+        m = _SEGMENT_DETECT_RE.match(output)
+        if not m:
+            break
+        gs = list(m.groups())
+        before = gs.pop(0)
+        name = gs.pop()
+        y1, x1, y2, x2 = [int(x) / 1024 for x in gs[:4]]
+
+        y1, x1, y2, x2 = map(round, (y1*image_height, x1*image_width, y2*image_height, x2*image_width))
+        seg_indices = gs[4:20]
+
+        # Generate segmentation mask
+        box_width, box_height = x2 - x1, y2 - y1
+        if all(seg_indices):
+            mask = decode_segmentation_mask(seg_indices, box_width, box_height)
+        else:
+            mask = None
+
+        content = m.group()
+        if before:
+            objs.append(dict(content=before))
+            content = content[len(before):]
+        while name in seen:
+            name = (name or '') + "'"
+        seen.add(name)
+        objs.append(dict(
+            content=content, xyxy=(x1, y1, x2, y2), mask=mask, name=name))
+        output = output[len(before) + len(content):]
+
+    if output:
+        objs.append(dict(content=output))
+
+    return objs
+
+
+def _token_digits(chunks, count, width, digits):
+    # chunks: equal-length token runs such as "<loc0123><loc0456>..." -> (len(chunks), count) integers
+    raw = np.frombuffer("".join(chunks).encode('ascii'), dtype=np.uint8).reshape(len(chunks), count, width)
+    values = raw[:, :, width - 1 - digits:width - 1].astype(np.int32) - ord('0')
+    return values @ (10 ** np.arange(digits - 1, -1, -1, dtype=np.int32))
+
+
+class ParsedBatch:
+    """Objects parsed from many PaliGemma outputs, as flat arrays.
+
+    ``output_index[i]`` is the output object i came from, ``boxes[i]`` its (x1, y1, x2, y2) box in image
+    pixels, ``seg[i]`` its 16 mask codes (valid where ``has_mask[i]``) and ``names[i]`` its label.
+    """
+
+    def __init__(self, output_index, boxes, seg, has_mask, names):
+        self.output_index = output_index
+        self.boxes = boxes
+        self.seg = seg
+        self.has_mask = has_mask
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def select(self, index):
+        """Indices of the objects parsed from output ``index``."""
+        return np.flatnonzero(self.output_index == index)
+
+
+def parse_outputs(outputs, sizes):
+    """Parse the location and segmentation tokens of all ``outputs`` at once; ``sizes`` holds (width, height) per output.
+
+    Objects cut off before their label, as at the end of a truncated output, are left out.
+    """
+    output_index = []
+    locs = []
+    segs = []
+    seg_rows = []
+    names = []
+    for index, output in enumerate(outputs):
+        matches = list(_OBJECT_RE.finditer(output))
+        # Output cut off by the token budget ends in a partial token or mask after an object that has no label yet
+        if matches and matches[-1].group(3) is None and output[matches[-1].end():].strip():
+            matches.pop()
+        for match in matches:
+            if match.group(2):
+                seg_rows.append(len(locs))
+                segs.append(match.group(2))
+            output_index.append(index)
+            locs.append(match.group(1))
+            names.append((match.group(3) or "").strip())
+
+    count = len(locs)
+    output_index = np.array(output_index, dtype=np.int32)
+    boxes = np.zeros((count, 4), dtype=np.int32)
+    seg = np.zeros((count, 16), dtype=np.int32)
+    has_mask = np.zeros(count, dtype=bool)
+    if count:
+        sizes = np.asarray(sizes, dtype=np.float64)[output_index]
+        y1, x1, y2, x2 = (_token_digits(locs, 4, _LOC_WIDTH, 4) / 1024).T
+        width, height = sizes[:, 0], sizes[:, 1]
+        boxes[:] = np.rint(np.stack([x1 * width, y1 * height, x2 * width, y2 * height], axis=1))
+    if segs:
+        seg[seg_rows] = _token_digits(segs, 16, _SEG_WIDTH, 3)
+        has_mask[seg_rows] = True
+    return ParsedBatch(output_index, boxes, seg, has_mask, names)
+
+
+def parse_objects(outputs, sizes):
+    """Objects per output as dicts with ``xyxy``, ``mask`` (None without segmentation tokens) and ``name``.
+
+    Parses every output in one ``parse_outputs`` call and decodes all masks with one ``decode_masks`` call.
+    """
+    parsed = parse_outputs(outputs, sizes)
+    masked = np.flatnonzero(parsed.has_mask)
+    masks = decode_masks(parsed.seg[masked], parsed.boxes[masked])
+    mask_row = dict(zip(masked.tolist(), range(len(masked))))
+    results = [[] for _ in outputs]
+    for index, (x1, y1, x2, y2) in enumerate(parsed.boxes.tolist()):
+        mask = None
+        if index in mask_row:
+            mask = masks[mask_row[index], :max(y2 - y1, 0), :max(x2 - x1, 0)]
+        results[parsed.output_index[index]].append({"xyxy": (x1, y1, x2, y2), "mask": mask,
+                                                    "name": parsed.names[index]})
+    return results
+
+
+def _nearest_source(sizes, length, source=64):
+    # Source pixel PIL's nearest-neighbor resize samples from a 64px row; the step is accumulated the same
+    # way PIL does it so the masks match decode_segmentation_mask exactly
+    step = source / np.maximum(sizes, 1).astype(np.float64)
+    offsets = np.repeat(step[:, None], length, axis=1)
+    offsets[:, 0] *= 0.5
+    return np.cumsum(offsets, axis=1).astype(np.int32)
+
+
+def decode_masks(seg, boxes, out=None):
+    """Nearest-neighbor upsample every 4x4 code grid to its box size in one step.
+
+    Returns a (count, max_height, max_width) uint8 array; mask i occupies ``[i, :height_i, :width_i]``
+    and is zero elsewhere. ``out`` may be a preallocated array of at least that size.
+    """
+    count = len(seg)
+    widths = np.maximum(boxes[:, 2] - boxes[:, 0], 0)
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    max_height = int(heights.max()) if count else 0
+    max_width = int(widths.max()) if count else 0
+    if out is None:
+        out = np.empty((count, max_height, max_width), dtype=np.uint8)
+    else:
+        out = out[:count, :max_height, :max_width]
+    out.fill(0)
+    if not count or not max_height or not max_width:
+        return out
+    # Grid cell per output row and column; padding past each box's size points at an all-zero cell
+    rows = np.minimum(_nearest_source(heights, max_height) // 16, 3)
+    rows[np.arange(max_height)[None, :] >= heights[:, None]] = 4
+    cols = np.minimum(_nearest_source(widths, max_width) // 16, 3)
+    cols[np.arange(max_width)[None, :] >= widths[:, None]] = 4
+    grids = np.zeros((count, 5, 5), dtype=np.uint8)
+    grids[:, :4, :4] = seg.reshape(count, 4, 4)
+    expanded_rows = grids[np.arange(count)[:, None], rows]
+    # Each row is four runs of one grid cell, so four masked copies fill the whole array
+    for cell in range(4):
+        np.copyto(out, expanded_rows[:, :, cell:cell + 1], where=(cols == cell)[:, None, :])
+    return out
+
+
+def stack_masks(masks, boxes):
+    """Pack per-object masks (or None) into the array layout returned by ``decode_masks``."""
+    widths = np.maximum(boxes[:, 2] - boxes[:, 0], 0)
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    out = np.zeros((len(masks), int(heights.max(initial=0)), int(widths.max(initial=0))), dtype=np.uint8)
+    for index, mask in enumerate(masks):
+        if mask is not None:
+            out[index, :mask.shape[0], :mask.shape[1]] = mask
+    return out
+
+
+@lru_cache(maxsize=1024)
+def _label_bitmap(text):
+    # Pixel offsets and coverage of the rendered label, so each distinct label is rasterized once
+    left, top, right, bottom = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text)
+    canvas = Image.new('L', (max(right, 1), max(bottom, 1)))
+    ImageDraw.Draw(canvas).text((0, 0), text, fill=255)
+    coverage = np.asarray(canvas)
+    ys, xs = np.nonzero(coverage)
+    return ys, xs, coverage[ys, xs].astype(np.float32) / 255
+
+
+def overlay_objects(image, boxes, names, masks=None, has_mask=None):
+    """Fill masks with solid colors, outline boxes without one and label every object.
+
+    Masks are composited in one NumPy pass (later objects over earlier ones) and labels are blended
+    from cached bitmaps. Returns a new PIL image.
+    """
+    frame = np.asarray(image.convert("RGB"))
+    height, width = frame.shape[:2]
+    colors = np.array([color_index(name) for name in names], dtype=np.int32)
+    if has_mask is None:
+        has_mask = np.zeros(len(names), dtype=bool)
+    label = np.full(height * width, -1, dtype=np.int32)
+    if masks is not None and has_mask.any():
+        index, ys, xs = np.nonzero((masks > 0) & has_mask[:, None, None])
+        ys = ys + boxes[index, 1]
+        xs = xs + boxes[index, 0]
+        inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        np.maximum.at(label, ys[inside] * width + xs[inside], index[inside])
+    label = label.reshape(height, width)
+    painted = label >= 0
+    frame = np.where(painted[:, :, None], _PALETTE[colors[np.maximum(label, 0)]], frame) if painted.any() else frame.copy()
+
+    texts = [str(name or 'Unknown') for name in names]
+    for text in set(texts):
+        selected = np.array([i for i, other in enumerate(texts) if other == text], dtype=np.int32)
+        ys, xs, alpha = _label_bitmap(text)
+        ys = (ys[None, :] + boxes[selected, 1:2]).ravel()
+        xs = (xs[None, :] + boxes[selected, 0:1]).ravel()
+        alpha = np.tile(alpha, len(selected))[:, None]
+        color = np.repeat(_PALETTE[colors[selected]], len(alpha) // len(selected), axis=0)
+        inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        ys, xs, alpha, color = ys[inside], xs[inside], alpha[inside], color[inside]
+        frame[ys, xs] = (frame[ys, xs] * (1 - alpha) + color * alpha).astype(np.uint8)
+
+    output = Image.fromarray(frame)
+    draw = ImageDraw.Draw(output)
+    for (x1, y1, x2, y2), name, masked in zip(boxes.tolist(), names, has_mask.tolist()):
+        if not masked:
+            draw.rectangle([x1, y1, x2, y2], outline=COLORS[color_index(name)], width=2)
+    return output
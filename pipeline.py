@@ -0,0 +1,259 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from device import AdbDevice
+from screen import png_size
+from frame_grabber import encode_png
+
+logger = logging.getLogger(__name__)
+
+
+class Observation:
+    def __init__(self, png, ui_xml, cursor_position, captured_at=None):
+        self.png = png
+        self.ui_xml = ui_xml
+        self.cursor_position = cursor_position
+        self.captured_at = captured_at or time.time()
+
+
+class StageTimings:
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages.append((name, start, time.perf_counter()))
+
+    def durations(self):
+        totals = {}
+        for name, start, end in self.stages:
+            totals[name] = totals.get(name, 0.0) + end - start
+        return totals
+
+    def wall_time(self):
+        if not self.stages:
+            return 0.0
+        return max(end for _, _, end in self.stages) - min(start for _, start, _ in self.stages)
+
+    def overlap(self):
+        # Time saved by running stages concurrently instead of back to back
+        return max(0.0, sum(self.durations().values()) - self.wall_time())
+
+    def summary(self):
+        parts = [f"{name}={duration:.2f}s" for name, duration in self.durations().items()]
+        parts.append(f"wall={self.wall_time():.2f}s")
+        parts.append(f"overlap={self.overlap():.2f}s")
+        return " ".join(parts)
+
+
+class StepScheduler:
+    """Overlaps UI dumps, settle checks and frame refreshes with actions and model requests.
+
+    Call ``action_sent`` as each action goes out: the UI dump for the next observation starts then, and
+    observations captured before it are no longer offered as the latest.
+    """
+
+    def __init__(self, device_type="android", settle_timeout=3.0, settle_interval=0.2, refresh_interval=1.0,
+                 frame_grabber=None, device=None):
+        self.device_type = device_type
+        self.device = device or AdbDevice(device_type)
+        self.frame_grabber = frame_grabber
+        self.settle_timeout = settle_timeout
+        self.settle_interval = settle_interval
+        self.refresh_interval = refresh_interval
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # uiautomator refuses to run two dumps at once
+        self._dump_lock = threading.Lock()
+        self._latest_lock = threading.Lock()
+        self._latest = None
+        self._action_at = 0.0
+        self._pending_dump = None
+        self._cursor_position = None
+        # Taken from the first captured frame, so no separate dimensions query is needed
+        self.screen_size = None
+        self._listeners = []
+
+    @property
+    def cursor_position(self):
+        if self._cursor_position is None:
+            width, height = self.screen_size or self.device.screen_dimensions()
+            self._cursor_position = (width // 2, height // 2)
+        return self._cursor_position
+
+    def _note_frame(self, png):
+        if self.screen_size is None and png:
+            try:
+                self.screen_size = png_size(png)
+            except Exception as e:
+                logger.debug(f"Could not read frame size: {str(e)}")
+
+    def _submit(self, function, *args):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="capture")
+            return self._executor.submit(function, *args)
+
+    def _dump(self, timings):
+        with self._dump_lock, timings.stage("ui_dump"):
+            ui_xml = self.device.dump_ui_xml()
+        return ui_xml, time.perf_counter()
+
+    def action_sent(self, timings=None):
+        """Note that an action is going out and start the UI dump for the observation after it.
+
+        uiautomator spends most of a dump starting up, so the hierarchy is read after the action has
+        landed; ``observe`` dumps again if the screen changed after this dump finished.
+        """
+        self._action_at = time.time()
+        if self._pending_dump is not None:
+            # Superseded by this action; cancel() only succeeds if it hasn't started
+            self._pending_dump.cancel()
+        self._pending_dump = self._submit(self._dump, timings or StageTimings())
+
+    def _use_grabber(self):
+        return self.frame_grabber is not None and self.frame_grabber.is_running
+
+    def _capture_png(self):
+        if self._use_grabber():
+            png, timestamp = self.frame_grabber.latest_png()
+            # A frame grabbed before the last action shows a screen that may already be gone
+            if png is not None and timestamp >= self._action_at:
+                return png
+        return self.device.capture_png()
+
+    def _wait_for_grabbed_frame(self, deadline):
+        """Wait for a frame grabbed after the last action; returns the frame and sequence, or None at the deadline."""
+        sequence = self.frame_grabber.buffer.sequence
+        while True:
+            frame, timestamp = self.frame_grabber.latest()
+            if frame is not None and timestamp >= self._action_at:
+                return frame, sequence
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None, sequence
+            sequence = self.frame_grabber.wait_for_frame(sequence, remaining)
+
+    def _wait_for_grabbed_settle(self):
+        # Streamed sources only emit frames on change, so a quiet interval also counts as settled
+        deadline = time.perf_counter() + self.settle_timeout
+        previous, sequence = self._wait_for_grabbed_frame(deadline)
+        if previous is None:
+            logger.debug("No frame grabbed since the last action, capturing from the device")
+            return self._wait_for_polled_settle(deadline)
+        last_change = time.perf_counter()
+        while time.perf_counter() < deadline:
+            new_sequence = self.frame_grabber.wait_for_frame(sequence, self.settle_interval)
+            if new_sequence == sequence:
+                break
+            sequence = new_sequence
+            frame, _ = self.frame_grabber.latest()
+            if np.array_equal(frame, previous):
+                break
+            previous = frame
+            last_change = time.perf_counter()
+        return encode_png(previous), last_change
+
+    def _wait_for_polled_settle(self, deadline):
+        previous = self.device.capture_png()
+        last_change = time.perf_counter()
+        while time.perf_counter() < deadline:
+            time.sleep(self.settle_interval)
+            frame = self.device.capture_png()
+            if frame == previous:
+                break
+            previous = frame
+            last_change = time.perf_counter()
+        else:
+            logger.debug("Screen did not settle before timeout, using the latest frame")
+        return previous, last_change
+
+    def _wait_for_settle(self, timings):
+        with timings.stage("settle"):
+            if self._use_grabber():
+                return self._wait_for_grabbed_settle()
+            return self._wait_for_polled_settle(time.perf_counter() + self.settle_timeout)
+
+    def observe(self, timings=None):
+        """Capture an observation with the UI dump and settle check running side by side."""
+        timings = timings or StageTimings()
+        captured_at = time.time()
+        dump_future, self._pending_dump = self._pending_dump, None
+        if dump_future is None:
+            dump_future = self._submit(self._dump, timings)
+        settle_future = self._submit(self._wait_for_settle, timings)
+        png, last_change = settle_future.result()
+        ui_xml, dumped_at = dump_future.result()
+        if last_change > dumped_at:
+            # The screen kept changing after the dump finished, so the hierarchy may be stale
+            ui_xml, _ = self._dump(timings)
+        self._note_frame(png)
+        observation = Observation(png, ui_xml, self.cursor_position, captured_at)
+        self._set_latest(observation)
+        return observation
+
+    def add_listener(self, callback):
+        """Call ``callback(observation)`` with every new observation, on the thread that captured it."""
+        self._listeners.append(callback)
+
+    def _set_latest(self, observation):
+        with self._latest_lock:
+            # captured_at is when the capture started, so anything begun before the last action is stale
+            if observation.captured_at < self._action_at or \
+                    (self._latest is not None and observation.captured_at < self._latest.captured_at):
+                return
+            self._latest = observation
+        for callback in self._listeners:
+            try:
+                callback(observation)
+            except Exception as e:
+                logger.debug(f"Observation listener failed: {str(e)}")
+
+    def latest(self):
+        with self._latest_lock:
+            return self._latest
+
+    def _refresh_loop(self, stop_event, timings):
+        while not stop_event.wait(self.refresh_interval):
+            try:
+                with timings.stage("refresh"):
+                    captured_at = time.time()
+                    png = self._capture_png()
+                    latest = self.latest()
+                    # The dump is the expensive part; skip it while the screen hasn't changed
+                    if stop_event.is_set() or (latest is not None and latest.png == png):
+                        continue
+                    ui_xml, _ = self._dump(StageTimings())
+                self._set_latest(Observation(png, ui_xml, self.cursor_position, captured_at))
+            except Exception as e:
+                logger.debug(f"Background frame refresh failed: {str(e)}")
+
+    @contextmanager
+    def refreshing(self, timings=None):
+        """Keep the latest observation fresh in the background while the model is generating."""
+        timings = timings or StageTimings()
+        stop_event = threading.Event()
+        future = self._submit(self._refresh_loop, stop_event, timings)
+        try:
+            yield
+        finally:
+            # Wait out an in-flight refresh so it can't overlap the action that follows
+            stop_event.set()
+            future.result()
+
+    def shutdown(self):
+        """Wait for background captures and release the worker threads; they restart on the next use."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        self._pending_dump = None
+        if executor is not None:
+            executor.shutdown(wait=True)
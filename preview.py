@@ -0,0 +1,145 @@
+import io
+import time
+import logging
+import threading
+from PIL import Image, ImageDraw
+from macros import action_point
+from ui_tree import parse_ui_xml, element_at
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREVIEW_SIZE = (270, 600)
+DEFAULT_PREVIEW_FPS = 8
+TOUCH_COLOR = (229, 57, 53)
+ELEMENT_COLOR = (255, 193, 7)
+
+
+def decode_thumbnail(png, max_size=DEFAULT_PREVIEW_SIZE):
+    """Decode a screenshot and shrink it to fit ``max_size``; returns the image and the scale applied."""
+    image = Image.open(io.BytesIO(png))
+    image.load()
+    scale = min(max_size[0] / image.width, max_size[1] / image.height, 1.0)
+    # reduce() is a cheap integer box filter; the final resize then only has to cover a small factor
+    factor = int(1 / scale) if scale < 1 else 1
+    if factor > 1:
+        image = image.reduce(factor)
+    size = (max(1, round(image.width * scale * factor)), max(1, round(image.height * scale * factor)))
+    return image.convert("RGB").resize(size, Image.BILINEAR), scale
+
+
+def draw_action_overlay(image, scale, action):
+    """Mark the last tap, long press or swipe and the bounds of the element it landed on.
+
+    ``action`` is (name, params, element_bounds) in device pixels; ``element_bounds`` may be None.
+    """
+    name, params, bounds = action
+    draw = ImageDraw.Draw(image)
+    if bounds is not None:
+        left, top, right, bottom = (round(value * scale) for value in bounds)
+        draw.rectangle([left, top, right, bottom], outline=ELEMENT_COLOR, width=2)
+    point = action_point(name, params)
+    if point is None:
+        return image
+    x, y = round(point[0] * scale), round(point[1] * scale)
+    if name == "swipe":
+        end = (round(params["end_x"] * scale), round(params["end_y"] * scale))
+        draw.line([(x, y), end], fill=TOUCH_COLOR, width=3)
+        draw.ellipse([end[0] - 3, end[1] - 3, end[0] + 3, end[1] + 3], fill=TOUCH_COLOR)
+    radius = 8 if name == "long_press" else 6
+    draw.ellipse([x - radius, y - radius, x + radius, y + radius], outline=TOUCH_COLOR, width=3)
+    return image
+
+
+class PreviewFeed:
+    """Renders the agent's own observations into preview images on a background thread.
+
+    ``frame`` and ``action`` only store the latest value and return, so they are safe to call from the
+    agent's capture threads. The render thread coalesces everything that arrived since its last pass
+    and renders at most ``max_fps`` times a second, handing each image to ``on_frame`` (from the
+    render thread). Thumbnails are reused when only the action overlay changed.
+    """
+
+    def __init__(self, on_frame, max_size=DEFAULT_PREVIEW_SIZE, max_fps=DEFAULT_PREVIEW_FPS):
+        self.on_frame = on_frame
+        self.max_size = max_size
+        self.min_interval = 1 / max_fps
+        self.submitted = 0
+        self.rendered = 0
+        self._frame = None
+        self._ui_xml = None
+        self._action = None
+        self._thumbnail = None
+        self._target = None
+        self._version = 0
+        self._rendered_version = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def frame(self, observation):
+        with self._lock:
+            self._frame = observation.png
+            self._ui_xml = observation.ui_xml
+            self._version += 1
+            self.submitted += 1
+        self._wake.set()
+
+    def action(self, name, params):
+        # Element bounds are resolved on the render thread against the screen the action was taken on
+        with self._lock:
+            self._action = (name, dict(params), self._ui_xml)
+            self._version += 1
+            self.submitted += 1
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._render_loop, name="preview", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _render_loop(self):
+        last_render = 0.0
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            # Anything arriving while we wait out the interval is folded into this render
+            delay = last_render + self.min_interval - time.perf_counter()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            with self._lock:
+                if self._version == self._rendered_version or self._frame is None:
+                    continue
+                png, action, version = self._frame, self._action, self._version
+            try:
+                image = self.render(png, action)
+            except Exception as e:
+                logger.debug(f"Preview render failed: {str(e)}")
+                continue
+            last_render = time.perf_counter()
+            self._rendered_version = version
+            self.rendered += 1
+            self.on_frame(image)
+
+    def render(self, png, action):
+        if self._thumbnail is None or self._thumbnail[0] is not png:
+            self._thumbnail = (png, *decode_thumbnail(png, self.max_size))
+        _, thumbnail, scale = self._thumbnail
+        image = thumbnail.copy()
+        if action is not None:
+            if self._target is None or self._target[0] is not action:
+                name, params, ui_xml = action
+                point = action_point(name, params)
+                target = element_at(parse_ui_xml(ui_xml), *point) if point and ui_xml else None
+                self._target = (action, target.bounds if target is not None else None)
+            name, params, _ = action
+            draw_action_overlay(image, scale, (name, params, self._target[1]))
+        return image
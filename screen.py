@@ -1,15 +1,24 @@
 import os
 import io
-import base64
-import pyautogui
+import struct
 import logging
 from PIL import Image, ImageDraw
-import time
 import subprocess
 
 logger = logging.getLogger(__name__)
 
-screen_width, screen_height = pyautogui.size()
+
+def _pyautogui():
+    # Imported on first use: it needs a display and loads GUI libraries, which the adb paths never touch
+    import pyautogui
+    return pyautogui
+
+def cursor_position():
+    return _pyautogui().position()
+
+def png_size(png):
+    # Width and height from the IHDR chunk, without decoding the image
+    return struct.unpack('>II', png[16:24])
 
 def draw_cursor(screenshot, cursor_x, cursor_y):
     draw = ImageDraw.Draw(screenshot)
@@ -29,51 +38,30 @@ def draw_cursor(screenshot, cursor_x, cursor_y):
     
     return screenshot
 
-def capture_screenshot(device_type="android"):
-    try:
-        # 重启 ADB 服务器
-     #   subprocess.run(['adb', 'kill-server'], check=True)
-      #  time.sleep(1)
-      #  subprocess.run(['adb', 'start-server'], check=True)
-       # time.sleep(2)
-
-        # 等待设备连接
-        #subprocess.run(['adb', 'wait-for-device'], check=True)
-        
-        # 获取 UI XML
-        subprocess.run(['adb', 'shell', 'uiautomator', 'dump', '/sdcard/window_dump.xml'], check=True)
-        time.sleep(1)
-        subprocess.run(['adb', 'pull', '/sdcard/window_dump.xml'], check=True)
-        
-        with open('window_dump.xml', 'r', encoding='utf-8') as f:
-            ui_xml = f.read()
+def dump_ui_xml(remote_path='/sdcard/window_dump.xml'):
+    # uiautomator waits for the UI to go idle before dumping, so the result reflects a settled hierarchy
+    subprocess.run(['adb', 'shell', 'uiautomator', 'dump', remote_path], check=True, capture_output=True)
+    return subprocess.check_output(['adb', 'exec-out', 'cat', remote_path]).decode('utf-8')
 
-        # 修改截图命令，不使用 shell=True
-        subprocess.run(['adb', 'shell', 'screencap', '-p', '/sdcard/screenshot.png'], check=True)
-        time.sleep(1)
-        subprocess.run(['adb', 'pull', '/sdcard/screenshot.png'], check=True)
-        
-        # 读取并编码图片
-        with open('screenshot.png', 'rb') as f:
-            image_data = f.read()
-            screenshot_data = base64.b64encode(image_data).decode('utf-8')
-            
-        # 获取屏幕尺寸
-        width, height = get_screen_dimensions(device_type)
-        cursor_position = (width // 2, height // 2)
-        
-        return screenshot_data, cursor_position, ui_xml
+def capture_png():
+    # Stream the PNG straight from the device instead of writing it to /sdcard and pulling it
+    return subprocess.check_output(['adb', 'exec-out', 'screencap', '-p'])
 
+def get_foreground_activity():
+    try:
+        output = subprocess.check_output(['adb', 'shell', 'dumpsys window | grep mCurrentFocus'], text=True)
+        # mCurrentFocus=Window{1a2b3c u0 com.android.settings/com.android.settings.Settings}
+        return output.strip().rstrip('}').split(' ')[-1]
     except Exception as e:
-        logging.error(f"Error capturing screenshot: {str(e)}")
-        return None, None, None
+        logging.error(f"Error getting foreground activity: {str(e)}")
+        return ""
 
 def move_cursor(direction, distance):
     try:
         if direction in ["right", "left"]:
-            pyautogui.moveRel(xOffset=distance if direction == "right" else -distance, yOffset=0)
+            _pyautogui().moveRel(xOffset=distance if direction == "right" else -distance, yOffset=0)
         elif direction in ["down", "up"]:
-            pyautogui.moveRel(xOffset=0, yOffset=distance if direction == "down" else -distance)
+            _pyautogui().moveRel(xOffset=0, yOffset=distance if direction == "down" else -distance)
         logger.info(f"Cursor moved {direction} by {distance} pixels")
         return f"Cursor moved {direction} by {distance} pixels."
     except Exception as e:
@@ -82,7 +70,7 @@ def move_cursor(direction, distance):
 
 def click_cursor():
     try:
-        pyautogui.click()
+        _pyautogui().click()
         logger.info("Click performed successfully")
         return "Click performed successfully."
     except Exception as e:
@@ -0,0 +1,367 @@
+import io
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from xml.sax.saxutils import quoteattr
+from PIL import Image, ImageDraw
+from device import DeviceBackend
+from journal import JournalReader
+from actions import describe_action
+from macros import action_point
+from ui_tree import parse_ui_xml, element_at
+
+logger = logging.getLogger(__name__)
+
+GRAPH_FILE = "graph.json"
+
+# (mean, jitter) in seconds, roughly what adb takes against a mid-range phone over USB
+DEFAULT_LATENCY = {
+    "capture": (0.25, 0.08),
+    "ui_dump": (0.9, 0.3),
+    "action": (0.12, 0.04),
+    "query": (0.05, 0.02),
+}
+
+
+class ScreenState:
+    __slots__ = ("name", "png", "ui_xml", "activity", "transitions", "elements")
+
+    def __init__(self, name, png, ui_xml, activity="", transitions=None):
+        self.name = name
+        self.png = png
+        self.ui_xml = ui_xml
+        self.activity = activity
+        self.transitions = transitions or []
+        self.elements = parse_ui_xml(ui_xml)
+
+
+def _transition_matches(state, transition, name, params):
+    if transition["action"] != name:
+        return False
+    if name == "press_key":
+        return transition.get("key") == params["key"]
+    if name == "input_text":
+        return transition.get("text") in (None, params["text"])
+    point = action_point(name, params)
+    if point is None:
+        return False
+    if "bounds" in transition:
+        left, top, right, bottom = transition["bounds"]
+        if not (left <= point[0] < right and top <= point[1] < bottom):
+            return False
+    if "match" in transition:
+        target = element_at(state.elements, *point)
+        if target is None:
+            return False
+        descriptor = target.descriptor()
+        return all(descriptor.get(key) == value for key, value in transition["match"].items())
+    return "bounds" in transition
+
+
+class ScreenGraph:
+    """Screens and the actions that move between them.
+
+    Each state has a screenshot, a UI dump and transitions such as
+    ``{"action": "tap", "match": {"text": "Next"}, "to": "step_2"}`` or
+    ``{"action": "press_key", "key": "back", "to": "home"}``. Tap-like transitions fire when the touch lands
+    on the matched element (or inside ``bounds``); actions without a matching transition leave the screen as is.
+    """
+
+    def __init__(self, states, initial):
+        self.states = {state.name: state for state in states}
+        self.initial = initial
+        with Image.open(io.BytesIO(self.states[initial].png)) as image:
+            self.width, self.height = image.size
+
+    def next_state(self, current, name, params):
+        state = self.states[current]
+        for transition in state.transitions:
+            if _transition_matches(state, transition, name, params):
+                return transition["to"]
+        return current
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, GRAPH_FILE), 'r', encoding='utf-8') as f:
+            graph = json.load(f)
+        states = []
+        for name, spec in graph["states"].items():
+            with open(os.path.join(directory, spec["screenshot"]), 'rb') as f:
+                png = f.read()
+            with open(os.path.join(directory, spec["ui_xml"]), 'r', encoding='utf-8') as f:
+                ui_xml = f.read()
+            states.append(ScreenState(name, png, ui_xml, spec.get("activity", ""), spec.get("transitions")))
+        return cls(states, graph["initial"])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        graph = {"initial": self.initial, "states": {}}
+        for state in self.states.values():
+            with open(os.path.join(directory, f"{state.name}.png"), 'wb') as f:
+                f.write(state.png)
+            with open(os.path.join(directory, f"{state.name}.xml"), 'w', encoding='utf-8') as f:
+                f.write(state.ui_xml)
+            graph["states"][state.name] = {"screenshot": f"{state.name}.png", "ui_xml": f"{state.name}.xml",
+                                           "activity": state.activity, "transitions": state.transitions}
+        with open(os.path.join(directory, GRAPH_FILE), 'w', encoding='utf-8') as f:
+            json.dump(graph, f, indent=2)
+
+    @classmethod
+    def from_journal(cls, run_dir):
+        """Build a graph from a recorded run: each distinct screen becomes a state, each step a transition.
+
+        Only the first screen-changing action of a step gets the transition, since the intermediate
+        screens of a batch were never captured. Screens use the full-resolution frame journaled with each
+        message; older journals only have the image sent to the model.
+        """
+        reader = JournalReader(run_dir)
+        states = {}
+        order = []
+        current = None
+        pending = []
+        for entry in reader.events("message"):
+            message = entry["message"]
+            content = message["content"] if isinstance(message["content"], list) else []
+            if message["role"] == "assistant":
+                pending = _recorded_actions(content)
+                continue
+            png = reader.image(entry["frame"]) if entry.get("frame") else None
+            ui_xml = None
+            for block in content:
+                # Crops of changed regions are not screens
+                if block.get("type") == "image" and "key" in block and "region" not in block and not entry.get("frame"):
+                    png = reader.image(block["key"])
+                elif block.get("type") == "text" and block["text"].startswith("UI XML Structure:\n"):
+                    ui_xml = block["text"][len("UI XML Structure:\n"):]
+            if png is None or ui_xml is None:
+                continue
+            # Exact dumps, not masked signatures: screens that differ only in a counter are distinct states
+            signature = hashlib.sha1(ui_xml.encode('utf-8')).hexdigest()
+            if signature not in states:
+                states[signature] = ScreenState(f"screen_{len(order)}", png, ui_xml)
+                order.append(signature)
+            state = states[signature]
+            if current is not None and current is not state:
+                transition = _recorded_transition(current, pending, state.name)
+                if transition is not None and transition not in current.transitions:
+                    current.transitions.append(transition)
+            current = state
+            pending = []
+        if not order:
+            raise Exception(f"No screens with UI dumps found in {run_dir}")
+        return cls([states[signature] for signature in order], states[order[0]].name)
+
+    @classmethod
+    def generate(cls, screens=5, width=1080, height=2400, package="com.example.simulated"):
+        """Synthetic linear flow: each screen has a Next button leading on, and back returns to the previous one."""
+        states = []
+        for index in range(screens):
+            last = index == screens - 1
+            title = "Finished" if last else f"Step {index + 1} of {screens - 1}"
+            button = None if last else (width // 4, height - 400, width * 3 // 4, height - 250)
+            transitions = [] if last else [{"action": "tap", "match": {"text": "Next"}, "to": f"screen_{index + 1}"}]
+            if index > 0:
+                transitions.append({"action": "press_key", "key": "back", "to": f"screen_{index - 1}"})
+            states.append(ScreenState(f"screen_{index}", _render_screen(width, height, title, button),
+                                      _build_ui_xml(width, height, package, title, button),
+                                      f"{package}/.Step{index}", transitions))
+        return cls(states, "screen_0")
+
+
+def _recorded_actions(content):
+    actions = []
+    for block in content:
+        if block.get("type") != "tool_use":
+            continue
+        if block["name"] == "batch":
+            actions.extend((action["name"], action.get("input", {})) for action in block["input"]["actions"])
+        else:
+            actions.append((block["name"], block["input"]))
+    return actions
+
+
+def _recorded_transition(state, actions, target):
+    for name, params in actions:
+        if name == "press_key":
+            return {"action": name, "key": params["key"], "to": target}
+        point = action_point(name, params)
+        if name == "input_text" or point is None:
+            continue
+        element = element_at(state.elements, *point)
+        if element is not None:
+            match = {key: value for key, value in element.descriptor().items() if value}
+            return {"action": name, "match": match, "to": target}
+        x, y = point
+        return {"action": name, "bounds": [x - 24, y - 24, x + 24, y + 24], "to": target}
+    return None
+
+
+def _render_screen(width, height, title, button):
+    image = Image.new('RGB', (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, width, 220], fill=(33, 150, 243))
+    draw.text((60, 100), title, fill=(255, 255, 255))
+    if button:
+        draw.rectangle(button, fill=(76, 175, 80))
+        draw.text((button[0] + 40, button[1] + 60), "Next", fill=(255, 255, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _node(package, cls, bounds, text="", resource_id="", clickable=False, children=""):
+    left, top, right, bottom = bounds
+    return (f'<node text={quoteattr(text)} resource-id={quoteattr(resource_id)} class="{cls}" package="{package}" '
+            f'content-desc="" clickable="{str(clickable).lower()}" enabled="true" '
+            f'bounds="[{left},{top}][{right},{bottom}]">{children}</node>')
+
+
+def _build_ui_xml(width, height, package, title, button):
+    children = _node(package, "android.widget.TextView", (60, 80, width - 60, 160), title, f"{package}:id/title")
+    if button:
+        children += _node(package, "android.widget.Button", button, "Next", f"{package}:id/next", clickable=True)
+    root = _node(package, "android.widget.FrameLayout", (0, 0, width, height), children=children)
+    return f"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">{root}</hierarchy>"
+
+
+class SimulatedDevice(DeviceBackend):
+    """A phone backed by a ScreenGraph, with injected adb-like latency and jitter.
+
+    ``latency`` overrides entries of DEFAULT_LATENCY; ``time_scale`` multiplies every delay, so 0 runs
+    as fast as possible. Each instance has its own state, so many can share one graph.
+    """
+
+    def __init__(self, graph, latency=None, time_scale=1.0, seed=None):
+        self.graph = graph
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.time_scale = time_scale
+        self.state = graph.initial
+        self.visited = [graph.initial]
+        self.action_count = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self, operation):
+        mean, jitter = self.latency[operation]
+        with self._lock:
+            delay = max(0.0, self._rng.uniform(mean - jitter, mean + jitter)) * self.time_scale
+        if delay:
+            time.sleep(delay)
+
+    def _current(self):
+        with self._lock:
+            return self.graph.states[self.state]
+
+    def capture_png(self):
+        self._delay("capture")
+        return self._current().png
+
+    def dump_ui_xml(self):
+        self._delay("ui_dump")
+        return self._current().ui_xml
+
+    def screen_dimensions(self):
+        self._delay("query")
+        return self.graph.width, self.graph.height
+
+    def foreground_activity(self):
+        self._delay("query")
+        return self._current().activity
+
+    def _apply(self, name, params):
+        result = describe_action(name, params)
+        with self._lock:
+            self.action_count += 1
+            target = self.graph.next_state(self.state, name, params)
+            if target != self.state:
+                logger.debug(f"Simulated {name} moved {self.state} -> {target}")
+                self.state = target
+                self.visited.append(target)
+        return result
+
+    def execute_action(self, name, params):
+        self._delay("action")
+        return self._apply(name, params)
+
+    def execute_batch(self, actions):
+        # One round trip for the whole script, plus the requested delays between actions
+        self._delay("action")
+        results = []
+        for index, (name, params, delay_ms) in enumerate(actions):
+            results.append(self._apply(name, params))
+            if delay_ms and index < len(actions) - 1:
+                time.sleep(delay_ms / 1000 * self.time_scale)
+        return results
+
+
+def tap_next_policy(params):
+    """Scripted model for generated flows: tap the Next button if there is one, otherwise finish."""
+    for block in reversed(params["messages"][-1]["content"]):
+        if block.get("type") == "text" and block["text"].startswith("UI XML Structure:\n"):
+            for element in parse_ui_xml(block["text"][len("UI XML Structure:\n"):]):
+                if element.text == "Next":
+                    return [("tap", {"x": element.center[0], "y": element.center[1]})]
+            return [("done", {"status": "completed", "reason": "Reached the last screen"})]
+    return [("done", {"status": "failed", "reason": "No UI structure in the request"})]
+
+
+_FAKE_ADB = """#!/bin/sh
+dir="$(dirname "$0")"
+printf '%s\\n' "$*" >> "$dir/commands.log"
+case "$*" in
+    "exec-out screencap -p") cat "$dir/screen.png" ;;
+    "exec-out cat "*) cat "$dir/window_dump.xml" ;;
+    "shell wm size") echo "Physical size: {width}x{height}" ;;
+    "shell uiautomator dump"*) echo "UI hierchary dumped to: $3" ;;
+    "shell dumpsys window"*) echo "  mCurrentFocus=Window{{1a2b3c u0 {activity}}}" ;;
+    shell*) shift; sh -c ". '$dir/device.sh'; $*" ;;
+esac
+"""
+
+# On-device commands seen by shell scripts: each input/am call is logged to input.log (one argument per
+# field, tab separated) and takes command_ms plus text_char_ms per typed character
+_FAKE_DEVICE = """pause() {{ [ "$1" -gt 0 ] && sleep "$(awk "BEGIN {{ print $1 / 1000000 }}")"; :; }}
+record() {{ (IFS="$(printf '\\t')"; printf '%s\\n' "$*") >> '{directory}/input.log'; }}
+input() {{
+    record input "$@"
+    if [ "$1" = text ]; then pause $(({command_us} + ${{#2}} * {char_us})); else pause {command_us}; fi
+}}
+am() {{ record am "$@"; pause {command_us}; echo "Broadcast completed: result=0"; }}
+settings() {{ echo "{ime}"; }}
+"""
+
+
+@contextmanager
+def fake_adb(png, ui_xml, width=1080, height=2400, activity="com.example.simulated/.Main", ime="",
+             command_ms=0, text_char_ms=0):
+    """Put a shell-script ``adb`` that serves a fixed screen first on PATH, to time the real adb code paths.
+
+    Input commands are accepted but do nothing. Each one can be given a cost: ``command_ms`` for every
+    ``input``/``am`` call, plus ``text_char_ms`` per character typed by ``input text``. ``ime`` is
+    reported as the active input method. Every invocation is appended to ``commands.log`` and every
+    on-device input command to ``input.log`` in the yielded directory.
+    """
+    with tempfile.TemporaryDirectory(prefix="fake_adb_") as directory:
+        with open(os.path.join(directory, "screen.png"), 'wb') as f:
+            f.write(png)
+        with open(os.path.join(directory, "window_dump.xml"), 'w', encoding='utf-8') as f:
+            f.write(ui_xml)
+        with open(os.path.join(directory, "device.sh"), 'w', encoding='utf-8') as f:
+            f.write(_FAKE_DEVICE.format(directory=directory, ime=ime, command_us=round(command_ms * 1000),
+                                        char_us=round(text_char_ms * 1000)))
+        script = os.path.join(directory, "adb")
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write(_FAKE_ADB.format(width=width, height=height, activity=activity))
+        os.chmod(script, 0o755)
+        original_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = directory + os.pathsep + original_path
+        try:
+            yield directory
+        finally:
+            os.environ["PATH"] = original_path
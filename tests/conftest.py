@@ -0,0 +1,35 @@
+import pytest
+from model_client import ScriptedClient
+from simulator import ScreenGraph, SimulatedDevice, tap_next_policy
+
+
+@pytest.fixture
+def graph():
+    return ScreenGraph.generate(6)
+
+
+@pytest.fixture
+def make_agent():
+    """Build a PhoneMirroringAgent with a scripted model (``tap_next_policy`` by default) on a simulated device."""
+    from agent import PhoneMirroringAgent
+
+    def make(graph, policy=tap_next_policy, device=None, time_scale=0, **options):
+        client = policy if hasattr(policy, "create_message") else ScriptedClient(policy)
+        device = device or SimulatedDevice(graph, time_scale=time_scale, seed=0)
+        agent = PhoneMirroringAgent(None, "scripted", 1024, 0.0, 200, client=client, device=device, **options)
+        agent.task_description = "Go through the setup flow"
+        return agent
+    return make
+
+
+@pytest.fixture
+def run_task():
+    """Run an agent's task to the end; returns the success flag passed to ``task_completed`` (None if never called)."""
+    def run(agent):
+        result = {}
+        try:
+            agent.run(lambda success, reason: result.update(success=success), lambda status: None)
+        finally:
+            agent.scheduler.shutdown()
+        return result.get("success")
+    return run
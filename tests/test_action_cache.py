@@ -0,0 +1,49 @@
+import pytest
+from action_cache import ActionCache, GLOBAL_INTENT, cache_signature
+
+DIALOG = ("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">"
+          "<node text=\"Allow Maps to access this device's location?\" resource-id=\"com.android.permissioncontroller:id/"
+          "permission_message\" class=\"android.widget.TextView\" package=\"com.android.permissioncontroller\" "
+          "content-desc=\"\" clickable=\"false\" enabled=\"true\" bounds=\"[100,900][980,1000]\" />"
+          "<node text=\"While using the app\" resource-id=\"com.android.permissioncontroller:id/"
+          "permission_allow_foreground_only_button\" class=\"android.widget.Button\" "
+          "package=\"com.android.permissioncontroller\" content-desc=\"\" clickable=\"true\" enabled=\"true\" "
+          "bounds=\"[100,1100][980,1200]\" /></hierarchy>")
+ALLOW = [{"name": "tap", "input": {"x": 540, "y": 1150}}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ActionCache(str(tmp_path / "cache.sqlite3"), max_entries=3, promote_after=2)
+    yield cache
+    cache.close()
+
+
+def test_entry_is_per_intent_until_promoted(cache):
+    signature = cache_signature(DIALOG)
+    cache.store(signature, ALLOW, "open maps")
+    assert cache.lookup(signature, "open maps") == ALLOW
+    assert cache.lookup(signature, "order food") is None
+    cache.store(signature, ALLOW, "find a cafe")
+    assert cache.lookup(signature, "order food") == ALLOW
+    assert cache.lookup(signature, GLOBAL_INTENT) == ALLOW
+
+
+def test_disagreeing_intents_are_not_promoted(cache):
+    signature = cache_signature(DIALOG)
+    cache.store(signature, ALLOW, "open maps")
+    cache.store(signature, [{"name": "tap", "input": {"x": 540, "y": 1300}}], "find a cafe")
+    assert cache.lookup(signature, "order food") is None
+
+
+def test_text_and_activity_are_part_of_the_key():
+    assert cache_signature(DIALOG) != cache_signature(DIALOG.replace("Maps", "Camera"))
+    assert cache_signature(DIALOG) != cache_signature(DIALOG, "com.example/.Main")
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for index in range(4):
+        cache.store(f"screen {index}", ALLOW, "task")
+    assert cache.stats()["entries"] == 3
+    assert cache.lookup("screen 0", "task") is None
+    assert cache.lookup("screen 3", "task") == ALLOW
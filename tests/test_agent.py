@@ -0,0 +1,58 @@
+from action_cache import ActionCache
+from actions import RejectedAction
+from model_client import ScriptedClient
+from simulator import SimulatedDevice, tap_next_policy
+
+
+def give_up_at_last_screen(params):
+    turn = tap_next_policy(params)
+    if turn[0][0] == "done":
+        return [("done", {"status": "failed", "reason": "Gave up"})]
+    return turn
+
+
+def test_failed_task_leaves_the_action_cache_empty(tmp_path, graph, make_agent, run_task):
+    cache = ActionCache(str(tmp_path / "cache.sqlite3"))
+    assert run_task(make_agent(graph, give_up_at_last_screen, action_cache=cache)) is False
+    assert cache.stats()["entries"] == 0
+
+
+def test_completed_tasks_fill_and_promote_the_action_cache(tmp_path, graph, make_agent, run_task):
+    cache = ActionCache(str(tmp_path / "cache.sqlite3"), promote_after=2)
+    for task in ("Finish setup", "Finish onboarding"):
+        agent = make_agent(graph, action_cache=cache)
+        agent.task_description = task
+        assert run_task(agent) is True
+    screens = len(graph.states) - 1
+    assert cache.stats()["entries"] == 3 * screens
+
+    # A third task is resolved from the promoted entries; the model only sees the last screen
+    client = ScriptedClient(tap_next_policy)
+    agent = make_agent(graph, client, action_cache=cache)
+    agent.task_description = "Finish the tour"
+    assert run_task(agent) is True
+    assert client.calls == 1
+    assert agent.device.action_count == screens
+
+
+def test_rejected_action_is_an_error_result_and_the_task_goes_on(graph, make_agent, run_task):
+    device = SimulatedDevice(graph, time_scale=0, seed=0)
+    execute_batch = device.execute_batch
+
+    def rejecting_batch(actions):
+        results = execute_batch([action for action in actions if action[0] != "input_text"])
+        return [RejectedAction("input_text was not executed") if name == "input_text" else results.pop(0)
+                for name, _, _ in actions]
+
+    device.execute_batch = rejecting_batch
+    results = []
+
+    def type_then_tap(params):
+        if len(params["messages"]) == 1:
+            return [("input_text", {"text": "héllo"})] + tap_next_policy(params)
+        if len(params["messages"]) == 3:
+            results.extend(block for block in params["messages"][-1]["content"] if block.get("type") == "tool_result")
+        return tap_next_policy(params)
+
+    assert run_task(make_agent(graph, type_then_tap, device=device)) is True
+    assert [result.get("is_error", False) for result in results] == [True, False]
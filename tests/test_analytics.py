@@ -0,0 +1,47 @@
+import os
+import json
+from analytics import analyze, find_runs, summarize_run
+from simulator import tap_next_policy
+
+
+def record(make_agent, run_task, graph, run_dir, task, stuck):
+    retries = []
+
+    def policy(params):
+        # A dead tap repeated on an unchanged screen
+        if stuck and len(retries) < 3:
+            retries.append(1)
+            return [("tap", {"x": 20, "y": 20})]
+        return tap_next_policy(params)
+
+    agent = make_agent(graph, policy, journal_dir=run_dir)
+    agent.task_description = task
+    run_task(agent)
+
+
+def test_report_finds_retry_hotspots(tmp_path, make_agent, run_task, graph):
+    runs = [(f"Finish setup for account {index}", index < 2) for index in range(4)]
+    for index, (task, stuck) in enumerate(runs):
+        record(make_agent, run_task, graph, str(tmp_path / "runs" / f"run_{index}"), task, stuck)
+    paths = list(find_runs(str(tmp_path / "runs")))
+    assert len(paths) == len(runs)
+    report = analyze(map(summarize_run, paths))
+    assert report["totals"]["runs"] == len(runs)
+    assert report["totals"]["repeated_tap_streaks"] == sum(stuck for _, stuck in runs)
+    # Account numbers differ, but it is one task type
+    assert len(report["tasks"]) == 1
+    assert next(iter(report["tasks"].values()))["success_rate"] == 1.0
+    assert not report["errors"]
+
+
+def test_export_is_summarized(tmp_path):
+    export_dir = tmp_path / "export"
+    os.makedirs(export_dir)
+    with open(export_dir / "conversation.json", 'w', encoding='utf-8') as f:
+        json.dump([{"role": "user", "content": [{"type": "text", "text": "Screenshot for the task: Open settings"}]},
+                   {"role": "assistant", "content": [{"type": "tool_use", "id": "t0", "name": "tap",
+                                                      "input": {"x": 1, "y": 2}}]}], f)
+    summary = summarize_run(str(export_dir))
+    assert summary["source"] == "export"
+    assert summary["task"] == "Open settings"
+    assert summary["model_calls"] == 1
@@ -0,0 +1,47 @@
+import base64
+from anthropic.types import MessageParam, TextBlockParam
+from conversation_store import BlobTable, ConversationStore
+
+
+def screen_message(store, png, step):
+    return MessageParam(role="user", content=[TextBlockParam(type="text", text=f"Screenshot for step {step}"),
+                                              store.image_block(png)])
+
+
+def test_identical_screenshots_are_stored_once():
+    store = ConversationStore()
+    pngs = [b"screen-a" * 100, b"screen-b" * 100]
+    for step in range(10):
+        # Fresh bytes objects, like a real capture
+        store.append(screen_message(store, bytes(bytearray(pngs[step % 2])), step))
+    assert len(store.blobs) == 2
+    assert store.blobs.total_bytes == sum(len(png) for png in pngs)
+
+
+def test_base64_images_are_compacted_into_blobs():
+    store = ConversationStore()
+    png = b"screen" * 50
+    store.append(MessageParam(role="user", content=[
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png",
+                                     "data": base64.b64encode(png).decode('utf-8')}}]))
+    block = store[0]["content"][0]
+    assert block["source"]["type"] == "blob"
+    assert store.image_bytes(block) == png
+
+
+def test_only_recent_screenshots_are_sent():
+    store = ConversationStore()
+    for step in range(5):
+        store.append(screen_message(store, f"screen {step}".encode(), step))
+    messages = store.to_api_messages(max_images=2)
+    sent = [base64.b64decode(block["source"]["data"]) for message in messages for block in message["content"]
+            if block["type"] == "image"]
+    assert sent == [b"screen 3", b"screen 4"]
+    assert messages[0]["content"][1] == {"type": "text", "text": "[Earlier screenshot omitted]"}
+
+
+def test_spilled_blobs_read_back(tmp_path):
+    blobs = BlobTable(spill_dir=str(tmp_path), max_resident_bytes=100)
+    keys = [blobs.put(bytes([index]) * 80) for index in range(3)]
+    assert blobs.resident_bytes <= 100
+    assert [blobs.get(key) for key in keys] == [bytes([index]) * 80 for index in range(3)]
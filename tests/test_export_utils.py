@@ -0,0 +1,42 @@
+import os
+import json
+import threading
+from anthropic.types import MessageParam, TextBlockParam
+from conversation_store import ConversationStore
+from export_utils import export_run
+from simulator import ScreenGraph
+
+
+def test_export_while_the_agent_appends(tmp_path):
+    pngs = [state.png for state in ScreenGraph.generate(3).states.values()]
+    store = ConversationStore()
+    steps = 20
+    for step in range(steps):
+        store.append(MessageParam(role="user", content=[TextBlockParam(type="text", text=f"Step {step}"),
+                                                        store.image_block(pngs[step % 2])]))
+        store.append(MessageParam(role="assistant", content=[
+            {"type": "tool_use", "id": f"toolu_{step}", "name": "tap", "input": {"x": 540, "y": 1200}}]))
+    running = threading.Event()
+    running.set()
+
+    def agent():
+        step = steps
+        while running.is_set():
+            store.append(MessageParam(role="user", content=[store.image_block(pngs[2] + step.to_bytes(4, 'big'))]))
+            store.append(MessageParam(role="assistant", content="ok"))
+            step += 1
+
+    thread = threading.Thread(target=agent)
+    thread.start()
+    try:
+        export_run(store, str(tmp_path), {"Model": "test", "Task Description": "Export test"})
+    finally:
+        running.clear()
+        thread.join()
+    with open(tmp_path / "conversation.json", 'r', encoding='utf-8') as f:
+        exported = json.load(f)
+    assert len(exported) >= 2 * steps
+    images = [block["source"]["path"] for message in exported if isinstance(message["content"], list)
+              for block in message["content"] if block.get("type") == "image"]
+    assert len(images) >= steps
+    assert all(os.path.exists(tmp_path / path) for path in images)
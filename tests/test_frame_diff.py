@@ -0,0 +1,39 @@
+import io
+import numpy as np
+from PIL import Image
+from frame_diff import FrameDiff
+from simulator import ScreenGraph
+
+
+def test_crops_rebuild_every_screen(graph):
+    states = list(graph.states.values())
+    frame_diff = FrameDiff(full_frame_every=len(states) + 1)
+    composite = None
+    for state in states:
+        regions = frame_diff.changes(state.png)
+        current = Image.open(io.BytesIO(state.png)).convert("RGB")
+        if regions is None:
+            composite = current.copy()
+        for bounds in regions or []:
+            composite.paste(Image.open(io.BytesIO(frame_diff.crop(bounds))), bounds[:2])
+        assert np.array_equal(np.asarray(composite), np.asarray(current))
+
+
+def test_unchanged_screen_has_no_regions(graph):
+    png = graph.states[graph.initial].png
+    frame_diff = FrameDiff(full_frame_every=10)
+    assert frame_diff.changes(png) is None
+    assert frame_diff.changes(png) == []
+
+
+def test_sending_only_changes_keeps_the_run_the_same(tmp_path, graph, make_agent, run_task):
+    full = make_agent(graph, full_frame_every=None)
+    assert run_task(full) is True
+    run_dir = str(tmp_path / "run")
+    diffed = make_agent(graph, full_frame_every=3, journal_dir=run_dir)
+    assert run_task(diffed) is True
+    assert diffed.device.action_count == full.device.action_count
+    # Turns that carried only crops, or no image, must still replay as whole screens
+    replayed = ScreenGraph.from_journal(run_dir)
+    assert len(replayed.states) == len(graph.states)
+    assert all(state.png == graph.states[name].png for name, state in replayed.states.items())
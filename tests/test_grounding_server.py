@@ -0,0 +1,40 @@
+import io
+import pytest
+from PIL import Image
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import grounding_server
+from grounding import decode_mask
+from grounding_server import GroundingService
+
+SEGMENT = "".join(f"<loc{value:04d}>" for value in (0, 0, 512, 512)) + "".join(f"<seg{i:03d}>" for i in range(16))
+
+
+@pytest.fixture
+def png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 100), (255, 255, 255)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_batch_is_parsed_per_task(monkeypatch, png):
+    outputs = {"detect button": "<loc0000><loc0000><loc0512><loc0512> button ; "
+                                "<loc0512><loc0512><loc1023><loc1023> button",
+               "segment icon": SEGMENT + " icon", "caption": "a settings screen"}
+    monkeypatch.setattr(grounding_server, "infer_batch",
+                        lambda images, prompts, *args: [outputs[prompt] for prompt in prompts])
+    service = GroundingService(None, None, None, max_wait_ms=50)
+    try:
+        futures = [service.submit(png, "detect", "button", 32), service.submit(png, "segment", "icon", 32),
+                   service.submit(png, "generate", "caption", 32)]
+        detected, segmented, generated = [future.result(5) for future in futures]
+    finally:
+        service.close()
+    assert detected == [{"xyxy": [0, 0, 100, 50], "mask": None, "name": "button"},
+                        {"xyxy": [100, 50, 200, 100], "mask": None, "name": "button"}]
+    assert segmented[0]["name"] == "icon"
+    assert decode_mask(segmented[0]["mask"]).shape == (50, 100)
+    assert generated == "a settings screen"
+    assert service.stats()["batches"] == 1
@@ -0,0 +1,73 @@
+import os
+from agent import PhoneMirroringAgent
+from analytics import summarize_journal
+from journal import JournalReader, latest_resumable_run
+from model_client import ScriptedClient
+from simulator import ScreenGraph, SimulatedDevice, tap_next_policy
+
+FAIL_AT = 4
+
+
+def interrupted_run(make_agent, run_task, graph, run_dir, operation):
+    """Run the flow until ``operation`` fails once at step FAIL_AT; returns the device, which keeps its state."""
+    device = SimulatedDevice(graph, time_scale=0, seed=0)
+    original = getattr(device, operation)
+    failed = []
+
+    def failing(*args):
+        if agent.step == FAIL_AT and not failed:
+            failed.append(1)
+            raise Exception("Simulated device disconnect")
+        return original(*args)
+
+    setattr(device, operation, failing)
+    agent = make_agent(graph, device=device, journal_dir=run_dir)
+    assert not run_task(agent)
+    setattr(device, operation, original)
+    return device
+
+
+def test_gave_up_run_is_not_offered(tmp_path, make_agent, run_task, graph):
+    agent = make_agent(graph, [[("done", {"status": "failed", "reason": "Gave up"})]],
+                       journal_dir=str(tmp_path / "gave_up"))
+    assert run_task(agent) is False
+    assert latest_resumable_run(str(tmp_path)) is None
+
+
+def check_resume(tmp_path, make_agent, run_task, operation):
+    graph = ScreenGraph.generate(8)
+    run_dir = str(tmp_path / operation)
+    device = interrupted_run(make_agent, run_task, graph, run_dir, operation)
+    assert latest_resumable_run(str(tmp_path)) == run_dir
+
+    client = ScriptedClient(tap_next_policy)
+    resumed = PhoneMirroringAgent.from_checkpoint(run_dir, None, client=client, device=device)
+    assert run_task(resumed) is True
+    assert device.state == list(graph.states)[-1]
+    # Resuming picks up at the failed step instead of replaying the flow
+    assert client.calls < len(graph.states)
+    assert latest_resumable_run(str(tmp_path)) is None
+
+    # The summary counts only the screens the resumed conversation kept
+    summary = summarize_journal(run_dir)
+    kept = sum(1 for message in JournalReader(run_dir).conversation().messages if message["role"] == "user")
+    assert summary["resumes"] == 1
+    assert summary["success"] is True
+    assert sum(summary["screen_calls"].values()) == kept
+
+
+def test_resume_after_lost_capture(tmp_path, make_agent, run_task):
+    check_resume(tmp_path, make_agent, run_task, "capture_png")
+
+
+def test_resume_after_failed_action(tmp_path, make_agent, run_task):
+    check_resume(tmp_path, make_agent, run_task, "execute_action")
+
+
+def test_journal_replays_as_screen_graph(tmp_path, make_agent, run_task, graph):
+    run_dir = str(tmp_path / "run")
+    assert run_task(make_agent(graph, journal_dir=run_dir)) is True
+    replayed = ScreenGraph.from_journal(run_dir)
+    assert len(replayed.states) == len(graph.states)
+    assert all(state.png == graph.states[name].png for name, state in replayed.states.items())
+    assert os.path.exists(os.path.join(run_dir, "journal.jsonl"))
@@ -0,0 +1,35 @@
+from anthropic.types import ToolUseBlock
+from macros import MacroRecorder, MacroPlayer
+
+
+def toggle_ui_xml(checked, label="Wi-Fi"):
+    """A settings screen with one switch row."""
+    return ("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">"
+            "<node text=\"\" resource-id=\"\" class=\"android.widget.FrameLayout\" package=\"com.android.settings\" "
+            "content-desc=\"\" clickable=\"false\" enabled=\"true\" bounds=\"[0,0][1080,2400]\">"
+            f"<node text=\"{label}\" resource-id=\"android:id/title\" class=\"android.widget.TextView\" "
+            "package=\"com.android.settings\" content-desc=\"\" clickable=\"false\" enabled=\"true\" "
+            "bounds=\"[60,400][700,480]\" />"
+            f"<node text=\"\" resource-id=\"android:id/switch_widget\" class=\"android.widget.Switch\" "
+            f"package=\"com.android.settings\" content-desc=\"\" checkable=\"true\" checked=\"{str(checked).lower()}\" "
+            "clickable=\"true\" enabled=\"true\" bounds=\"[880,400][1020,480]\" /></node></hierarchy>")
+
+
+def wifi_macro():
+    recorder = MacroRecorder("Turn on Wi-Fi")
+    recorder.record_step(toggle_ui_xml(False), [ToolUseBlock(type="tool_use", id="t0", name="tap",
+                                                             input={"x": 950, "y": 440})])
+    return recorder.build(toggle_ui_xml(True), "Wi-Fi is on")
+
+
+def test_replays_when_switch_is_off():
+    macro = wifi_macro()
+    assert MacroPlayer(macro).match(toggle_ui_xml(False)) is not None
+    assert MacroPlayer(macro).matches_final(toggle_ui_xml(True))
+
+
+def test_already_toggled_switch_is_not_replayed():
+    macro = wifi_macro()
+    assert MacroPlayer(macro).match(toggle_ui_xml(True)) is None
+    assert not MacroPlayer(macro).matches_final(toggle_ui_xml(False))
+
@@ -0,0 +1,66 @@
+import threading
+import urllib.request
+from metrics import AgentMetrics, MetricsRegistry, start_metrics_server
+from model_client import RoutedClient, ScriptedClient
+from simulator import SimulatedDevice
+
+
+def samples(text):
+    return {name: float(value) for name, value in
+            (line.rsplit(" ", 1) for line in text.splitlines() if line and not line.startswith("#"))}
+
+
+def test_updates_from_many_threads_are_all_counted():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "", ("device",))
+    threads = [threading.Thread(target=lambda index=index: [counter.inc(1, (f"device-{index % 2}",))
+                                                            for _ in range(5000)]) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.values() == {("device-0",): 20000, ("device-1",): 20000}
+
+
+def test_scrape_agrees_with_the_fleet(graph, make_agent, run_task):
+    registry = MetricsRegistry()
+    server = start_metrics_server(registry, port=0)
+    agents = [make_agent(graph, device=SimulatedDevice(graph, time_scale=0, seed=index),
+                         metrics=AgentMetrics(f"sim-{index}", registry)) for index in range(3)]
+    try:
+        fleet = [threading.Thread(target=run_task, args=(agent,)) for agent in agents]
+        for thread in fleet:
+            thread.start()
+        for thread in fleet:
+            thread.join()
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            text = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+    values = samples(text)
+    steps = sum(value for name, value in values.items() if name.startswith("agent_steps_total{"))
+    completed = sum(value for name, value in values.items()
+                    if name.startswith("agent_tasks_total{") and 'outcome="completed"' in name)
+    assert steps == sum(agent.device.action_count for agent in agents)
+    assert completed == len(agents)
+
+
+def test_provider_counters_follow_the_router():
+    registry = MetricsRegistry()
+    router = RoutedClient([("primary", ScriptedClient(["ok"], loop=True, error_rate=1.0)),
+                           ("secondary", ScriptedClient(["ok"], loop=True))], failure_threshold=1000)
+    metrics = AgentMetrics("sim-0", registry)
+    metrics.watch(None, router)
+    for index in range(5):
+        router.create_message(model="claude-3-5-sonnet-20241022", max_tokens=64,
+                              messages=[{"role": "user", "content": f"request {index}"}])
+    text = registry.render()
+    assert "# TYPE agent_model_provider_retries_total counter" in text
+    values = samples(text)
+    for stat in ("calls", "errors", "retries", "wins"):
+        for provider, stats in router.stats().items():
+            assert values[f'agent_model_provider_{stat}_total{{provider="{provider}"}}'] == stats[stat]
+    assert values['agent_model_provider_retries_total{provider="secondary"}'] == 5
+
+    metrics.watch(None)
+    assert "agent_model_provider_calls_total{" not in registry.render()
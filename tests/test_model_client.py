@@ -0,0 +1,87 @@
+import pytest
+from model_client import (AnthropicClient, BedrockClient, RoutedClient, ScriptedClient, ROUTING_ENV,
+                          client_from_environment)
+
+
+def request(client, index=0):
+    return client.create_message(model="claude-3-5-sonnet-20241022", max_tokens=64,
+                                 messages=[{"role": "user", "content": f"request {index}"}])
+
+
+def test_fails_over_to_the_next_provider():
+    router = RoutedClient([("primary", ScriptedClient(["ok"], loop=True, error_rate=1.0)),
+                           ("secondary", ScriptedClient(["ok"], loop=True))], failure_threshold=1000)
+    for index in range(5):
+        assert request(router, index).content[0].text == "ok"
+    stats = router.stats()
+    assert stats["primary"]["errors"] == 5
+    assert stats["secondary"]["retries"] == 5
+    assert stats["secondary"]["wins"] == 5
+
+
+def test_failing_provider_is_taken_out_of_rotation():
+    down = ScriptedClient(["ok"], loop=True, error_rate=1.0)
+    router = RoutedClient([("primary", down), ("secondary", ScriptedClient(["ok"], loop=True))],
+                          failure_threshold=3, cooldown=60)
+    for index in range(10):
+        request(router, index)
+    assert down.calls == 3
+
+
+def test_error_when_every_provider_fails():
+    router = RoutedClient([("primary", ScriptedClient(["ok"], loop=True, error_rate=1.0)),
+                           ("secondary", ScriptedClient(["ok"], loop=True, error_rate=1.0))])
+    with pytest.raises(Exception, match="Scripted server error"):
+        request(router)
+
+
+def test_slow_request_is_hedged():
+    slow = ScriptedClient(["ok"], loop=True, latency=0.01, stall_rate=1.0, stall_latency=0.5, seed=0)
+    router = RoutedClient([("primary", slow), ("secondary", ScriptedClient(["ok"], loop=True))], min_samples=0)
+    router.health["primary"].latencies.extend([0.01] * 20)
+    request(router)
+    stats = router.stats()
+    assert stats["secondary"]["hedges"] == 1
+    assert stats["secondary"]["wins"] == 1
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    for name in ("ANTHROPIC_API_KEY", "AWS_REGION", "CLOUD_ML_REGION", "ANTHROPIC_VERTEX_PROJECT_ID", ROUTING_ENV):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_single_provider_is_used_directly(environment):
+    environment.setenv("AWS_REGION", "us-east-1")
+    client = client_from_environment()
+    assert isinstance(client, BedrockClient)
+    assert client.client.max_retries == 2
+
+
+def test_several_providers_need_routing_turned_on(environment):
+    environment.setenv("AWS_REGION", "us-east-1")
+    client = client_from_environment("sk-test")
+    assert type(client) is AnthropicClient
+
+    environment.setenv(ROUTING_ENV, "failover")
+    router = client_from_environment("sk-test")
+    assert isinstance(router, RoutedClient)
+    assert [name for name, _ in router.providers] == ["anthropic", "bedrock"]
+    assert router.hedge_percentile is None
+    assert all(client.client.max_retries == 0 for _, client in router.providers)
+    assert client_from_environment("sk-test", routing="hedge").hedge_percentile == 0.95
+
+
+def test_unknown_routing_mode(environment):
+    with pytest.raises(ValueError):
+        client_from_environment("sk-test", routing="fastest")
+
+
+def test_no_hedges_without_hedging():
+    slow = ScriptedClient(["ok"], loop=True, stall_rate=1.0, stall_latency=0.05, seed=0)
+    router = RoutedClient([("primary", slow), ("secondary", ScriptedClient(["ok"], loop=True))],
+                          hedge_percentile=None, min_samples=0)
+    router.health["primary"].latencies.extend([0.001] * 20)
+    request(router)
+    assert router.stats()["secondary"]["calls"] == 0
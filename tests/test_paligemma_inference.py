@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from paligemma_inference import max_new_tokens_for, DEFAULT_MAX_NEW_TOKENS, TOKENS_PER_OBJECT, OBJECTS_PER_QUERY
+from vision_grounding import DEFAULT_QUERIES
+
+
+def test_budget_grows_with_the_number_of_queries():
+    text = " ; ".join(DEFAULT_QUERIES)
+    budget = max_new_tokens_for("detect", text, limit=True)
+    assert budget == TOKENS_PER_OBJECT["detect"] * OBJECTS_PER_QUERY * len(DEFAULT_QUERIES)
+    assert budget > max_new_tokens_for("detect", "button", limit=True)
+    # On CPU larger requests are capped; elsewhere they are used as given
+    assert max_new_tokens_for("detect", "button", 500, limit=True) == max_new_tokens_for("detect", "button", limit=True)
+    assert max_new_tokens_for("detect", "button", 500) == 500
+
+
+def test_default_budget_without_cpu_mode():
+    assert max_new_tokens_for("detect", "button") == DEFAULT_MAX_NEW_TOKENS
+    assert max_new_tokens_for("generate", "caption en") == DEFAULT_MAX_NEW_TOKENS
+    assert max_new_tokens_for("detect", " ; ".join(DEFAULT_QUERIES)) > DEFAULT_MAX_NEW_TOKENS
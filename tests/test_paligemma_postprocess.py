@@ -0,0 +1,61 @@
+import random
+import numpy as np
+from paligemma_postprocess import parse_segmentation, parse_outputs, parse_objects, decode_masks
+
+
+def make_output(objects, rng, mask_fraction=0.5):
+    """Synthetic detect/segment output in PaliGemma's location/segmentation token format."""
+    parts = []
+    for _ in range(objects):
+        y1, x1 = rng.randrange(0, 900), rng.randrange(0, 900)
+        y2, x2 = min(1023, y1 + rng.randrange(8, 120)), min(1023, x1 + rng.randrange(8, 120))
+        tokens = "".join(f"<loc{value:04d}>" for value in (y1, x1, y2, x2))
+        if rng.random() < mask_fraction:
+            tokens += "".join(f"<seg{rng.randrange(128):03d}>" for _ in range(16))
+        parts.append(f"{tokens} {rng.choice(['button', 'icon', 'text field', 'switch'])}")
+    return " ; ".join(parts)
+
+
+def test_batched_parse_matches_per_object_parse():
+    rng = random.Random(0)
+    sizes = [(540, 1200), (1080, 2400), (333, 777)]
+    outputs = [make_output(40, rng) for _ in sizes]
+    parsed = parse_outputs(outputs, sizes)
+    masks = decode_masks(parsed.seg, parsed.boxes)
+    for index, (output, size, objects) in enumerate(zip(outputs, sizes, parse_objects(outputs, sizes))):
+        expected = [obj for obj in parse_segmentation(output, *size) if "xyxy" in obj]
+        selected = parsed.select(index)
+        assert len(selected) == len(objects) == len(expected)
+        for i, obj, reference in zip(selected, objects, expected):
+            assert tuple(parsed.boxes[i]) == obj["xyxy"] == reference["xyxy"]
+            # The reference marks repeated labels with "'" and keeps trailing spaces; the label itself is the same
+            assert parsed.names[i] == obj["name"] == reference["name"].rstrip("'").strip()
+            assert parsed.has_mask[i] == (obj["mask"] is not None) == (reference["mask"] is not None)
+            if reference["mask"] is not None:
+                x1, y1, x2, y2 = reference["xyxy"]
+                assert np.array_equal(masks[i, :y2 - y1, :x2 - x1], reference["mask"])
+                assert np.array_equal(obj["mask"], reference["mask"])
+
+
+def test_repeated_labels_keep_their_name():
+    output = " ; ".join(f"<loc{top:04d}><loc0100><loc{top + 50:04d}><loc0200> button" for top in (100, 300, 500))
+    assert [obj["name"] for obj in parse_objects([output], [(1024, 1024)])[0]] == ["button"] * 3
+    assert [obj["name"] for obj in parse_segmentation(output, 1024, 1024)] == ["button ", "button '", "button"]
+
+
+def test_empty_output():
+    parsed = parse_outputs(["", "no objects here"], [(100, 100), (100, 100)])
+    assert len(parsed) == 0
+    assert decode_masks(parsed.seg, parsed.boxes).shape == (0, 0, 0)
+    assert parse_objects(["", "no objects here"], [(100, 100), (100, 100)]) == [[], []]
+
+
+def test_truncated_output_keeps_complete_objects():
+    complete = make_output(6, random.Random(1), mask_fraction=1.0)
+    expected = parse_objects([complete], [(540, 1200)])[0]
+    cut_in_mask = complete[:complete.rindex("<seg") - 3]
+    cut_in_location = complete + " ; <loc0100><loc02"
+    for output, count in ((cut_in_mask, 5), (cut_in_location, 6)):
+        objects = parse_objects([output], [(540, 1200)])[0]
+        assert [(obj["xyxy"], obj["name"]) for obj in objects] == [(obj["xyxy"], obj["name"]) for obj in expected[:count]]
+        assert all(np.array_equal(obj["mask"], other["mask"]) for obj, other in zip(objects, expected))
@@ -0,0 +1,86 @@
+import queue
+import threading
+import numpy as np
+from frame_grabber import FrameGrabber, encode_png
+from model_client import ScriptedClient
+from pipeline import StepScheduler
+from simulator import ScreenGraph, SimulatedDevice, tap_next_policy
+
+
+def test_refresh_never_overlaps_an_action(make_agent, run_task):
+    device = SimulatedDevice(ScreenGraph.generate(6), time_scale=0.05, seed=0)
+    dumps = []
+    dump_ui_xml = device.dump_ui_xml
+
+    def counted_dump():
+        dumps.append(1)
+        return dump_ui_xml()
+
+    device.dump_ui_xml = counted_dump
+    agent = make_agent(device.graph, ScriptedClient(tap_next_policy, latency=0.1, jitter=0.025, seed=0), device=device)
+    steps = []
+    record_step = agent.record_step
+
+    def timed_record_step(response, timings):
+        steps.append(timings)
+        record_step(response, timings)
+
+    agent.record_step = timed_record_step
+    assert run_task(agent) is True
+
+    stages = [stage for timings in steps for stage in timings.stages]
+    refreshes = [(start, end) for name, start, end in stages if name == "refresh"]
+    actions = [(start, end) for name, start, end in stages if name == "action"]
+    assert not [refresh for refresh in refreshes for action in actions
+                if refresh[0] < action[1] and action[0] < refresh[1]]
+    # The UI is dumped once per step, when the action is dispatched
+    assert len(dumps) <= len(steps) + 1
+
+
+class QueueSource:
+    def __init__(self):
+        self.frames = queue.Queue()
+
+    def open(self):
+        pass
+
+    def read(self):
+        return self.frames.get()
+
+    def close(self):
+        self.frames.put(np.zeros((4, 4, 3), dtype=np.uint8))
+
+
+def grabbing_scheduler(frame):
+    device = SimulatedDevice(ScreenGraph.generate(3), time_scale=0, seed=0)
+    source = QueueSource()
+    grabber = FrameGrabber(source, max_fps=None).start()
+    source.frames.put(frame)
+    grabber.wait_for_frame(0, 5.0)
+    return StepScheduler(settle_timeout=0.3, settle_interval=0.05, frame_grabber=grabber, device=device), source
+
+
+def test_frames_grabbed_before_the_action_are_not_used():
+    stale = np.full((4, 4, 3), 10, dtype=np.uint8)
+    scheduler, _ = grabbing_scheduler(stale)
+    try:
+        assert scheduler._capture_png() == encode_png(stale)
+        scheduler.action_sent()
+        # Nothing grabbed since the action, so both fall back to the device
+        assert scheduler._capture_png() == scheduler.device.capture_png()
+        assert scheduler.observe().png == scheduler.device.capture_png()
+    finally:
+        scheduler.frame_grabber.stop()
+        scheduler.shutdown()
+
+
+def test_observe_waits_for_a_frame_grabbed_after_the_action():
+    scheduler, source = grabbing_scheduler(np.full((4, 4, 3), 10, dtype=np.uint8))
+    fresh = np.full((4, 4, 3), 200, dtype=np.uint8)
+    try:
+        scheduler.action_sent()
+        threading.Timer(0.05, source.frames.put, (fresh,)).start()
+        assert scheduler.observe().png == encode_png(fresh)
+    finally:
+        scheduler.frame_grabber.stop()
+        scheduler.shutdown()
@@ -0,0 +1,91 @@
+import os
+import base64
+import shlex
+import pytest
+from actions import execute_action, execute_batch, RejectedAction, TEXT_ENTRY
+from simulator import ScreenGraph, fake_adb
+from text_entry import ADB_KEYBOARD_IME, input_text_commands, broadcast_command
+
+AWKWARD = 'it\'s "quoted" $HOME a;b&c|d (x) `tick` 100% %s\nline two\ttab'
+
+
+def typed_text(input_log):
+    """Reconstruct what the device would have typed from a fake_adb input.log."""
+    keys = {"KEYCODE_ENTER": "\n", "KEYCODE_TAB": "\t"}
+    typed = []
+    for line in input_log.splitlines():
+        fields = line.split("\t")
+        if fields[:2] == ["input", "text"]:
+            typed.append(fields[2].replace("%s", " "))
+        elif fields[:2] == ["input", "keyevent"]:
+            typed.append(keys.get(fields[2], ""))
+        elif fields[0] == "am" and "ADB_INPUT_B64" in fields:
+            typed.append(base64.b64decode(fields[-1]).decode('utf-8'))
+    return "".join(typed)
+
+
+def test_input_text_commands_escape_for_the_device_shell():
+    commands = input_text_commands("a b'c\nd")
+    assert commands == [f"input text {shlex.quote('a%sb' + chr(39) + 'c')}", "input keyevent KEYCODE_ENTER",
+                        "input text d"]
+
+
+def test_literal_percent_s_is_split():
+    typed = "".join(shlex.split(command)[2].replace("%s", " ") for command in input_text_commands("100%sure"))
+    assert typed == "100%sure"
+
+
+def test_long_text_is_chunked():
+    commands = input_text_commands("x" * 25, chunk_size=10)
+    assert [len(shlex.split(command)[2]) for command in commands] == [10, 10, 5]
+
+
+def test_non_ascii_needs_the_ime():
+    with pytest.raises(ValueError):
+        input_text_commands("héllo")
+    assert broadcast_command("héllo").startswith("am broadcast -a ADB_INPUT_B64")
+
+
+@pytest.fixture(params=[("com.android.inputmethod.latin/.LatinIME", AWKWARD),
+                        (ADB_KEYBOARD_IME, AWKWARD + " héllo wörld ✓")], ids=["chunked", "broadcast"])
+def device(request):
+    ime, sample = request.param
+    state = ScreenGraph.generate(2).states["screen_0"]
+    with fake_adb(state.png, state.ui_xml, ime=ime) as directory:
+        TEXT_ENTRY._ime = None
+        yield os.path.join(directory, "input.log"), sample
+    TEXT_ENTRY._ime = None
+
+
+def test_text_arrives_intact(device):
+    log_path, sample = device
+    execute_action("input_text", {"text": sample})
+    with open(log_path, encoding='utf-8') as f:
+        assert typed_text(f.read()) == sample
+
+
+def test_text_entry_in_a_batch(device):
+    # Form fill as one batch: text entry between other input must not fail the batch
+    log_path, sample = device
+    execute_batch([("tap", {"x": 540, "y": 1200}, 0), ("input_text", {"text": sample}, 0),
+                   ("press_key", {"key": "enter"}, 0)])
+    with open(log_path, encoding='utf-8') as f:
+        assert typed_text(f.read()) == sample + "\n"
+
+
+def test_non_ascii_without_the_ime_rejects_only_that_action():
+    state = ScreenGraph.generate(2).states["screen_0"]
+    with fake_adb(state.png, state.ui_xml, ime="com.android.inputmethod.latin/.LatinIME") as directory:
+        TEXT_ENTRY._ime = None
+        try:
+            assert isinstance(execute_action("input_text", {"text": "héllo"}), RejectedAction)
+            results = execute_batch([("tap", {"x": 540, "y": 1200}, 0), ("input_text", {"text": "héllo"}, 0),
+                                     ("press_key", {"key": "enter"}, 0)])
+        finally:
+            TEXT_ENTRY._ime = None
+        with open(os.path.join(directory, "input.log"), encoding='utf-8') as f:
+            log = f.read()
+    assert [isinstance(result, RejectedAction) for result in results] == [False, True, False]
+    assert "ASCII" in results[1]
+    assert typed_text(log) == "\n"
+    assert "input\ttap\t540\t1200" in log
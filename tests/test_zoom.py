@@ -0,0 +1,67 @@
+import re
+from screen import png_size
+from simulator import ScreenGraph, tap_next_policy
+from ui_tree import parse_ui_xml
+from zoom import crop_region, describe_crop
+
+
+def ui_blocks(message):
+    return [block for block in message["content"] if block.get("type") == "text"
+            and block["text"].startswith("UI XML Structure:\n")]
+
+
+def zoom_then_tap_policy(params):
+    """Zoom into the Next button of every new screen before tapping it."""
+    last = params["messages"][-1]
+    blocks = ui_blocks(last)
+    if not blocks:
+        # The answer to a zoom carries no new screenshot; act on the screen zoomed into
+        screen = next(message for message in reversed(params["messages"]) if message["role"] == "user"
+                      and ui_blocks(message))
+        return tap_next_policy({"messages": [screen]})
+    for element in parse_ui_xml(blocks[0]["text"][len("UI XML Structure:\n"):]):
+        if element.text == "Next":
+            left, top, right, bottom = element.bounds
+            return [("zoom", {"x": left, "y": top, "width": right - left, "height": bottom - top})]
+    return tap_next_policy(params)
+
+
+def test_crop_coordinates_map_back_to_the_screen(graph):
+    state = graph.states[graph.initial]
+    button = next(element for element in parse_ui_xml(state.ui_xml) if element.text == "Next")
+    png, bounds, scale = crop_region(state.png, button.bounds[0] - 100, button.bounds[1] - 100, 2000, 2000)
+    u, v = (button.center[0] - bounds[0]) * scale, (button.center[1] - bounds[1]) * scale
+    numbers = [float(value) for value in re.findall(r"\d+(?:\.\d+)?", describe_crop(bounds, scale).split("; ", 1)[1])]
+    mapped = (numbers[0] + u / numbers[1], numbers[2] + v / numbers[3])
+    assert abs(mapped[0] - button.center[0]) <= 1
+    assert abs(mapped[1] - button.center[1]) <= 1
+
+
+def test_overview_with_zoom_keeps_the_run_the_same(tmp_path, graph, make_agent, run_task):
+    full = make_agent(graph, full_frame_every=None)
+    assert run_task(full) is True
+    run_dir = str(tmp_path / "run")
+    zoomed = make_agent(graph, zoom_then_tap_policy, overview_long_side=800, full_frame_every=None,
+                        journal_dir=run_dir)
+    assert run_task(zoomed) is True
+    assert zoomed.device.action_count == full.device.action_count
+    assert zoomed.client.calls > full.client.calls
+    # Replaying the run must rebuild screens at the device's resolution, not the overview's
+    replayed = ScreenGraph.from_journal(run_dir)
+    assert len(replayed.states) == len(graph.states)
+    assert all(png_size(state.png) == png_size(graph.states[name].png) for name, state in replayed.states.items())
+
+
+def test_invalid_zoom_is_reported_to_the_model(graph, make_agent, run_task):
+    results = []
+
+    def bad_zoom_then_tap_policy(params):
+        if len(params["messages"]) == 1:
+            return [("zoom", {"x": "left", "y": 0, "width": 100, "height": 100})]
+        results.extend(block for block in params["messages"][-1]["content"] if block.get("type") == "tool_result")
+        return zoom_then_tap_policy(params)
+
+    agent = make_agent(graph, bad_zoom_then_tap_policy)
+    assert run_task(agent) is True
+    assert results[0]["is_error"] is True
+    assert "Invalid zoom region" in results[0]["content"][0]["text"]
@@ -0,0 +1,110 @@
+import re
+import time
+import shlex
+import base64
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# https://github.com/senzhk/ADBKeyBoard: types a whole string per broadcast, including non-ASCII
+ADB_KEYBOARD_IME = "com.android.adbkeyboard/.AdbIME"
+# Very long `input text` arguments lose characters on some devices; chunks still go in one adb call
+INPUT_TEXT_CHUNK_SIZE = 250
+IME_CHECK_TTL = 60.0
+
+_CONTROL_KEYS = {"\n": "KEYCODE_ENTER", "\t": "KEYCODE_TAB"}
+# What `am broadcast` prints on success; the receiver's result code carries no error for ADB Keyboard
+_BROADCAST_OUTPUT = re.compile(r"^(Broadcasting: Intent \{.*\}|Broadcast completed: result=-?\d+.*)$")
+
+
+def _segments(text):
+    # `input text` reads "%s" as a space, so a literal "%s" is typed as "%" and "s" in separate commands
+    start = 0
+    while True:
+        index = text.find("%s", start)
+        if index < 0:
+            yield text[start:]
+            return
+        yield text[start:index + 1]
+        start = index + 1
+
+
+def input_text_commands(text, chunk_size=INPUT_TEXT_CHUNK_SIZE):
+    """Shell commands that type ``text`` with ``input text``, quoted for the device shell.
+
+    Spaces are sent as %s, newlines and tabs as key events, and long runs are split into chunks.
+    Only ASCII can be typed this way.
+    """
+    if not text.isascii():
+        raise ValueError("input text can only type ASCII; enable the ADB Keyboard IME for other characters")
+    commands = []
+    line = []
+    for char in text + "\0":
+        if char not in _CONTROL_KEYS and char != "\0":
+            line.append(char)
+            continue
+        for segment in _segments("".join(line)):
+            for start in range(0, len(segment), chunk_size):
+                chunk = segment[start:start + chunk_size].replace(" ", "%s")
+                commands.append(f"input text {shlex.quote(chunk)}")
+        line = []
+        if char in _CONTROL_KEYS:
+            commands.append(f"input keyevent {_CONTROL_KEYS[char]}")
+    return commands
+
+
+def broadcast_command(text):
+    """Type ``text`` in one step through the ADB Keyboard IME; base64 keeps quoting and encoding out of the way."""
+    encoded = base64.b64encode(text.encode('utf-8')).decode('ascii')
+    return f"am broadcast -a ADB_INPUT_B64 --es msg {encoded}"
+
+
+def is_broadcast_output(line):
+    """Whether ``line`` is the normal output of the broadcast sent by ``broadcast_command``."""
+    return bool(_BROADCAST_OUTPUT.match(line.strip()))
+
+
+class TextEntry:
+    """Chooses how ``input_text`` reaches the device.
+
+    When the ADB Keyboard IME is the active input method the whole string is delivered with one
+    broadcast; otherwise it falls back to escaped, chunked ``input text`` commands. The active IME is
+    checked with one adb call and remembered for ``ttl`` seconds.
+    """
+
+    def __init__(self, fast_path=True, chunk_size=INPUT_TEXT_CHUNK_SIZE, ttl=IME_CHECK_TTL):
+        self.fast_path = fast_path
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self._ime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def ime_active(self):
+        if not self.fast_path:
+            return False
+        with self._lock:
+            if self._ime is None or time.monotonic() - self._checked_at > self.ttl:
+                try:
+                    output = subprocess.check_output(['adb', 'shell', 'settings get secure default_input_method'],
+                                                     text=True, timeout=10)
+                    self._ime = output.strip()
+                except Exception as e:
+                    logger.debug(f"Could not read the active input method: {str(e)}")
+                    self._ime = ""
+                self._checked_at = time.monotonic()
+                logger.debug(f"Active input method: {self._ime or 'unknown'}")
+            return self._ime == ADB_KEYBOARD_IME
+
+    def commands(self, text, fast=None):
+        if fast is None:
+            fast = self.ime_active()
+        if fast:
+            return [broadcast_command(text)]
+        return input_text_commands(text, self.chunk_size)
+
+    def script(self, text, fast=None):
+        """One shell line that types ``text`` and stops at the first failing command."""
+        return " && ".join(self.commands(text, fast)) or "true"
@@ -0,0 +1,145 @@
+import re
+import hashlib
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+_BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+class UIElement:
+    __slots__ = ("cls", "resource_id", "text", "content_desc", "package", "bounds",
+                 "clickable", "enabled", "checked", "selected", "scrollable", "focused", "source")
+
+    def __init__(self, cls="", resource_id="", text="", content_desc="", package="", bounds=(0, 0, 0, 0),
+                 clickable=False, enabled=True, checked=False, selected=False, scrollable=False, focused=False,
+                 source="xml"):
+        self.cls = cls
+        self.resource_id = resource_id
+        self.text = text
+        self.content_desc = content_desc
+        self.package = package
+        self.bounds = bounds
+        self.clickable = clickable
+        self.enabled = enabled
+        self.checked = checked
+        self.selected = selected
+        self.scrollable = scrollable
+        self.focused = focused
+        self.source = source
+
+    @property
+    def center(self):
+        left, top, right, bottom = self.bounds
+        return (left + right) // 2, (top + bottom) // 2
+
+    @property
+    def area(self):
+        left, top, right, bottom = self.bounds
+        return max(0, right - left) * max(0, bottom - top)
+
+    def contains(self, x, y):
+        left, top, right, bottom = self.bounds
+        return left <= x < right and top <= y < bottom
+
+    def descriptor(self):
+        # The state is part of what an action targets: tapping a switch that is already on turns it off
+        return {"class": self.cls, "resource_id": self.resource_id, "text": self.text,
+                "content_desc": self.content_desc, "checked": self.checked, "selected": self.selected}
+
+    def format(self, index):
+        parts = [f"[{index}]", self.cls.rsplit('.', 1)[-1] or "Element"]
+        if self.text:
+            parts.append(f'"{self.text}"')
+        if self.content_desc:
+            parts.append(f'desc="{self.content_desc}"')
+        if self.resource_id:
+            parts.append(f"id={self.resource_id.rsplit('/', 1)[-1]}")
+        left, top, right, bottom = self.bounds
+        parts.append(f"center={self.center[0]},{self.center[1]}")
+        parts.append(f"bounds=[{left},{top}][{right},{bottom}]")
+        flags = [name for name, value in (("clickable", self.clickable), ("scrollable", self.scrollable),
+                                          ("checked", self.checked), ("selected", self.selected),
+                                          ("focused", self.focused),
+                                          ("disabled", not self.enabled)) if value]
+        if self.source != "xml":
+            flags.append(f"source={self.source}")
+        parts.extend(flags)
+        return " ".join(parts)
+
+
+def parse_bounds(value):
+    match = _BOUNDS_RE.match(value or "")
+    if not match:
+        return 0, 0, 0, 0
+    return tuple(int(v) for v in match.groups())
+
+
+def parse_ui_xml(ui_xml):
+    """Return the meaningful nodes of a uiautomator dump: labelled, identified or interactive ones."""
+    if not ui_xml:
+        return []
+    try:
+        root = ET.fromstring(ui_xml)
+    except ET.ParseError as e:
+        logger.warning(f"Could not parse UI XML: {str(e)}")
+        return []
+    elements = []
+    for node in root.iter('node'):
+        attrib = node.attrib
+        clickable = attrib.get('clickable') == 'true' or attrib.get('long-clickable') == 'true'
+        scrollable = attrib.get('scrollable') == 'true'
+        text = attrib.get('text', '')
+        content_desc = attrib.get('content-desc', '')
+        resource_id = attrib.get('resource-id', '')
+        if not (text or content_desc or resource_id or clickable or scrollable):
+            continue
+        elements.append(UIElement(
+            cls=attrib.get('class', ''),
+            resource_id=resource_id,
+            text=text,
+            content_desc=content_desc,
+            package=attrib.get('package', ''),
+            bounds=parse_bounds(attrib.get('bounds')),
+            clickable=clickable,
+            enabled=attrib.get('enabled', 'true') == 'true',
+            checked=attrib.get('checked') == 'true',
+            selected=attrib.get('selected') == 'true',
+            scrollable=scrollable,
+            focused=attrib.get('focused') == 'true'
+        ))
+    return elements
+
+
+def format_elements(elements):
+    return "\n".join(element.format(index) for index, element in enumerate(elements))
+
+
+def element_at(elements, x, y):
+    # The smallest element under the point is the one that receives the touch
+    candidates = [element for element in elements if element.contains(x, y)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda element: element.area)
+
+
+def screen_signature(ui_xml=None, elements=None, include_text=False, mask_digits=True, include_state=False):
+    """Hash of the screen's structure: classes, ids, descriptions, packages and interactive flags.
+
+    Text and bounds are left out so clocks, counters and small layout shifts don't change the signature.
+    With ``include_text`` the text is hashed too, with digits masked for the same reason unless
+    ``mask_digits`` is off. ``include_state`` adds checked and selected, for callers that replay actions.
+    """
+    if elements is None:
+        elements = parse_ui_xml(ui_xml)
+    digest = hashlib.sha1()
+    for element in elements:
+        text = element.text if include_text else ""
+        if mask_digits:
+            text = _DIGITS_RE.sub('#', text)
+        state = f"|{int(element.checked)}{int(element.selected)}" if include_state else ""
+        digest.update(f"{element.package}|{element.cls}|{element.resource_id}|{element.content_desc}|"
+                      f"{int(element.clickable)}{int(element.scrollable)}|{text}{state}\n".encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,128 @@
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from ui_tree import UIElement, parse_ui_xml, format_elements
+from grounding import GroundingClient, DEFAULT_GROUNDING_URL, detection_boxes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = ("button", "text field", "icon", "link", "checkbox", "tab")
+# Fewer labelled or clickable nodes than this and the dump is treated as unusable
+MIN_NATIVE_ELEMENTS = 2
+
+
+def is_sparse(elements, min_elements=MIN_NATIVE_ELEMENTS):
+    """Whether a parsed UI dump has too little to act on, as with WebViews, games and Flutter surfaces.
+
+    Nodes with only a resource id don't count: those surfaces usually expose one identified container.
+    """
+    useful = [element for element in elements if element.text or element.content_desc or element.clickable]
+    return len(useful) < min_elements
+
+
+class PaliGemmaDetector:
+    """Runs detection in this process through paligemma_inference; the model is loaded on first use."""
+
+    def __init__(self, model_id=None, cpu=True, max_new_tokens=None):
+        self.model_id = model_id
+        self.cpu = cpu
+        self.max_new_tokens = max_new_tokens
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import paligemma_inference
+        if self._model is None:
+            if self.cpu:
+                self._model = paligemma_inference.load_cpu_model(self.model_id or paligemma_inference.CPU_MODEL_ID)
+            else:
+                self._model = paligemma_inference.load_model(self.model_id or paligemma_inference.DEFAULT_MODEL_ID)
+        return self._model
+
+    def __call__(self, png, queries):
+        import paligemma_inference
+        from PIL import Image
+
+        with self._lock:
+            model, processor, device = self._load()
+            image = Image.open(io.BytesIO(png)).convert("RGB")
+            text = " ; ".join(queries)
+            max_new_tokens = paligemma_inference.max_new_tokens_for("detect", text, self.max_new_tokens, self.cpu)
+            objects = paligemma_inference.process_image(image, text, "detect", model, processor, device,
+                                                        max_new_tokens)
+        return detection_boxes(objects)
+
+
+def server_detector(url=DEFAULT_GROUNDING_URL, socket_path=None, timeout=30.0):
+    """Detector backed by a running grounding_server.py."""
+    return GroundingClient(url, socket_path, timeout).element_boxes
+
+
+class VisionGrounder:
+    """Finds elements in the screenshot when the UI dump is too sparse to target anything.
+
+    ``detector(png, queries)`` returns dicts with ``name``, ``bounds`` and ``center``, like
+    ``GroundingClient.element_boxes`` or a PaliGemmaDetector. Results are cached per screenshot hash, so
+    retries on an unchanged screen don't run detection again. Native screens are never sent to the detector.
+    """
+
+    def __init__(self, detector, queries=DEFAULT_QUERIES, min_elements=MIN_NATIVE_ELEMENTS, cache_size=128):
+        self.detector = detector
+        self.queries = list(queries)
+        self.min_elements = min_elements
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.detections = 0
+        self.cache_hits = 0
+        self.failures = 0
+
+    def detect(self, png):
+        key = hashlib.sha1(png).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+        try:
+            boxes = self.detector(png, self.queries)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logger.warning(f"Element detection failed: {str(e)}")
+            return []
+        elements = [UIElement(cls=box["name"] or "element", bounds=tuple(box["bounds"]), clickable=True,
+                              source="vision")
+                    for box in boxes]
+        with self._lock:
+            self.detections += 1
+            self._cache[key] = elements
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        logger.info(f"Detected {len(elements)} elements on screen {key[:12]}")
+        return elements
+
+    def elements_for(self, png, ui_xml):
+        """Detected elements for a sparse screen, or None when the UI dump is good enough."""
+        if not png or not is_sparse(parse_ui_xml(ui_xml), self.min_elements):
+            return None
+        return self.detect(png)
+
+    def describe(self, png, ui_xml):
+        """Prompt text listing the detected elements one per line with ``format_elements``, or None.
+
+        It follows the raw UI XML in the prompt, so the header says how to read the lines.
+        """
+        elements = self.elements_for(png, ui_xml)
+        if not elements:
+            return None
+        return ("Detected elements (the UI XML has almost no usable nodes, so these were found in the screenshot; "
+                "one per line with its center and bounds in screen pixels; target their centers):\n"
+                + format_elements(elements))
+
+    def stats(self):
+        with self._lock:
+            return {"detections": self.detections, "cache_hits": self.cache_hits, "failures": self.failures,
+                    "cached_screens": len(self._cache)}
@@ -0,0 +1,57 @@
+import io
+import functools
+from PIL import Image
+from screen import png_size
+
+# Long side of the overview sent every turn; 800px keeps a phone screenshot near 400 image tokens
+OVERVIEW_LONG_SIDE = 800
+# Crops larger than this are scaled down so one zoom never costs more than a full screenshot
+ZOOM_LONG_SIDE = 1200
+MIN_ZOOM_SIZE = 32
+
+
+def _encode(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=8)
+def overview(png, long_side=OVERVIEW_LONG_SIDE):
+    """Downscaled copy of a screenshot and the scale applied; screenshots already small enough pass through."""
+    width, height = png_size(png)
+    if long_side is None or max(width, height) <= long_side:
+        return png, 1.0
+    scale = long_side / max(width, height)
+    image = Image.open(io.BytesIO(png))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return _encode(image.resize(size, Image.LANCZOS, reducing_gap=1.5)), scale
+
+
+def crop_region(png, x, y, width, height, long_side=ZOOM_LONG_SIDE):
+    """Crop a region given in screen pixels out of a captured screenshot.
+
+    The region is clamped to the screen and grown to at least MIN_ZOOM_SIZE. Returns the PNG, the
+    (left, top, right, bottom) bounds actually used and the scale of the crop relative to the screen.
+    """
+    screen_width, screen_height = png_size(png)
+    width = max(MIN_ZOOM_SIZE, min(int(width), screen_width))
+    height = max(MIN_ZOOM_SIZE, min(int(height), screen_height))
+    left = min(max(0, int(x)), screen_width - width)
+    top = min(max(0, int(y)), screen_height - height)
+    bounds = (left, top, left + width, top + height)
+    image = Image.open(io.BytesIO(png)).crop(bounds)
+    scale = min(1.0, long_side / max(width, height))
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    return _encode(image), bounds, scale
+
+
+def describe_crop(bounds, scale):
+    """Tells the model how to map a point in a zoomed image back to screen pixels."""
+    left, top, right, bottom = bounds
+    if scale == 1.0:
+        mapping = f"a point (u, v) in it is at screen pixel ({left} + u, {top} + v)"
+    else:
+        mapping = f"a point (u, v) in it is at screen pixel ({left} + u / {scale:.4g}, {top} + v / {scale:.4g})"
+    return f"Zoomed region [{left},{top}][{right},{bottom}] of the last screenshot; {mapping}."